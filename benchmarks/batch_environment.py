@@ -0,0 +1,96 @@
+"""
+Steps per second of the batched environment, and check that its games are the same as the scalar engine's.
+
+Usage: python -m benchmarks.batch_environment [--layout layouts/original.lay] [--steps 200]
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from libs import DIRECTIONS
+from libs.batch_environment import BatchEnvironment
+from libs.layouts import Layout
+from libs.pacman_controller import PacmanState
+
+
+def random_actions(environment: BatchEnvironment, generator: np.random.Generator) -> np.ndarray:
+    """
+    A random legal action for each game.
+    """
+    legal = environment.get_legal_actions_mask()
+    scores = np.where(legal, generator.random(legal.shape), -1)
+    return scores.argmax(axis=1)
+
+
+def check_parity(layout_content: str, games: int, seed: int, ghost_agent=None):
+    """
+    Play the first game of each slot with random actions, then replay the actions in PacmanState with the same seed
+    and compare positions and scores after every turn.
+    """
+    environment = BatchEnvironment(Layout(layout_content), games, seed=seed, ghost_agent=ghost_agent)
+    generator = np.random.default_rng(seed)
+    histories = [[] for _ in range(games)]
+    running = np.ones(games, dtype=bool)
+    while running.any():
+        actions = random_actions(environment, generator)
+        scores = environment.scores.copy()
+        rewards, dones, _ = environment.step(actions)
+        pacman = environment.get_pacman_coordinates()
+        ghosts = environment.get_ghost_coordinates()
+        for game in np.flatnonzero(running):
+            histories[game].append((
+                int(actions[game]),
+                tuple(int(value) for value in pacman[game]),
+                {name: tuple(int(value) for value in ghosts[name][game]) for name in ghosts},
+                int(scores[game] + rewards[game]),
+                bool(dones[game]),
+            ))
+        running &= ~dones
+
+    for game in range(games):
+        state = PacmanState(Layout(layout_content), pacman_agent='PacmanAgent', ghost_agent=ghost_agent, seed=seed + game)
+        for turn, (action, pacman, ghosts, score, done) in enumerate(histories[game]):
+            state.pacman.position.direction = DIRECTIONS[action]
+            over = state.update(keyboard_input=True)
+            if over != done or (done and state.score != score):
+                raise AssertionError(f'Game {game}, turn {turn}: game over {over} != {done} or {state.score} != {score}')
+            if done:
+                break
+            scalar_ghosts = {name: state.ghosts[name].position.coordinates for name in state.ghosts}
+            if state.pacman.position.coordinates != pacman or scalar_ghosts != ghosts or state.score != score:
+                raise AssertionError(
+                    f'Game {game}, turn {turn}: {state.pacman.position.coordinates} {scalar_ghosts} {state.score} '
+                    f'!= {pacman} {ghosts} {score}'
+                )
+
+
+def measure(layout_content: str, batch_size: int, steps: int) -> float:
+    environment = BatchEnvironment(Layout(layout_content), batch_size)
+    generator = np.random.default_rng(0)
+    start_time = time.perf_counter()
+    for _ in range(steps):
+        environment.step(random_actions(environment, generator))
+    return batch_size * steps / (time.perf_counter() - start_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure and check the batched environment')
+    parser.add_argument('-l', '--layout', default='layouts/original.lay', help='The layout to use')
+    parser.add_argument('--steps', type=int, default=200, help='Number of steps measured for each batch size')
+    parser.add_argument('--parity-games', type=int, default=64, help='Number of games compared with the scalar engine')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    with open(args.layout, 'r') as f:
+        layout_content = f.read()
+
+    for ghost_agent in (None, 'RandomGhostAgent'):
+        check_parity(layout_content, args.parity_games, seed=0, ghost_agent=ghost_agent)
+        print(f"{args.parity_games} games with {ghost_agent or 'the original ghosts'} identical to the scalar engine")
+    for batch_size in (1, 64, 1024, 4096):
+        print(f"Batch of {batch_size:>5}: {measure(layout_content, batch_size, args.steps):>10.0f} steps/s")
+
+
+if __name__ == '__main__':
+    main()
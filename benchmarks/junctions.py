@@ -0,0 +1,128 @@
+"""
+Size of the junction graph of each layout (see libs/junction_graph.py), and searches on it compared to searches on the
+cells, with the time and the expanded nodes per search:
+- paths between random pairs of cells, by A* on the graph and by HeapAStar on the cells,
+- the closest food from a random cell, with a few food left (the end of a game), by Dijkstra on the graph and by a
+  breadth-first search on the cells.
+The lengths found are checked against the navigation table of the layout. Generated mazes (see libs/maze_generator.py)
+are measured after the layouts of the repository, the graph saving more on their long corridors and dead ends.
+
+Usage: python -m benchmarks.junctions [--pairs 500] [--food 10] [--seed 0] [--mazes 41 81]
+"""
+import argparse
+import glob
+import logging
+import random
+import time
+from collections import deque
+from typing import Optional
+
+from benchmarks.pathfinding import get_world
+from libs import junction_graph  # noqa: F401, imported here so that the first build time doesn't include the import
+from libs.greedy_shortest_path import HeapAStar
+from libs.layouts import Layout, CellSet
+from libs.maze_generator import generate_layout
+
+
+def search_nearest_food(layout: Layout, position, food: CellSet):
+    """
+    Breadth-first search on the cells: distance to the closest food and number of cells expanded.
+    """
+    neighbours, cells = layout.navigation.neighbours, layout.cells
+    start = layout.cell_index[position]
+    distances = {start: 0}
+    queue = deque([start])
+    while queue:
+        cell = queue.popleft()
+        if cells[cell] in food:
+            return distances[cell], len(distances) - len(queue)
+        for direction in range(4):
+            neighbour = neighbours[cell * 4 + direction]
+            if neighbour != -1 and neighbour not in distances:
+                distances[neighbour] = distances[cell] + 1
+                queue.append(neighbour)
+    return None, len(distances)
+
+
+def benchmark_layout(path: str, pairs: int, food_count: int, seed: int, layout_content: Optional[str] = None):
+    if layout_content is None:
+        with open(path, 'r') as f:
+            layout_content = f.read()
+    layout = Layout(layout_content)
+    start_time = time.perf_counter()
+    graph = layout.get_junction_graph()
+    build_time = time.perf_counter() - start_time
+
+    rng = random.Random(seed)
+    queries = [(rng.choice(layout.cells), rng.choice(layout.cells)) for _ in range(pairs)]
+    # HeapAStar works on (row, column) positions
+    portals = [((entrance[1], entrance[0]), (exit[1], exit[0])) for entrance, exit in layout.portals.values() if exit]
+    engine = HeapAStar(get_world(layout), portals)
+    cell_expanded, cell_lengths = 0, []
+    start_time = time.perf_counter()
+    for start, target in queries:
+        path_found = engine.search((start[1], start[0]), (target[1], target[0]))
+        cell_lengths.append(None if path_found is None else len(path_found) - 1)
+        cell_expanded += engine.expanded
+    cell_time = time.perf_counter() - start_time
+
+    graph_expanded, graph_lengths = 0, []
+    start_time = time.perf_counter()
+    for start, target in queries:
+        graph_lengths.append(graph.get_distance(start, target))
+        graph_expanded += graph.expanded
+    graph_time = time.perf_counter() - start_time
+
+    for (start, target), cell_length, graph_length in zip(queries, cell_lengths, graph_lengths):
+        expected = layout.get_distance(start, target)
+        if cell_length != expected or graph_length != expected:
+            raise AssertionError(f'{path}: path lengths differ from {start} to {target}: navigation table {expected}, '
+                                 f'HeapAStar {cell_length}, junction graph {graph_length}')
+
+    food = CellSet(layout.food.width, layout.food.height, rng.sample(layout.cells, min(food_count, len(layout.cells))))
+    starts = [rng.choice(layout.cells) for _ in range(pairs)]
+    start_time = time.perf_counter()
+    breadth_first = [search_nearest_food(layout, start, food) for start in starts]
+    food_cell_time = time.perf_counter() - start_time
+    food_graph_expanded, food_graph = 0, []
+    start_time = time.perf_counter()
+    for start in starts:
+        nearest = graph.search_nearest_food(start, food)
+        food_graph.append(None if nearest is None else nearest[0])
+        food_graph_expanded += graph.expanded
+    food_graph_time = time.perf_counter() - start_time
+    for start, (expected, _), found in zip(starts, breadth_first, food_graph):
+        if found != expected:
+            raise AssertionError(f'{path}: distances to the closest food differ from {start}: {expected} != {found}')
+    food_cell_expanded = sum(expanded for _, expanded in breadth_first)
+    return (layout, graph, build_time, (cell_time, cell_expanded, graph_time, graph_expanded),
+            (food_cell_time, food_cell_expanded, food_graph_time, food_graph_expanded))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare path searches on the junction graph and on the cells')
+    parser.add_argument('--pairs', type=int, default=500, help='Number of random start and target pairs per layout')
+    parser.add_argument('--food', type=int, default=10, help='Number of food left for the closest food searches')
+    parser.add_argument('--seed', type=int, default=0, help='Seed used to draw the pairs and the food')
+    parser.add_argument('--mazes', type=int, nargs='*', default=[41, 81], help='Sizes of the generated mazes measured')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print(f"{'':<67}{' paths ':-^40}{' closest food ':-^40}")
+    print(f"{'layout':<32}{'cells':>7}{'nodes':>7}{'corridors':>11}{'build ms':>10}"
+          + f"{'cells us':>10}{'expanded':>10}{'graph us':>10}{'expanded':>10}" * 2)
+    layouts = [(path, None) for path in sorted(glob.glob('layouts/*.lay') + glob.glob('layouts/legacy/*.lay'))]
+    layouts += [(f'maze {size}x{size}', generate_layout(size, size, seed=args.seed)) for size in args.mazes]
+    for path, layout_content in layouts:
+        layout, graph, build_time, paths, food = benchmark_layout(path, args.pairs, args.food, args.seed, layout_content)
+        columns = ''.join(
+            f"{cell_time / args.pairs * 1e6:>10.1f}{cell_expanded / args.pairs:>10.1f}"
+            f"{graph_time / args.pairs * 1e6:>10.1f}{graph_expanded / args.pairs:>10.1f}"
+            for cell_time, cell_expanded, graph_time, graph_expanded in (paths, food)
+        )
+        print(f"{path:<32}{len(layout.cells):>7}{len(graph.nodes):>7}{len(graph.corridors):>11}{build_time * 1e3:>10.1f}"
+              f"{columns}")
+
+
+if __name__ == '__main__':
+    main()
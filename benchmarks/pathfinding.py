@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of the path search engines of libs/greedy_shortest_path.py on the legacy layouts.
+
+Usage: python -m benchmarks.pathfinding [--pairs 200] [--seed 0]
+"""
+import argparse
+import glob
+import random
+import time
+
+from libs.greedy_shortest_path import AStar, HeapAStar
+from libs.layouts import Layout
+
+
+def get_world(layout: Layout):
+    """
+    The maze of a layout, padded with walls so that every row has the same length.
+    """
+    width = max(len(row) for row in layout.maze)
+    return [row + [1] * (width - len(row)) for row in layout.maze]
+
+
+def benchmark_layout(path: str, pairs: int, seed: int):
+    with open(path, 'r') as f:
+        layout = Layout(f.read())
+    world = get_world(layout)
+    rng = random.Random(seed)
+    queries = [(rng.choice(layout.cells), rng.choice(layout.cells)) for _ in range(pairs)]
+    queries = [((start[1], start[0]), (target[1], target[0])) for start, target in queries]
+
+    start_time = time.perf_counter()
+    legacy_paths = [AStar(world).search(start, target) for start, target in queries]
+    legacy_time = time.perf_counter() - start_time
+
+    engine = HeapAStar(world)
+    expanded = 0
+    start_time = time.perf_counter()
+    heap_paths = []
+    for start, target in queries:
+        heap_paths.append(engine.search(start, target))
+        expanded += engine.expanded
+    heap_time = time.perf_counter() - start_time
+
+    for query, legacy_path, heap_path in zip(queries, legacy_paths, heap_paths):
+        if (legacy_path is None) != (heap_path is None) or (legacy_path is not None and len(legacy_path) != len(heap_path)):
+            raise AssertionError(f'{path}: path lengths differ for {query}: {legacy_path} != {heap_path}')
+    return legacy_time, heap_time, expanded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare AStar and HeapAStar on the legacy layouts')
+    parser.add_argument('--pairs', type=int, default=200, help='Number of random start and target pairs per layout')
+    parser.add_argument('--seed', type=int, default=0, help='Seed used to draw the pairs')
+    args = parser.parse_args()
+
+    print(f"{'layout':<32}{'AStar (us)':>12}{'HeapAStar (us)':>16}{'speedup':>10}{'expanded':>10}")
+    for path in sorted(glob.glob('layouts/legacy/*.lay')):
+        legacy_time, heap_time, expanded = benchmark_layout(path, args.pairs, args.seed)
+        print(f"{path:<32}{legacy_time / args.pairs * 1e6:>12.1f}{heap_time / args.pairs * 1e6:>16.1f}"
+              f"{legacy_time / heap_time:>9.1f}x{expanded / args.pairs:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Time spent rendering a frame of the pygame App, without a window (SDL dummy video driver).
+
+Usage: python -m benchmarks.rendering [--frames 2000] [--layout layouts/original.lay] [--agent MonCherryAgent]
+"""
+import argparse
+import os
+import sys
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the frame time of the App')
+    parser.add_argument('--frames', type=int, default=2000, help='Number of frames rendered')
+    parser.add_argument('-l', '--layout', default='layouts/original.lay', help='The layout to use')
+    parser.add_argument('-a', '--agent', default='MonCherryAgent', help='The pacman agent')
+    args = parser.parse_args()
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    # main.py reads its options when imported
+    sys.argv = ['main.py', '-l', args.layout, '-a', args.agent, '--seed', '0', '--log-level', 'ERROR']
+    import main as game
+
+    app = game.App()
+    render_time = 0.0
+    frames = 0
+    while frames < args.frames:
+        if app.game_state.game_over:
+            app = game.App()
+        app.on_loop()
+        start_time = time.perf_counter()
+        app.on_render()
+        render_time += time.perf_counter() - start_time
+        frames += 1
+    print(f"{args.layout}: {render_time / frames * 1e6:.0f} us per frame over {frames} frames "
+          f"({frames / render_time:.0f} frames/s)")
+
+
+if __name__ == '__main__':
+    main()
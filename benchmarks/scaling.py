@@ -0,0 +1,77 @@
+"""
+Turns per second and memory of the headless engine on generated mazes of growing size (see libs/maze_generator.py).
+
+Usage: python -m benchmarks.scaling [--sizes 21,41,81,121,161,201] [--duration 2.0] [--agent MonCherryAgent]
+"""
+import argparse
+import logging
+import time
+import tracemalloc
+from typing import Optional
+
+from libs.layouts import Layout, MAX_PRECOMPUTED_CELLS
+from libs.maze_generator import generate_layout
+from libs.pacman_controller import PacmanState
+
+MAX_TURNS_PER_GAME = 500  # Games that never end are restarted after this number of turns
+
+
+def play(layout: Layout, pacman_agent: str, ghost_agent: Optional[str], duration: float = 0.0, turns: int = 0):
+    """
+    Play seeded games on copies of the layout until the duration is spent or the number of turns is played. Returns
+    the number of turns played and the time it took.
+    """
+    played, seed = 0, 0
+    start_time = time.perf_counter()
+    while (time.perf_counter() - start_time < duration) if duration else played < turns:
+        state = PacmanState(layout.copy(), pacman_agent=pacman_agent, ghost_agent=ghost_agent, seed=seed)
+        while not state.game_over and state.turn < MAX_TURNS_PER_GAME:
+            state.update()
+            played += 1
+            if (duration and time.perf_counter() - start_time >= duration) or (not duration and played >= turns):
+                break
+        seed += 1
+    return played, time.perf_counter() - start_time
+
+
+def measure_memory(layout_content: str, pacman_agent: str, ghost_agent: Optional[str], turns: int):
+    """
+    Bytes held by the parsed layout and its tables, and peak bytes allocated while parsing it and playing the turns.
+    """
+    tracemalloc.start()
+    try:
+        layout = Layout(layout_content)
+        retained = tracemalloc.get_traced_memory()[0]
+        play(layout, pacman_agent, ghost_agent, turns=turns)
+        return retained, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the engine on generated mazes of growing size')
+    parser.add_argument('--sizes', default='21,41,81,121,161,201', help='Comma separated sizes of the square mazes')
+    parser.add_argument('--duration', type=float, default=2.0, help='Seconds of games played on each maze')
+    parser.add_argument('--memory-turns', type=int, default=200, help='Turns played while tracing the memory')
+    parser.add_argument('-a', '--agent', default='MonCherryAgent', help='The pacman agent')
+    parser.add_argument('-g', '--ghost-agent', default=None, help='The agent of all the ghosts, the original ghosts if not set')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the mazes')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'size':>9}{'cells':>8}{'food':>8}{'parse ms':>10}{'turns/s':>10}{'layout MB':>11}{'peak MB':>9}")
+    for size in (int(value) for value in args.sizes.split(',')):
+        layout_content = generate_layout(size, size, seed=args.seed, portals=2, cherries=max(4, size // 10))
+        start_time = time.perf_counter()
+        layout = Layout(layout_content)
+        parse_time = time.perf_counter() - start_time
+        turns, duration = play(layout, args.agent, args.ghost_agent, duration=args.duration)
+        retained, peak = measure_memory(layout_content, args.agent, args.ghost_agent, args.memory_turns)
+        dimensions = f"{len(layout.maze[0])}x{len(layout.maze)}"
+        note = '' if len(layout.cells) <= MAX_PRECOMPUTED_CELLS else '  (navigation rows computed on demand)'
+        print(f"{dimensions:>9}{len(layout.cells):>8}{layout.initial_food_count:>8}{parse_time * 1e3:>10.1f}"
+              f"{turns / duration:>10.0f}{retained / 2 ** 20:>11.1f}{peak / 2 ** 20:>9.1f}{note}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Throughput of PacmanState.generate_successor, PacmanState.predict_pacman_position and SimulationState.apply/undo on
+every layout.
+
+SimulationState copies the rules of PacmanState.update, so each layout first checks that they agree: the moves of a few
+games are applied to a SimulationState along PacmanState.update, which must give the same state and hash after every
+turn, and undoing them all must restore the starting state.
+
+Usage: python -m benchmarks.successors [--duration 1.0] [--parity-turns 300]
+"""
+import argparse
+import glob
+import itertools
+import logging
+import time
+
+from libs.layouts import Layout
+from libs.pacman_controller import PacmanState
+from libs.simulation import SimulationState
+
+
+def get_states(layout_path: str, count: int = 20, seed: int = 0):
+    """
+    States met during a random game on the layout, to expand successors from.
+    """
+    with open(layout_path, 'r') as f:
+        state = PacmanState(Layout(f.read()), pacman_agent='ReflexAgent', seed=seed)
+    states = [state.copy()]
+    while not state.game_over and len(states) < count:
+        state.update()
+        states.append(state.copy())
+    return [state for state in states if not state.game_over]
+
+
+def get_fields(simulation: SimulationState) -> tuple:
+    return (simulation.pacman, simulation.pacman_direction, list(simulation.ghosts), list(simulation.ghost_directions),
+            list(simulation.disable_clip), list(simulation.scared), list(simulation.dead), list(simulation.food),
+            list(simulation.cherries), simulation.score, simulation.turn, simulation.game_over, simulation.killed_by,
+            simulation.to_move, simulation.hash)
+
+
+def check_parity(layout_path: str, turns: int, games: int = 3) -> int:
+    """
+    Plays seeded games on the layout, with and without the clipping bug, applying the moves of every turn to a
+    SimulationState, and raises an AssertionError at the first difference with PacmanState.update. Returns the number of
+    turns checked.
+    """
+    with open(layout_path, 'r') as f:
+        layout_content = f.read()
+    checked = 0
+    for seed, clipping_bug in itertools.product(range(games), (False, True)):
+        state = PacmanState(Layout(layout_content), pacman_agent='ReflexAgent', clipping_bug=clipping_bug, seed=seed)
+        simulation = SimulationState(state)
+        start, records = get_fields(simulation), []
+        while not state.game_over and state.turn < turns:
+            state.update()
+            for actor in [state.pacman] + list(state.ghosts.values()):
+                records.append(simulation.apply(actor.position.direction))
+            expected = SimulationState(state)
+            if get_fields(simulation)[:-1] != get_fields(expected)[:-1]:
+                raise AssertionError(f'{layout_path}: SimulationState differs from PacmanState.update on turn '
+                                     f'{state.turn}:\n{get_fields(simulation)}\n{get_fields(expected)}')
+            if simulation.hash != state.get_hash():
+                raise AssertionError(f'{layout_path}: SimulationState hash differs on turn {state.turn}')
+            checked += 1
+        for record in reversed(records):
+            simulation.undo(record)
+        if get_fields(simulation) != start:
+            raise AssertionError(f'{layout_path}: undoing {len(records)} moves did not restore the starting state')
+    return checked
+
+
+def measure(function, states, duration: float) -> float:
+    """
+    Number of calls of function per second, cycling through the states.
+    """
+    calls = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < duration:
+        for state in states:
+            function(state)
+        calls += len(states)
+    return calls / (time.perf_counter() - start_time)
+
+
+def expand(state):
+    for action in state.pacman.get_legal_actions(state):
+        state.generate_successor(action)
+
+
+def apply_and_undo(simulation: SimulationState):
+    """
+    Same successors as expand, one full turn per pacman action with the ghosts playing their first legal action.
+    """
+    for action in simulation.get_legal_actions():
+        records = [simulation.apply(action)]
+        while simulation.to_move:
+            records.append(simulation.apply(simulation.get_legal_actions()[0]))
+        for record in reversed(records):
+            simulation.undo(record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure successors and predictions per second on every layout')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds spent measuring each function per layout')
+    parser.add_argument('--parity-turns', type=int, default=300,
+                        help='Turns per game of the parity check of SimulationState, 0 to skip it')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    print(f"{'layout':<32}{'successors/s':>14}{'predictions/s':>15}{'apply/undo/s':>14}")
+    for path in sorted(glob.glob('layouts/*.lay') + glob.glob('layouts/legacy/*.lay')):
+        if args.parity_turns:
+            check_parity(path, args.parity_turns)
+        states = get_states(path)
+        actions = sum(len(state.pacman.get_legal_actions(state)) for state in states)
+        successors = measure(expand, states, args.duration) * actions / len(states)
+        predictions = measure(lambda state: state.predict_pacman_position(3), states, args.duration)
+        simulations = [SimulationState(state) for state in states]
+        turns = measure(apply_and_undo, simulations, args.duration) * actions / len(states)
+        print(f"{path:<32}{successors:>14.0f}{predictions:>15.0f}{turns:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
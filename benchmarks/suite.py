@@ -0,0 +1,198 @@
+"""
+Performance baseline of the engine, the path searches and the agents, on every layout.
+
+Usage:
+    python -m benchmarks.suite --output benchmark.json
+    python -m benchmarks.suite --output new.json --baseline benchmark.json [--tolerance 0.1]
+
+Each result is a record {"name", "layout", "parameters", "value", "unit", "higher_is_better"}. With a baseline, results
+that got worse by more than the tolerance are listed and the exit code is 1.
+"""
+import argparse
+import glob
+import inspect
+import json
+import logging
+import platform
+import random
+import sys
+import time
+from typing import List, Dict, Optional
+
+from libs import PacmanAgent
+from libs import ghost_agents, pacman_agents
+from libs.ghost_agents import GhostAgent
+from libs.greedy_shortest_path import AStar, HeapAStar
+from libs.layouts import Layout
+from libs.pacman_controller import PacmanState
+from benchmarks.successors import get_states, measure, expand
+
+MAX_TURNS_PER_GAME = 500  # Games of agents that never win nor lose are restarted after this number of turns
+
+
+def get_agent_names(module, base_class) -> List[str]:
+    """
+    Agents defined in the module, without the base classes of other agents (like _SearchAgent).
+    """
+    classes = [
+        value for name, value in inspect.getmembers(module, inspect.isclass)
+        if issubclass(value, base_class) and value is not base_class and value.__module__ == module.__name__
+    ]
+    return [value.__name__ for value in classes if not any(other is not value and issubclass(other, value) for other in classes)]
+
+
+def record(results: List[Dict], name: str, layout: str, value: float, unit: str, higher_is_better: bool, **parameters):
+    results.append({
+        'name': name,
+        'layout': layout,
+        'parameters': parameters,
+        'value': value,
+        'unit': unit,
+        'higher_is_better': higher_is_better,
+    })
+
+
+def measure_turns(layout: Layout, pacman_agent: str, ghost_agent: Optional[str], duration: float) -> float:
+    """
+    Headless turns per second of PacmanState.update, starting new seeded games on copies of the parsed layout until the
+    duration is spent. An illegal move raises, like in a game.
+    """
+    turns = 0
+    seed = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < duration:
+        state = PacmanState(layout.copy(), pacman_agent=pacman_agent, ghost_agent=ghost_agent, seed=seed)
+        while not state.game_over and state.turn < MAX_TURNS_PER_GAME and time.perf_counter() - start_time < duration:
+            state.update()
+            turns += 1
+        seed += 1
+    return turns / (time.perf_counter() - start_time)
+
+
+def measure_latency(function, arguments: List, duration: float) -> float:
+    """
+    Mean duration of a call in microseconds, cycling through the arguments.
+    """
+    calls = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < duration:
+        for argument in arguments:
+            function(*argument)
+        calls += len(arguments)
+    return (time.perf_counter() - start_time) / calls * 1e6
+
+
+def benchmark_layout(path: str, pacman_agent_names: List[str], ghost_agent_names: List[Optional[str]], duration: float):
+    results = []
+    with open(path, 'r') as f:
+        layout_content = f.read()
+
+    parse_time = measure_latency(Layout, [(layout_content,)], duration)
+    record(results, 'layout_parse', path, parse_time, 'us', False)
+
+    layout = Layout(layout_content)
+    for pacman_agent in pacman_agent_names:
+        for ghost_agent in ghost_agent_names:
+            turns = measure_turns(layout, pacman_agent, ghost_agent, duration)
+            record(results, 'turns_per_second', path, turns, 'turns/s', True,
+                   pacman_agent=pacman_agent, ghost_agent=ghost_agent or 'original')
+
+    width = max(len(row) for row in layout.maze)
+    world = [row + [1] * (width - len(row)) for row in layout.maze]
+    rng = random.Random(0)
+    pairs = [(rng.choice(layout.cells), rng.choice(layout.cells)) for _ in range(50)]
+    pairs = [((start[1], start[0]), (target[1], target[0])) for start, target in pairs]
+    record(results, 'astar_search', path, measure_latency(lambda start, target: AStar(world).search(start, target), pairs, duration),
+           'us', False)
+    engine = HeapAStar(world)
+    record(results, 'heap_astar_search', path, measure_latency(engine.search, pairs, duration), 'us', False)
+
+    states = get_states(path)
+    if states:
+        calls = [(ghost, state) for state in states for ghost in state.ghosts.values()]
+        if calls:
+            latency = measure_latency(lambda ghost, state: ghost.go_to_coords(state, state.pacman.position.coordinates),
+                                      calls, duration)
+            record(results, 'go_to_coords', path, latency, 'us', False)
+        actions = sum(len(state.pacman.get_legal_actions(state)) for state in states)
+        successors = measure(expand, states, duration) * actions / len(states)
+        record(results, 'generate_successor', path, successors, 'successors/s', True)
+        predictions = measure(lambda state: state.predict_pacman_position(3), states, duration)
+        record(results, 'predict_pacman_position', path, predictions, 'predictions/s', True)
+    return results
+
+
+def get_key(result: Dict) -> str:
+    return json.dumps([result['name'], result['layout'], result['parameters']], sort_keys=True)
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """
+    Descriptions of the results that are worse than the baseline by more than the tolerance (0.1 is 10%).
+    """
+    baseline = {get_key(result): result for result in baseline}
+    slowdowns = []
+    for result in results:
+        reference = baseline.get(get_key(result))
+        if reference is None or reference['value'] == 0:
+            continue
+        ratio = result['value'] / reference['value']
+        slower = ratio < 1 - tolerance if result['higher_is_better'] else ratio > 1 + tolerance
+        if slower:
+            parameters = ', '.join(f'{key}={value}' for key, value in result['parameters'].items())
+            slowdowns.append(
+                f"{result['name']} on {result['layout']} ({parameters}): "
+                f"{reference['value']:.1f} -> {result['value']:.1f} {result['unit']}"
+            )
+    return slowdowns
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the engine, the path searches and the agents')
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file', default=None)
+    parser.add_argument('-b', '--baseline', help='Compare the results to this JSON file', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Relative slowdown reported as a regression')
+    parser.add_argument('--duration', type=float, default=0.2, help='Seconds spent on each measurement')
+    parser.add_argument('--layouts', nargs='*', default=None, help='Layout files, all of layouts/ by default')
+    parser.add_argument('--pacman-agents', nargs='*', default=None, help='Pacman agents, all of them by default')
+    parser.add_argument('--ghost-agents', nargs='*', default=None,
+                        help='Ghost agents applied to all ghosts, "original" for the default ghosts, all by default')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    layouts = args.layouts or sorted(glob.glob('layouts/*.lay') + glob.glob('layouts/legacy/*.lay'))
+    pacman_agent_names = args.pacman_agents or get_agent_names(pacman_agents, PacmanAgent)
+    ghost_agent_names = args.ghost_agents or ['original'] + get_agent_names(ghost_agents, GhostAgent)
+    ghost_agent_names = [None if name == 'original' else name for name in ghost_agent_names]
+
+    results = []
+    for path in layouts:
+        start_time = time.perf_counter()
+        results += benchmark_layout(path, pacman_agent_names, ghost_agent_names, args.duration)
+        print(f"{path}: done in {time.perf_counter() - start_time:.1f}s", file=sys.stderr)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        slowdowns = compare(results, baseline, args.tolerance)
+        for slowdown in slowdowns:
+            print(f"Slower: {slowdown}", file=sys.stderr)
+        if slowdowns:
+            sys.exit(1)
+        print(f"No slowdown above {args.tolerance:.0%} compared to {args.baseline}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 from copy import deepcopy
 from typing import Tuple, Optional, List
 
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))  # Order in which legal actions are listed: right, left, up, down
+
 
 def add_tuples(a: Tuple[int, int], b: Tuple[int, int]) -> Tuple[int, int]:
     return a[0] + b[0], a[1] + b[1]
@@ -23,6 +25,14 @@ class BaseClass(object):
             setattr(result, k, deepcopy(v, memodict))
         return result
 
+    def shallow_copy(self):
+        """
+        New instance of the same class sharing all the attributes of this one.
+        """
+        result = self.__class__.__new__(self.__class__)
+        result.__dict__.update(self.__dict__)
+        return result
+
 
 class Position(BaseClass):
     """
@@ -44,6 +54,9 @@ class ActorPosition(Position):
         super().__init__(coordinates)
         self.direction = direction if direction is not None else (1, 0)
 
+    def copy(self):
+        return ActorPosition(self.coordinates, self.direction)
+
     def get_direction(self):
         if self.direction == (1, 0):
             return 'right'
@@ -61,22 +74,19 @@ class PacmanAgent(BaseClass):
     def __init__(self, position: Tuple[int, int]):
         self.position = ActorPosition(position, None)
 
+    def copy(self):
+        """
+        Copy of the agent with its own position. Other attributes are shared with the original agent.
+        """
+        result = self.shallow_copy()
+        result.position = self.position.copy()
+        return result
+
     def get_action(self, state):
         pass
 
     def get_legal_actions(self, state):
-        walls = state.layout.walls
-        coordinates = state.pacman.position.coordinates
-        actions = []
-        if not (coordinates[0] + 1, coordinates[1]) in walls:
-            actions.append((1, 0))
-        if not (coordinates[0] - 1, coordinates[1]) in walls:
-            actions.append((-1, 0))
-        if not (coordinates[0], coordinates[1] + 1) in walls:
-            actions.append((0, 1))
-        if not (coordinates[0], coordinates[1] - 1) in walls:
-            actions.append((0, -1))
-        return actions
+        return state.layout.get_legal_actions(state.pacman.position.coordinates)
 
     def evaluation_function(self, state, action):
         pass
\ No newline at end of file
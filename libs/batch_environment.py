@@ -0,0 +1,350 @@
+"""
+Many games of the same layout stepped in lockstep with NumPy, for reinforcement learning.
+
+The rules are the ones of PacmanState.update and PacmanState.compute_score, and the ghosts behave like the agents of
+libs/ghost_agents.py, read from lookup tables built from the layout. Each game has its own random generator, seeded like
+the generator of a scalar game, so game i of a batch seeded with s plays exactly like `PacmanState(..., seed=s + i)` when
+Pacman takes the same actions.
+"""
+import random
+from typing import Optional, Sequence, Dict, List
+
+import numpy as np
+
+from libs import DIRECTIONS
+from libs.layouts import Layout, NO_MOVE, UNREACHABLE
+
+GHOST_NAMES = ('blinky', 'pinky', 'inky', 'clyde')
+DEFAULT_GHOST_AGENTS = {'blinky': 'BlinkyAgent', 'pinky': 'PinkyAgent', 'inky': 'InkyAgent', 'clyde': 'ClydeAgent'}
+SUPPORTED_GHOST_AGENTS = ('BlinkyAgent', 'PinkyAgent', 'InkyAgent', 'ClydeAgent', 'RandomGhostAgent')
+REVERSE = np.array([DIRECTIONS.index((-dx, -dy)) for dx, dy in DIRECTIONS])
+NO_ACTION = -1  # Previous action of a ghost that hasn't moved inside its box yet
+
+PINKY_START_AT_TURN = 5  # Same values as the ghost agents
+INKY_NEEDED_FOOD_TO_START = 10
+PINKY_LOOK_AHEAD = 3
+FLEEING_DURATION = 10
+TIME_PENALTY = 1
+
+
+class BatchEnvironment(object):
+    """
+    B games of the same layout, stored as arrays of shape (B,) or (B, number of ghosts).
+
+    Positions are indices in the grid of the layout padded by one cell on each side, because ghosts going through a
+    portal spend one turn just outside the maze. Directions are indices in DIRECTIONS.
+    Call `step` with one action per game: games that end are reported in the returned info and start again.
+    """
+
+    def __init__(self, layout: Layout, batch_size: int, seed: int = 0, ghost_agent: Optional[str] = None,
+                 clipping_bug: bool = False):
+        self.layout = layout
+        self.batch_size = batch_size
+        self.clipping_bug = clipping_bug
+        self.ghost_names = [name for name in GHOST_NAMES if getattr(layout, name) != (-1, -1)]
+        self.ghost_agents = [ghost_agent if ghost_agent else DEFAULT_GHOST_AGENTS[name] for name in self.ghost_names]
+        for agent in self.ghost_agents:
+            if agent not in SUPPORTED_GHOST_AGENTS:
+                raise ValueError(f'Ghost agent "{agent}" has no batched implementation')
+        self.build_tables()
+        self.next_seed = seed
+
+        games, ghosts = batch_size, len(self.ghost_names)
+        self.seeds = np.zeros(games, dtype=np.int64)
+        self.generators: List[random.Random] = [random.Random() for _ in range(games)]
+        self.pacman_positions = np.zeros(games, dtype=np.int64)
+        self.pacman_directions = np.zeros(games, dtype=np.int64)
+        self.ghost_positions = np.zeros((games, ghosts), dtype=np.int64)
+        self.ghost_directions = np.zeros((games, ghosts), dtype=np.int64)
+        self.previous_actions = np.zeros((games, ghosts), dtype=np.int64)
+        self.scared = np.zeros((games, ghosts), dtype=bool)
+        self.dead = np.zeros((games, ghosts), dtype=bool)
+        self.disable_clip = np.zeros((games, ghosts), dtype=bool)
+        self.fleeing_since = np.zeros((games, ghosts), dtype=np.int64)
+        self.food = np.zeros((games, self.cell_count), dtype=bool)
+        self.cherries = np.zeros((games, self.cell_count), dtype=bool)
+        self.food_count = np.zeros(games, dtype=np.int64)
+        self.scores = np.zeros(games, dtype=np.int64)
+        self.turns = np.zeros(games, dtype=np.int64)
+        self.reset(np.ones(games, dtype=bool))
+
+    def build_tables(self):
+        """
+        Lookup tables indexed by padded position or by open cell. Index `cell_count` stands for "not an open cell".
+        """
+        layout = self.layout
+        self.width = max(len(row) for row in layout.maze) + 2
+        height = len(layout.maze) + 2
+        self.deltas = np.array([dx + dy * self.width for dx, dy in DIRECTIONS])
+        self.cell_count = cells = len(layout.cells)
+        self.cell_positions = np.array([self.get_position(cell) for cell in layout.cells])
+        self.open_cells = np.full(self.width * height, cells, dtype=np.int64)
+        self.open_cells[self.cell_positions] = np.arange(cells)
+
+        for target in range(cells):
+            if layout.navigation.distances[target] is None:
+                layout.navigation.compute_row(target)
+        self.distances = np.full((cells + 1, cells + 1), UNREACHABLE, dtype=np.int64)
+        self.next_moves = np.full((cells + 1, cells + 1), NO_MOVE, dtype=np.int64)
+        for target in range(cells):
+            self.distances[target, :cells] = np.frombuffer(layout.navigation.distances[target], dtype=np.uint16)
+            self.next_moves[target, :cells] = np.frombuffer(layout.navigation.next_moves[target], dtype=np.int8)
+        self.neighbours = np.full((cells + 1, len(DIRECTIONS)), cells, dtype=np.int64)
+        self.neighbours[:cells] = np.frombuffer(layout.navigation.neighbours, dtype=np.int32).reshape(cells, len(DIRECTIONS))
+        self.neighbours[self.neighbours == -1] = cells
+
+        self.pacman_legal = np.zeros((cells + 1, len(DIRECTIONS)), dtype=bool)
+        self.ghost_legal = np.zeros((cells + 1, len(DIRECTIONS), len(DIRECTIONS)), dtype=bool)
+        self.predictions = np.full((cells + 1, len(DIRECTIONS)), cells, dtype=np.int64)
+        for index, cell in enumerate(layout.cells):
+            for action in layout.get_legal_actions(cell):
+                self.pacman_legal[index, DIRECTIONS.index(action)] = True
+            for direction_index, direction in enumerate(DIRECTIONS):
+                for action in layout.get_ghost_legal_actions(cell, direction):
+                    self.ghost_legal[index, direction_index, DIRECTIONS.index(action)] = True
+                predicted, _ = layout.predict_pacman(cell, direction, PINKY_LOOK_AHEAD)
+                self.predictions[index, direction_index] = layout.cell_index[predicted]
+
+        # Padded position of the other end of the portal at each position, the position itself where there is none
+        self.portal_partners = np.arange(self.width * height, dtype=np.int64)
+        for position, partner in layout.portal_partners.items():
+            self.portal_partners[self.get_position(position)] = self.get_position(partner)
+        self.pacman_start = self.get_position(layout.pacman)
+        self.ghost_starts = np.array([self.get_position(getattr(layout, name)) for name in self.ghost_names], dtype=np.int64)
+        food = np.zeros(cells + 1, dtype=bool)
+        food[[layout.cell_index[position] for position in layout.food]] = True
+        cherries = np.zeros(cells + 1, dtype=bool)
+        cherries[[layout.cell_index[position] for position in layout.cherries]] = True
+        self.initial_food, self.initial_cherries = food[:cells], cherries[:cells]
+
+    def get_position(self, coordinates) -> int:
+        return (coordinates[1] + 1) * self.width + coordinates[0] + 1
+
+    def get_coordinates(self, positions: np.ndarray):
+        return positions % self.width - 1, positions // self.width - 1
+
+    def reset(self, games: np.ndarray):
+        """
+        Start new games in the given slots, each with the next seed.
+        """
+        for game in np.flatnonzero(games):
+            self.seeds[game] = self.next_seed
+            self.generators[game].seed(self.next_seed)
+            self.next_seed += 1
+        self.pacman_positions[games] = self.pacman_start
+        self.pacman_directions[games] = 0
+        self.ghost_positions[games] = self.ghost_starts
+        self.ghost_directions[games] = 0
+        self.previous_actions[games] = NO_ACTION
+        self.scared[games] = False
+        self.dead[games] = False
+        self.disable_clip[games] = False
+        self.fleeing_since[games] = 0
+        self.food[games] = self.initial_food
+        self.cherries[games] = self.initial_cherries
+        self.food_count[games] = self.initial_food.sum()
+        self.scores[games] = 0
+        self.turns[games] = 0
+
+    def get_legal_actions_mask(self) -> np.ndarray:
+        """
+        Boolean array of shape (B, 4), the legal actions of pacman in each game, after going through a portal.
+        """
+        return self.pacman_legal[self.open_cells[self.teleport(self.pacman_positions.copy())]]
+
+    def teleport(self, positions: np.ndarray) -> np.ndarray:
+        positions[:] = self.portal_partners[positions]
+        return positions
+
+    def step(self, actions: Sequence[int]):
+        """
+        Play one turn in every game. Returns the rewards (score differences), the games that ended, and an info dict
+        with the final score, number of turns, outcome and killer (index of the ghost, or -1) of the ended games.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        previous_scores = self.scores.copy()
+
+        self.teleport(self.pacman_positions)
+        if not self.pacman_legal[self.open_cells[self.pacman_positions], actions].all():
+            raise ValueError('Pacman tried to move in an illegal direction')
+        self.pacman_directions[:] = actions
+        self.pacman_positions += self.deltas[actions]
+
+        for ghost in range(len(self.ghost_names)):
+            self.move_ghost(ghost)
+        self.turns += 1
+
+        killed_by = np.full(self.batch_size, -1, dtype=np.int64)
+        won = self.compute_score(killed_by)
+        rewards = self.scores - previous_scores
+        dones = won | (killed_by != -1)
+        info = {
+            'scores': self.scores[dones],
+            'turns': self.turns[dones],
+            'seeds': self.seeds[dones],
+            'won': won[dones],
+            'killed_by': killed_by[dones],
+        }
+        if dones.any():
+            self.reset(dones)
+        return rewards, dones, info
+
+    def move_ghost(self, ghost: int):
+        """
+        Same as the ghost part of PacmanState.update, for one ghost in every game.
+        """
+        choosing = np.flatnonzero(~self.disable_clip[:, ghost])
+        if len(choosing):
+            self.ghost_directions[choosing, ghost] = self.get_ghost_actions(ghost, choosing)
+        positions = self.ghost_positions[:, ghost]
+        directions = self.ghost_directions[:, ghost]
+        positions += self.deltas[directions]
+        partners = self.portal_partners[positions]
+        teleported = ~self.disable_clip[:, ghost] & (partners != positions)
+        positions[teleported] = partners[teleported] - self.deltas[directions[teleported]]
+        self.disable_clip[:, ghost] = teleported
+        respawned = (self.dead[:, ghost] | self.scared[:, ghost]) & (positions == self.ghost_starts[ghost])
+        self.dead[respawned, ghost] = False
+        self.scared[respawned, ghost] = False
+        self.fleeing_since[respawned, ghost] = 0
+
+    def get_ghost_actions(self, ghost: int, games: np.ndarray) -> np.ndarray:
+        """
+        Same as the get_action methods of the ghost agents, for one ghost in the given games.
+        """
+        agent = self.ghost_agents[ghost]
+        cells = self.open_cells[self.ghost_positions[games, ghost]]
+        directions = self.ghost_directions[games, ghost]
+        pacman_cells = self.open_cells[self.pacman_positions[games]]
+        eaten_food = self.initial_food.sum() - self.food_count[games]
+        actions = np.full(len(games), NO_ACTION, dtype=np.int64)
+        targets = np.full(len(games), self.cell_count, dtype=np.int64)
+        draws = np.zeros(len(games), dtype=bool)
+
+        dead = self.dead[games, ghost]
+        scared = self.scared[games, ghost] & ~dead
+        tired = scared & (self.fleeing_since[games, ghost] > FLEEING_DURATION)
+        fleeing = scared & ~tired
+        self.fleeing_since[games[fleeing], ghost] += 1
+        going = dead | tired
+        targets[going] = self.open_cells[self.ghost_starts[ghost]]
+        free = ~dead & ~scared
+        boxed = np.zeros(len(games), dtype=bool)
+
+        if agent == 'BlinkyAgent':
+            chasing = free
+            targets[chasing] = pacman_cells[chasing]
+        elif agent == 'PinkyAgent':
+            boxed = free & (self.turns[games] < PINKY_START_AT_TURN)
+            chasing = free & ~boxed
+            targets[chasing] = self.predictions[pacman_cells[chasing], self.pacman_directions[games[chasing]]]
+        elif agent == 'InkyAgent':
+            boxed = free & (eaten_food < INKY_NEEDED_FOOD_TO_START)
+            chasing = free & ~boxed
+            targets[chasing] = pacman_cells[chasing]
+        elif agent == 'ClydeAgent':
+            boxed = free & (eaten_food < self.initial_food.sum() / 3)
+            ghost_x, ghost_y = self.get_coordinates(self.ghost_positions[games, ghost])
+            pacman_x, pacman_y = self.get_coordinates(self.pacman_positions[games])
+            far = np.abs(ghost_x - pacman_x) + np.abs(ghost_y - pacman_y) > 8
+            chasing = free & ~boxed & far
+            fleeing |= free & ~boxed & ~far
+            targets[chasing] = pacman_cells[chasing]
+        else:
+            chasing = np.zeros(len(games), dtype=bool)
+            draws |= free
+        going |= chasing
+
+        if going.any():
+            actions[going], draws[going] = self.go_to_cells(ghost, games[going], cells[going], directions[going], targets[going])
+        if fleeing.any():
+            actions[fleeing] = self.flee_pacman(ghost, games[fleeing], cells[fleeing], directions[fleeing])
+        if boxed.any():
+            previous = self.previous_actions[games, ghost]
+            turning = boxed & (previous != NO_ACTION)
+            actions[turning] = REVERSE[previous[turning]]
+            draws |= boxed & ~turning
+        for index in np.flatnonzero(draws):
+            game = games[index]
+            coordinates = self.layout.cells[cells[index]] if cells[index] < self.cell_count else tuple(
+                int(value) for value in self.get_coordinates(self.ghost_positions[game, ghost]))
+            legal_actions = self.layout.get_ghost_legal_actions(coordinates, DIRECTIONS[directions[index]])
+            actions[index] = DIRECTIONS.index(self.generators[game].choice(legal_actions))
+        if boxed.any():
+            self.previous_actions[games[boxed], ghost] = actions[boxed]
+        return actions
+
+    def go_to_cells(self, ghost: int, games: np.ndarray, cells: np.ndarray, directions: np.ndarray, targets: np.ndarray):
+        """
+        Same as GhostAgent.go_to_coords. Returns the actions, and where a random legal action must be drawn instead.
+        """
+        at_start = self.ghost_positions[games, ghost] == self.ghost_starts[ghost]
+        forbidden = np.where(at_start, NO_MOVE, REVERSE[directions])
+        moves = self.next_moves[targets, cells]
+        blocked = (moves != NO_MOVE) & (moves == forbidden)
+        if blocked.any():
+            distances = self.distances[targets[blocked, None], self.neighbours[cells[blocked]]]
+            distances[np.arange(blocked.sum()), forbidden[blocked]] = UNREACHABLE
+            best = distances.argmin(axis=1)
+            moves[blocked] = np.where(distances.min(axis=1) < UNREACHABLE, best, NO_MOVE)
+        moves[(cells == targets) | (cells == self.cell_count) | (targets == self.cell_count)] = NO_MOVE
+        legal = self.ghost_legal[cells, directions, np.maximum(moves, 0)] & (moves != NO_MOVE)
+        return np.where(legal, moves, NO_ACTION), ~legal
+
+    def flee_pacman(self, ghost: int, games: np.ndarray, cells: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        """
+        Same as GhostAgent.flee_pacman: the legal action going the furthest from pacman, in Manhattan distance.
+        """
+        ghost_x, ghost_y = self.get_coordinates(self.ghost_positions[games, ghost])
+        pacman_x, pacman_y = self.get_coordinates(self.pacman_positions[games])
+        dx = np.array([direction[0] for direction in DIRECTIONS])
+        dy = np.array([direction[1] for direction in DIRECTIONS])
+        distances = np.abs(ghost_x[:, None] + dx - pacman_x[:, None]) + np.abs(ghost_y[:, None] + dy - pacman_y[:, None])
+        distances = np.where(self.ghost_legal[cells, directions], distances, -1)
+        return distances.argmax(axis=1)
+
+    def compute_score(self, killed_by: np.ndarray) -> np.ndarray:
+        """
+        Same as PacmanState.compute_score in every game. Fills killed_by and returns the games won.
+        """
+        games = np.arange(self.batch_size)
+        bounty = (self.dead.sum(axis=1) + 1) * 200
+        self.scores -= TIME_PENALTY
+        cells = self.open_cells[self.pacman_positions]
+        eating = self.food[games, cells]
+        self.scores += eating * 10
+        self.food[games[eating], cells[eating]] = False
+        self.food_count -= eating
+        cherries = self.cherries[games, cells]
+        self.scores += cherries * 50
+        self.scared[cherries] = True
+        self.cherries[games[cherries], cells[cherries]] = False
+
+        pacman_previous = self.pacman_positions - self.deltas[self.pacman_directions]
+        for ghost in range(len(self.ghost_names)):
+            positions = self.ghost_positions[:, ghost]
+            colliding = positions == self.pacman_positions
+            if not self.clipping_bug:
+                ghost_previous = positions - self.deltas[self.ghost_directions[:, ghost]]
+                colliding |= (ghost_previous == self.pacman_positions) & (pacman_previous == positions)
+            eaten = colliding & self.scared[:, ghost]
+            self.scores[eaten] += bounty[eaten]
+            self.dead[eaten, ghost] = True
+            bounty = (self.dead.sum(axis=1) + 1) * 200
+            killing = colliding & ~self.scared[:, ghost]
+            self.scores[killing] -= 500
+            killed_by[killing] = ghost
+        won = self.food_count == 0
+        self.scores[won] += 500
+        return won
+
+    def get_ghost_coordinates(self) -> Dict[str, np.ndarray]:
+        """
+        Coordinates (x, y) of each ghost in every game, as arrays of shape (B, 2).
+        """
+        x, y = self.get_coordinates(self.ghost_positions)
+        return {name: np.stack([x[:, index], y[:, index]], axis=1) for index, name in enumerate(self.ghost_names)}
+
+    def get_pacman_coordinates(self) -> np.ndarray:
+        x, y = self.get_coordinates(self.pacman_positions)
+        return np.stack([x, y], axis=1)
@@ -0,0 +1,145 @@
+"""
+Gym-style interface to drive a game step by step, for learning agents.
+"""
+from typing import Optional, Tuple, Union, List
+
+import numpy as np
+
+from libs import DIRECTIONS
+from libs.layout_cache import load_layout
+from libs.layouts import Layout
+from libs.pacman_controller import PacmanState
+
+GHOST_NAMES = ('blinky', 'pinky', 'inky', 'clyde')
+
+
+class PacmanEnvironment(object):
+    """
+    Wraps a PacmanState with `reset(seed)` and `step(action)`.
+
+    Observations are stacked planes of shape (channels, height, width): walls, food, cherries, pacman, one plane per
+    ghost of the layout, then the cells of the scared ghosts and of the dead ghosts. The observation is a single
+    preallocated array updated in place at each step: copy it to keep it across steps.
+
+    Once a step returned done, the game must be started again with `reset` before the next step.
+    """
+    observation: np.ndarray
+    state: PacmanState
+    done: bool = True  # Whether the game is over or truncated, or not started yet
+
+    def __init__(self, layout: Union[Layout, str], ghost_agent: Optional[str] = None, clipping_bug: bool = False,
+                 max_turns: int = 0, dtype=np.float32, pacman_agent: str = 'PacmanAgent', writer=None):
+        """
+        pacman_agent plays the steps taken without an action. Each step is appended to the writer, if any (a
+        libs.trajectories.TrajectoryWriter), as the observation before the step, the action, the reward and done.
+        """
+        self.layout = layout if isinstance(layout, Layout) else load_layout(layout)
+        self.ghost_agent = ghost_agent
+        self.pacman_agent = pacman_agent
+        self.clipping_bug = clipping_bug
+        self.max_turns = max_turns
+        self.ghost_names = [name for name in GHOST_NAMES if getattr(self.layout, name) != (-1, -1)]
+        self.plane_names = ['walls', 'food', 'cherries', 'pacman'] + self.ghost_names + ['scared', 'dead']
+        self.width = max(len(row) for row in self.layout.maze)
+        self.height = len(self.layout.maze)
+        self.observation = np.zeros((len(self.plane_names), self.height, self.width), dtype=dtype)
+        for x, y in self.layout.walls:
+            self.observation[0, y, x] = 1
+        self.drawn_actors: List[Tuple[int, int, int]] = []  # (plane, y, x) set to 1 for the actors at the last step
+        self.previous_observation = None
+        self.attach_writer(writer)
+
+    def attach_writer(self, writer):
+        """
+        Append the next steps to the writer, or stop recording them if it is None.
+        """
+        self.writer = writer
+        if writer is not None and self.previous_observation is None:
+            self.previous_observation = np.zeros_like(self.observation)
+
+    @property
+    def action_count(self) -> int:
+        return len(DIRECTIONS)
+
+    def get_plane(self, name: str) -> np.ndarray:
+        return self.observation[self.plane_names.index(name)]
+
+    def reset(self, seed: Optional[int] = None) -> np.ndarray:
+        """
+        Start a new game and return its first observation.
+        """
+        self.state = PacmanState(self.layout.copy(), pacman_agent=self.pacman_agent, clipping_bug=self.clipping_bug,
+                                 ghost_agent=self.ghost_agent, seed=seed)
+        self.observation[1:] = 0
+        for plane, cells in ((1, self.state.layout.food), (2, self.state.layout.cherries)):
+            for x, y in cells:
+                self.observation[plane, y, x] = 1
+        self.drawn_actors = []
+        self.draw_actors()
+        self.done = False
+        return self.observation
+
+    def legal_actions(self) -> List[int]:
+        """
+        Indices in DIRECTIONS of the actions pacman can take at the next step, after going through a portal.
+        """
+        coordinates = self.state.pacman.position.coordinates
+        coordinates = self.state.layout.portal_partners.get(coordinates, coordinates)
+        return [DIRECTIONS.index(action) for action in self.state.layout.get_legal_actions(coordinates)]
+
+    def step(self, action: Union[int, Tuple[int, int], None] = None):
+        """
+        Play one turn with the given action (an index in DIRECTIONS or a direction), or the action of the pacman agent,
+        and return the observation, the reward (the score difference), whether the game is over and an info dict.
+        Raises a ValueError when the game is over, until `reset` is called.
+        """
+        if self.done:
+            raise ValueError('The game is over, call reset() to start a new one')
+        state = self.state
+        score = state.score
+        if self.writer is not None:
+            np.copyto(self.previous_observation, self.observation)
+        if action is None:
+            over = state.update()
+        else:
+            state.pacman.position.direction = DIRECTIONS[action] if isinstance(action, (int, np.integer)) else tuple(action)
+            over = state.update(keyboard_input=True)
+        x, y = state.pacman.position.coordinates
+        self.observation[1, y, x] = (x, y) in state.layout.food
+        self.observation[2, y, x] = (x, y) in state.layout.cherries
+        self.draw_actors()
+        truncated = not over and 0 < self.max_turns <= state.turn
+        info = {
+            'score': state.score,
+            'turn': state.turn,
+            'won': over and len(state.layout.food) == 0 and state.killed_by is None,
+            'killed_by': state.killed_by,
+            'truncated': truncated,
+        }
+        self.done = over or truncated
+        if self.writer is not None:
+            self.writer.append(self.previous_observation, DIRECTIONS.index(state.pacman.position.direction),
+                               state.score - score, self.done)
+        return self.observation, state.score - score, self.done, info
+
+    def draw_actors(self):
+        """
+        Erase the actors from their previous cells and draw them on the new ones.
+        """
+        for plane, y, x in self.drawn_actors:
+            self.observation[plane, y, x] = 0
+        self.drawn_actors = []
+        self.draw(self.plane_names.index('pacman'), self.state.pacman.position.coordinates)
+        for name in self.ghost_names:
+            ghost = self.state.ghosts[name]
+            self.draw(self.plane_names.index(name), ghost.position.coordinates)
+            if ghost.scared:
+                self.draw(self.plane_names.index('scared'), ghost.position.coordinates)
+            if ghost.dead:
+                self.draw(self.plane_names.index('dead'), ghost.position.coordinates)
+
+    def draw(self, plane: int, coordinates: Tuple[int, int]):
+        x, y = coordinates
+        if 0 <= x < self.width and 0 <= y < self.height:  # Ghosts going through a portal leave the maze for one turn
+            self.observation[plane, y, x] = 1
+            self.drawn_actors.append((plane, y, x))
@@ -1,10 +1,9 @@
-import random
 from copy import deepcopy, copy
-from typing import Tuple
+from typing import Optional, Tuple
 
 
-from libs import ActorPosition, BaseClass, reverse_tuple, add_tuples
-from libs.greedy_shortest_path import AStar
+from libs import ActorPosition, BaseClass, DIRECTIONS, reverse_tuple, add_tuples
+from libs.greedy_shortest_path import PathReplanner
 from libs.layouts import manhattan_distance
 
 
@@ -18,12 +17,25 @@ class GhostAgent(BaseClass):
     disable_clip: bool = False
     fleeing_since: int = 0
     key: str
+    # Follow a path kept from turn to turn instead of the navigation table of the layout. By default, only on the layouts
+    # too large for the table to be precomputed, where each new target would cost a search through the whole maze.
+    replanning: Optional[bool] = None
+    replanner: Optional[PathReplanner] = None
 
     def __init__(self, position: Tuple[int, int]):
         position = ActorPosition(position, (1, 0))
         self.initial_position = deepcopy(position)
         self.position = position
 
+    def copy(self):
+        """
+        Copy of the ghost with its own position. The flags are immutable values, so they are copied on write.
+        """
+        result = self.shallow_copy()
+        result.position = self.position.copy()
+        result.replanner = None
+        return result
+
     def set_respawn(self):
         self.dead = True
 
@@ -66,43 +78,40 @@ class GhostAgent(BaseClass):
         A ghost cannot move through a ghost.
         A ghost can only advance one step at a time.
 
-        :return: list of legal actions
+        :return: tuple of legal actions
         """
-        walls = state.layout.walls
-        coordinates = self.position.coordinates
-        direction = self.position.direction
-        actions = []
-        if not (coordinates[0] + 1, coordinates[1]) in walls and direction != (-1, 0):
-            actions.append((1, 0))
-        if not (coordinates[0] - 1, coordinates[1]) in walls and direction != (1, 0):
-            actions.append((-1, 0))
-        if not (coordinates[0], coordinates[1] + 1) in walls and direction != (0, -1):
-            actions.append((0, 1))
-        if not (coordinates[0], coordinates[1] - 1) in walls and direction != (0, 1):
-            actions.append((0, -1))
-        if len(actions) == 0:
-            actions.append((direction[0] * -1, direction[1] * -1))
-        return actions
+        return state.layout.get_ghost_legal_actions(self.position.coordinates, self.position.direction)
 
     def go_to_coords(self, state, coords):
+        """
+        Move one step along a shortest path to the given coordinates, without going backwards.
+
+        Backwards is only allowed when leaving the spawn location.
+        """
         actions = self.get_legal_actions(state)
-        maze = deepcopy(state.layout.maze)
-        if self.position.coordinates != self.initial_position.coordinates:
-            previous_position = (self.position.coordinates[1] - self.position.direction[1], self.position.coordinates[0] - self.position.direction[0])
-            try:
-                maze[previous_position[0]][previous_position[1]] = 1
-            except IndexError:
-                pass
-        shortest_path_to_target = AStar(maze).search((self.position.coordinates[1], self.position.coordinates[0]), (coords[1], coords[0]))
-        try:
-            next_position = (shortest_path_to_target[1][1], shortest_path_to_target[1][0])
-        except (TypeError, IndexError):
-            return random.choice(actions)
-        vector = (next_position[0] - self.position.coordinates[0], next_position[1] - self.position.coordinates[1])
+        direction = None if self.position.coordinates == self.initial_position.coordinates else self.position.direction
+        if self.replanning or (self.replanning is None and not state.layout.navigation.precomputed):
+            vector = self.get_replanned_move(state, coords, direction)
+        else:
+            vector = state.layout.get_next_move(self.position.coordinates, coords, direction)
         if vector in actions:
             return vector
         else:
-            return random.choice(actions)
+            return state.random.choice(actions)
+
+    def get_replanned_move(self, state, coords, direction) -> Optional[Tuple[int, int]]:
+        """
+        Same as Layout.get_next_move, along the path of the ghost's PathReplanner.
+        """
+        layout = state.layout
+        cell, target = layout.cell_index.get(self.position.coordinates), layout.cell_index.get(coords)
+        if cell is None or target is None:
+            return None
+        if self.replanner is None or self.replanner.neighbours is not layout.navigation.neighbours:
+            self.replanner = PathReplanner(layout.navigation.neighbours, layout.cells, layout.portal_partners)
+        reverse = None if direction is None else reverse_tuple(direction)
+        move = self.replanner.get_next_move(cell, target, DIRECTIONS.index(reverse) if reverse in DIRECTIONS else -1)
+        return None if move == -1 else DIRECTIONS[move]
 
 
 class RandomGhostAgent(GhostAgent):
@@ -115,7 +124,7 @@ class RandomGhostAgent(GhostAgent):
         if action is not None:
             return action
         actions = self.get_legal_actions(state)
-        return random.choice(actions)
+        return state.random.choice(actions)
 
 
 class BlinkyAgent(GhostAgent):
@@ -143,13 +152,13 @@ class PinkyAgent(GhostAgent):
         actions = self.get_legal_actions(state)
         if state.turn < self.start_at_turn:
             if self.previous_action == (0, 0):
-                self.previous_action = random.choice(actions)
+                self.previous_action = state.random.choice(actions)
                 return self.previous_action
             else:
                 self.previous_action = reverse_tuple(self.previous_action)
                 return self.previous_action
-        way_ahead = state.predict_pacman_position(3)
-        return self.go_to_coords(state, way_ahead.pacman.position.coordinates)
+        way_ahead, _ = state.predict_pacman_position(3)
+        return self.go_to_coords(state, way_ahead)
 
 
 class InkyAgent(GhostAgent):
@@ -167,7 +176,7 @@ class InkyAgent(GhostAgent):
         actions = self.get_legal_actions(state)
         if state.layout.initial_food_count - len(state.layout.food) < self.needed_food_to_start:
             if self.previous_action == (0, 0):
-                self.previous_action = random.choice(actions)
+                self.previous_action = state.random.choice(actions)
                 return self.previous_action
             else:
                 self.previous_action = reverse_tuple(self.previous_action)
@@ -190,7 +199,7 @@ class ClydeAgent(GhostAgent):
         actions = self.get_legal_actions(state)
         if state.layout.initial_food_count - len(state.layout.food) < state.layout.initial_food_count / 3:
             if self.previous_action == (0, 0):
-                self.previous_action = random.choice(actions)
+                self.previous_action = state.random.choice(actions)
                 return self.previous_action
             else:
                 self.previous_action = reverse_tuple(self.previous_action)
@@ -1,7 +1,12 @@
 """
 from python-astar - A* path search algorithm
 """
-from typing import Set
+import heapq
+from array import array
+from collections import deque
+from typing import Set, List, Tuple, Optional, Iterable, Sequence
+
+from libs import profiler
 
 
 class Tile:
@@ -67,14 +72,21 @@ class AStar:
             tile = min(self.open_tiles)
             # check if we're there. Happy path!
             if tile.pos == target_pos:
+                self.record_search()
                 return self.rebuild_path(tile)
             # search new ways in the neighbor's tiles.
             self.search_for_tiles(tile)
 
             self.close_tile(tile)
         # if we got here, path is blocked :(
+        self.record_search()
         return None
 
+    def record_search(self):
+        """Report the expanded tiles to the turn profiler, if any"""
+        if profiler.current is not None:
+            profiler.current.record_search('astar', len(self.closed_tiles))
+
     def search_for_tiles(self, current):
         """Search for new tiles in the maze"""
         for other in self.get_neighbors(current):
@@ -141,6 +153,268 @@ class AStar:
         self.closed_tiles.add(tile)
 
 
+class HeapAStar:
+    """
+    A* path search on integer cell indices, with a binary heap for the open tiles and flat arrays for the distances
+    and the origins.
+
+    Same contract as AStar: `world[a][b] == 0` is a walkable tile, positions are (a, b) tuples, and `search` returns the
+    list of positions from start to target, or None. Portals are given as pairs of positions connected by a single
+    move. The heuristic is the Manhattan distance, lowered to account for the portals so that it stays admissible.
+    """
+    expanded: int = 0  # Number of tiles expanded by the last search
+
+    def __init__(self, world: Sequence[Sequence[int]], portals: Iterable[Tuple[Tuple[int, int], Tuple[int, int]]] = ()):
+        self.rows = len(world)
+        self.columns = max((len(row) for row in world), default=0)
+        self.walkable = array('b', [0]) * (self.rows * self.columns)
+        for a, row in enumerate(world):
+            for b, tile in enumerate(row):
+                if tile == 0:
+                    self.walkable[a * self.columns + b] = 1
+        self.portal_exits = {}
+        for entrance, exit in portals:
+            if exit is None or not self.is_walkable(entrance) or not self.is_walkable(exit):
+                continue
+            self.portal_exits[self.get_cell(entrance)] = self.get_cell(exit)
+            self.portal_exits[self.get_cell(exit)] = self.get_cell(entrance)
+        self.portal_entrances = [self.get_position(cell) for cell in self.portal_exits]
+
+    def get_cell(self, position: Tuple[int, int]) -> int:
+        return position[0] * self.columns + position[1]
+
+    def get_position(self, cell: int) -> Tuple[int, int]:
+        return divmod(cell, self.columns)
+
+    def is_walkable(self, position: Tuple[int, int]) -> bool:
+        return 0 <= position[0] < self.rows and 0 <= position[1] < self.columns and self.walkable[self.get_cell(position)] == 1
+
+    def get_neighbors(self, cell: int) -> List[int]:
+        """Return the walkable cells one move away from a given cell"""
+        a, b = divmod(cell, self.columns)
+        neighbors = []
+        if a > 0 and self.walkable[cell - self.columns]:
+            neighbors.append(cell - self.columns)
+        if a < self.rows - 1 and self.walkable[cell + self.columns]:
+            neighbors.append(cell + self.columns)
+        if b > 0 and self.walkable[cell - 1]:
+            neighbors.append(cell - 1)
+        if b < self.columns - 1 and self.walkable[cell + 1]:
+            neighbors.append(cell + 1)
+        if cell in self.portal_exits:
+            neighbors.append(self.portal_exits[cell])
+        return neighbors
+
+    def heuristic(self, position: Tuple[int, int], targets: List[Tuple[int, int]], portal_shortcut: int) -> int:
+        """
+        Manhattan distance to the closest target, or the distance to the closest portal plus the cheapest way out of a
+        portal to a target, whichever is lower.
+        """
+        a, b = position
+        estimate = min(abs(a - target[0]) + abs(b - target[1]) for target in targets)
+        if self.portal_entrances:
+            to_portal = min(abs(a - portal[0]) + abs(b - portal[1]) for portal in self.portal_entrances)
+            estimate = min(estimate, to_portal + portal_shortcut)
+        return estimate
+
+    def search(self, start_pos: Tuple[int, int], target_pos: Tuple[int, int]) -> Optional[List[Tuple[int, int]]]:
+        """A_Star (A*) path search algorithm"""
+        return self.search_nearest(start_pos, [target_pos])
+
+    def search_nearest(self, start_pos: Tuple[int, int], targets: Iterable[Tuple[int, int]]) -> Optional[List[Tuple[int, int]]]:
+        """
+        Multi-target A*: path to the closest of the targets, or None if none of them can be reached.
+        """
+        self.expanded = 0
+        targets = [target for target in targets if self.is_walkable(target)]
+        if not targets or not self.is_walkable(start_pos):
+            return None
+        target_cells = {self.get_cell(target) for target in targets}
+        portal_shortcut = 1 + min(
+            (abs(exit[0] - target[0]) + abs(exit[1] - target[1]) for exit in self.portal_entrances for target in targets),
+            default=0
+        )
+        distances = array('i', [-1]) * (self.rows * self.columns)
+        came_from = array('i', [-1]) * (self.rows * self.columns)
+        closed = array('b', [0]) * (self.rows * self.columns)
+        start = self.get_cell(start_pos)
+        distances[start] = 0
+        open_tiles = [(self.heuristic(start_pos, targets, portal_shortcut), 0, start)]
+        while open_tiles:
+            _, distance, cell = heapq.heappop(open_tiles)
+            if closed[cell]:
+                continue
+            if cell in target_cells:
+                self.record_search()
+                return self.rebuild_path(came_from, cell)
+            closed[cell] = 1
+            self.expanded += 1
+            for neighbor in self.get_neighbors(cell):
+                if closed[neighbor] or 0 <= distances[neighbor] <= distance + 1:
+                    continue
+                distances[neighbor] = distance + 1
+                came_from[neighbor] = cell
+                estimate = self.heuristic(self.get_position(neighbor), targets, portal_shortcut)
+                heapq.heappush(open_tiles, (distance + 1 + estimate, distance + 1, neighbor))
+        self.record_search()
+        return None
+
+    def record_search(self):
+        """Report the expanded cells to the turn profiler, if any"""
+        if profiler.current is not None:
+            profiler.current.record_search('heap_astar', self.expanded)
+
+    def rebuild_path(self, came_from: array, cell: int) -> List[Tuple[int, int]]:
+        """Rebuild the path from each cell"""
+        path = []
+        while cell != -1:
+            path.append(self.get_position(cell))
+            cell = came_from[cell]
+        path.reverse()
+        return path
+
+
+class PathReplanner(object):
+    """
+    Path towards a moving target, kept from one turn to the next by its owner (a ghost) and repaired instead of searched
+    again when the target only moved by one cell.
+
+    Works on the cells of a navigation graph, `neighbours[cell * 4 + direction]` being the cell reached by moving in that
+    direction (or -1), portals included, `positions[cell]` the (x, y) position of a cell for the heuristic, and `portals`
+    the positions of the ends of the portals.
+    At each call, the cells the owner walked are dropped from the head of the path. When the target moved onto the
+    path, the path is cut there, which keeps it a shortest path. When it moved to a neighbour of the end of the path, the
+    path is extended by that cell: it can then be up to two moves longer than a shortest path per extension, so a new
+    search is made after `max_repairs` extensions. Anything else (the owner left the path, the target jumped) starts a
+    new A* search, where the move backwards is excluded from the first step only, like `Layout.get_next_move` does with
+    the direction of a ghost.
+    """
+    expanded: int = 0  # Number of cells expanded by the last call
+    searches: int = 0  # Calls that made a new search
+    reuses: int = 0  # Calls that kept or repaired the path
+
+    def __init__(self, neighbours: Sequence[int], positions: Sequence[Tuple[int, int]],
+                 portals: Iterable[Tuple[int, int]] = (), max_repairs: int = 8):
+        self.neighbours = neighbours
+        self.positions = positions
+        self.max_repairs = max_repairs
+        self.portal_entrances = list(portals)
+        self.path: deque = deque()  # Cells from the position of the owner to the target
+        self.on_path: Set[int] = set()
+        self.extensions = 0  # Cells added to the path since the last search
+
+    def heuristic(self, cell: int, target: Tuple[int, int], portal_shortcut: int) -> int:
+        """
+        Manhattan distance to the target, or to the closest portal plus the cheapest way out of a portal to the target.
+        """
+        x, y = self.positions[cell]
+        estimate = abs(x - target[0]) + abs(y - target[1])
+        if self.portal_entrances:
+            to_portal = min(abs(x - portal[0]) + abs(y - portal[1]) for portal in self.portal_entrances)
+            estimate = min(estimate, to_portal + portal_shortcut)
+        return estimate
+
+    def search(self, start: int, target: int, forbidden: int = -1) -> bool:
+        """
+        A* from start to target, without the first move in the forbidden direction. Keeps the path found, if any.
+        """
+        self.searches += 1
+        self.extensions = 0
+        self.path.clear()
+        self.on_path.clear()
+        target_position = self.positions[target]
+        portal_shortcut = 1 + min(
+            (abs(exit[0] - target_position[0]) + abs(exit[1] - target_position[1]) for exit in self.portal_entrances),
+            default=0
+        )
+        # The first moves are pushed apart, so that the path may come back through the start after its first move
+        distances = {}
+        came_from = {}
+        closed = set()
+        open_cells = []
+        for direction in range(4):
+            neighbour = self.neighbours[start * 4 + direction]
+            if neighbour != -1 and direction != forbidden and neighbour not in distances:
+                distances[neighbour], came_from[neighbour] = 1, -1
+                heapq.heappush(open_cells, (1 + self.heuristic(neighbour, target_position, portal_shortcut), 1, neighbour))
+        self.expanded += 1
+        while open_cells:
+            _, distance, cell = heapq.heappop(open_cells)
+            if cell in closed:
+                continue
+            if cell == target:
+                while cell != -1:
+                    self.path.appendleft(cell)
+                    cell = came_from[cell]
+                self.path.appendleft(start)
+                self.on_path.update(self.path)
+                return True
+            closed.add(cell)
+            self.expanded += 1
+            for direction in range(4):
+                neighbour = self.neighbours[cell * 4 + direction]
+                if neighbour == -1 or neighbour in closed:
+                    continue
+                if neighbour in distances and distances[neighbour] <= distance + 1:
+                    continue
+                distances[neighbour] = distance + 1
+                came_from[neighbour] = cell
+                estimate = self.heuristic(neighbour, target_position, portal_shortcut)
+                heapq.heappush(open_cells, (distance + 1 + estimate, distance + 1, neighbour))
+        return False
+
+    def get_direction(self, cell: int, neighbour: int) -> int:
+        for direction in range(4):
+            if self.neighbours[cell * 4 + direction] == neighbour:
+                return direction
+        return -1
+
+    def repair(self, position: int, target: int) -> bool:
+        """
+        Update the path for the new position of the owner and of the target, returns False if it can't be.
+        """
+        path = self.path
+        for _ in range(3):  # The owner moved one cell, or two through a portal
+            if not path or path[0] == position:
+                break
+            self.on_path.discard(path.popleft())
+        if not path or path[0] != position:
+            return False
+        if target in self.on_path:
+            while path[-1] != target:
+                self.on_path.discard(path.pop())
+        elif self.extensions < self.max_repairs and self.get_direction(path[-1], target) != -1:
+            path.append(target)
+            self.on_path.add(target)
+            self.extensions += 1
+        else:
+            return False
+        return True
+
+    def get_next_move(self, position: int, target: int, forbidden: int = -1) -> int:
+        """
+        Direction of the first move from position towards target, not in the forbidden direction, or -1 if there is no
+        such path or if position is the target.
+        """
+        self.expanded = 0
+        if position == target:
+            self.path.clear()
+            self.on_path.clear()
+            return -1
+        if self.repair(position, target) and self.get_direction(position, self.path[1]) != forbidden:
+            self.reuses += 1
+        elif not self.search(position, target, forbidden):
+            self.record_search()
+            return -1
+        self.record_search()
+        return self.get_direction(position, self.path[1])
+
+    def record_search(self):
+        """Report the expanded cells to the turn profiler, if any"""
+        if profiler.current is not None:
+            profiler.current.record_search('replanner', self.expanded)
+
+
 def main():
 
     maze = [
@@ -156,6 +430,7 @@ def main():
     path = AStar(maze).search(start, end)
 
     print(path)
+    print(HeapAStar(maze).search(start, end))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,435 @@
+"""
+Junction graph of a layout: the open cells compressed into a weighted graph whose nodes are the junctions, the dead ends
+and the ends of the portals, and whose edges are the corridors between them.
+
+Most cells of a maze have exactly two exits: a search that goes through them one by one spends most of its time walking
+down corridors where there is no choice to make. Here a corridor is walked in a single step, its weight being its
+number of moves. Every open cell is either a node or inside exactly one corridor, at an offset counted in moves from
+the start node of the corridor. A loop without any junction is given one node so that it has a place in the graph.
+
+Path searches are A* from node to node. Their estimates are raised by the distances to a few landmark nodes computed
+with the graph, and they never enter a dead region (a part of the graph joined to the rest by a single node) that holds
+neither end of the path. Measured by benchmarks/junctions.py, they expand about 8 times fewer nodes than HeapAStar
+expands cells on original.lay (5 against 42 per path), and 18 to 25 times fewer on generated 41x41 and 81x81 mazes. The
+searches of the closest food are plain Dijkstra, about 7 times fewer expansions than a breadth-first search on the cells
+of original.lay.
+
+Built from the neighbours of the navigation table of the layout, so a move out of the maze from a portal is an edge of
+length one between the two ends of the portal. Use `Layout.get_junction_graph`, which builds the graph on the first call
+and shares it with the copies of the layout.
+"""
+import heapq
+from array import array
+from typing import List, Tuple, Dict, Optional
+
+from libs import DIRECTIONS, profiler
+from libs.layouts import CellSet, manhattan_distance
+
+REVERSE = [DIRECTIONS.index((-dx, -dy)) for dx, dy in DIRECTIONS]
+NO_MOVE = -1
+GOAL = -1  # Node of the heap entries that reach the target (or the food) inside a corridor
+LANDMARKS = 8  # Nodes whose distances to every node bound the A* estimates
+UNREACHABLE = -1
+NO_ANCHOR = -1  # Anchor of the nodes outside the dead regions
+
+
+class Corridor(object):
+    """
+    Chain of cells with two exits between two nodes. `cells` excludes the nodes, the start and the end are the same node
+    for a loop.
+    """
+    start: Tuple[int, int]
+    end: Tuple[int, int]
+    cells: List[Tuple[int, int]]  # From the start to the end
+    length: int  # Moves from the start to the end
+    start_move: int  # Index in DIRECTIONS of the move from the start into the corridor
+    end_move: int  # Index in DIRECTIONS of the move from the end into the corridor
+    mask: int  # Bits of the cells in a CellSet of the layout, to count the food along the corridor
+
+    def __init__(self, start: Tuple[int, int], end: Tuple[int, int], cells: List[Tuple[int, int]], start_move: int,
+                 end_move: int, mask: int):
+        self.start = start
+        self.end = end
+        self.cells = cells
+        self.length = len(cells) + 1
+        self.start_move = start_move
+        self.end_move = end_move
+        self.mask = mask
+
+    def count_food(self, food: CellSet) -> int:
+        return (food.bits & self.mask).bit_count()
+
+    def get_food(self, food: CellSet) -> List[Tuple[int, int]]:
+        return [cell for cell in self.cells if cell in food]
+
+    def __repr__(self):
+        return f'Corridor({self.start} -> {self.end}, {self.length} moves)'
+
+
+class JunctionGraph(object):
+    """
+    Nodes and corridors of a layout. The searches count the nodes they expand in `expanded`, and report it to the turn
+    profiler like the cell searches of libs/greedy_shortest_path.py.
+    """
+    expanded: int = 0  # Number of nodes expanded by the last search
+
+    nodes: List[Tuple[int, int]]
+    corridors: List[Corridor]
+    edges: Dict[int, List[Tuple[int, int, int, int]]]  # By node cell: (other node cell, length, corridor, first move)
+
+    def __init__(self, layout):
+        self.cells = layout.cells
+        self.cell_index = layout.cell_index
+        neighbours = layout.navigation.neighbours
+        self.neighbours = neighbours
+        size = len(self.cells)
+        exits = [sum(neighbours[cell * len(DIRECTIONS) + move] != -1 for move in range(len(DIRECTIONS)))
+                 for cell in range(size)]
+        self.is_node = array('b', [exits[cell] != 2 for cell in range(size)])
+        for position in layout.portal_partners:
+            if position in self.cell_index:
+                self.is_node[self.cell_index[position]] = 1
+
+        self.corridor_of = array('i', [-1]) * size  # Corridor of each cell, -1 for the nodes
+        self.offset_of = array('i', [0]) * size  # Moves from the start of its corridor
+        self.forward_moves = array('b', [NO_MOVE]) * size  # Move of a corridor cell towards the end of its corridor
+        self.backward_moves = array('b', [NO_MOVE]) * size  # Move of a corridor cell towards the start of its corridor
+        self.corridors = []
+        self.edges = {}
+        self.food_width, self.food_height = layout.food.width, layout.food.height
+        for cell in range(size):
+            if self.is_node[cell]:
+                self.add_node(cell)
+        for cell in range(size):
+            if not self.is_node[cell] and self.corridor_of[cell] == -1:
+                # A loop without junction: this cell becomes its node
+                self.is_node[cell] = 1
+                self.add_node(cell)
+        self.nodes = [self.cells[cell] for cell in range(size) if self.is_node[cell]]
+
+        self.portal_ends = [position for position in layout.portal_partners if position in self.cell_index]
+        self.landmark_distances = self.choose_landmarks()
+        self.anchors = self.find_dead_regions()
+
+    def add_node(self, node: int):
+        """
+        Add the node and walk the corridors leaving it that were not walked from their other end yet.
+        """
+        edges = self.edges.setdefault(node, [])
+        for move in range(len(DIRECTIONS)):
+            if self.neighbours[node * len(DIRECTIONS) + move] == -1:
+                continue
+            if any(first_move == move for _, _, _, first_move in edges):
+                continue
+            self.walk_corridor(node, move)
+
+    def walk_corridor(self, start: int, start_move: int):
+        neighbours = self.neighbours
+        index = len(self.corridors)
+        cells, mask = [], 0
+        previous, move = start, start_move
+        cell = neighbours[start * len(DIRECTIONS) + move]
+        while not self.is_node[cell]:
+            self.corridor_of[cell] = index
+            self.offset_of[cell] = len(cells) + 1
+            self.backward_moves[cell] = REVERSE[move]
+            position = self.cells[cell]
+            cells.append(position)
+            if 0 <= position[0] < self.food_width and 0 <= position[1] < self.food_height:
+                mask |= 1 << (position[1] * self.food_width + position[0])
+            for next_move in range(len(DIRECTIONS)):
+                if next_move != REVERSE[move] and neighbours[cell * len(DIRECTIONS) + next_move] != -1:
+                    break
+            self.forward_moves[cell] = next_move
+            previous, move = cell, next_move
+            cell = neighbours[cell * len(DIRECTIONS) + move]
+        end = cell
+        # The move back is the reverse of the last move, except after going through a portal
+        end_move = REVERSE[move]
+        if neighbours[end * len(DIRECTIONS) + end_move] != previous:
+            end_move = next(
+                candidate for candidate in range(len(DIRECTIONS))
+                if neighbours[end * len(DIRECTIONS) + candidate] == previous
+                and not (end == start and candidate == start_move)
+            )
+        corridor = Corridor(self.cells[start], self.cells[end], cells, start_move, end_move, mask)
+        self.corridors.append(corridor)
+        self.edges.setdefault(start, []).append((end, corridor.length, index, start_move))
+        if end != start or end_move != start_move:
+            self.edges.setdefault(end, []).append((start, corridor.length, index, end_move))
+
+    def get_node_distances(self, source: int) -> array:
+        """
+        Moves from the source node to every node, by node cell (UNREACHABLE for the other cells).
+        """
+        distances = array('i', [UNREACHABLE]) * len(self.cells)
+        distances[source] = 0
+        open_nodes = [(0, source)]
+        while open_nodes:
+            distance, node = heapq.heappop(open_nodes)
+            if distance > distances[node]:
+                continue
+            for other, length, _, _ in self.edges[node]:
+                if distances[other] == UNREACHABLE or distance + length < distances[other]:
+                    distances[other] = distance + length
+                    heapq.heappush(open_nodes, (distance + length, other))
+        return distances
+
+    def choose_landmarks(self) -> List[array]:
+        """
+        Distances from LANDMARKS nodes spread over the graph, each one the farthest from the landmarks before it.
+        The difference of the distances of two nodes to a landmark is a lower bound of the distance between them.
+        """
+        nodes = [self.cell_index[node] for node in self.nodes]
+        if not nodes:
+            return []
+        first = self.get_node_distances(nodes[0])
+        landmarks = [self.get_node_distances(max(nodes, key=lambda node: first[node]))]
+        closest = list(landmarks[0])
+        while len(landmarks) < min(LANDMARKS, len(nodes)):
+            farthest = max(nodes, key=lambda node: closest[node])
+            if closest[farthest] <= 0:
+                break
+            landmarks.append(self.get_node_distances(farthest))
+            closest = [min(a, b) if b != UNREACHABLE else a for a, b in zip(closest, landmarks[-1])]
+        return landmarks
+
+    def find_dead_regions(self) -> array:
+        """
+        Anchor of the nodes of the dead regions, the parts of the graph joined to the rest by a single node (the anchor):
+        a shortest path only goes into one to reach a cell inside it. NO_ANCHOR for the other nodes. Found by removing
+        the nodes left with a single neighbour until none is left; the last node of a component that is a tree anchors
+        the whole component.
+        """
+        neighbours = {node: {other for other, _, _, _ in edges if other != node} for node, edges in self.edges.items()}
+        degrees = {node: len(others) for node, others in neighbours.items()}
+        parents = {}
+        leaves = [node for node, degree in degrees.items() if degree <= 1]
+        while leaves:
+            node = leaves.pop()
+            remaining = [other for other in neighbours[node] if other not in parents]
+            if node in parents or len(remaining) > 1:
+                continue
+            parents[node] = remaining[0] if remaining else node
+            for other in remaining:
+                degrees[other] -= 1
+                if degrees[other] <= 1:
+                    leaves.append(other)
+        anchors = array('i', [NO_ANCHOR]) * len(self.cells)
+        for node in parents:
+            chain = []
+            while node in parents and anchors[node] == NO_ANCHOR and parents[node] != node:
+                chain.append(node)
+                node = parents[node]
+            if parents.get(node) == node:
+                anchors[node] = node
+            anchor = anchors[node] if anchors[node] != NO_ANCHOR else node
+            for visited in chain:
+                anchors[visited] = anchor
+        return anchors
+
+    def get_end_nodes(self, cell: int) -> List[int]:
+        """
+        The cell itself for a node, the two ends of its corridor for the other cells.
+        """
+        if self.is_node[cell]:
+            return [cell]
+        corridor = self.corridors[self.corridor_of[cell]]
+        return [self.cell_index[corridor.start], self.cell_index[corridor.end]]
+
+    def is_junction(self, position: Tuple[int, int]) -> bool:
+        """
+        Whether the position is a node of the graph: a junction, a dead end, a portal or the node of a loop.
+        """
+        cell = self.cell_index.get(position)
+        return cell is not None and self.is_node[cell] == 1
+
+    def get_corridor(self, position: Tuple[int, int]) -> Optional[Tuple[Corridor, int]]:
+        """
+        Corridor of an open cell and its offset from the start of the corridor, None for the nodes and the walls.
+        """
+        cell = self.cell_index.get(position)
+        if cell is None or self.is_node[cell]:
+            return None
+        return self.corridors[self.corridor_of[cell]], self.offset_of[cell]
+
+    def get_exits(self, cell: int) -> List[Tuple[int, int, int]]:
+        """
+        (node cell, moves, first move) of the ways out of a cell: its edges for a node, the two ends of its corridor for
+        the other cells.
+        """
+        if self.is_node[cell]:
+            return [(other, length, move) for other, length, _, move in self.edges[cell]]
+        corridor, offset = self.corridors[self.corridor_of[cell]], self.offset_of[cell]
+        return [
+            (self.cell_index[corridor.start], offset, self.backward_moves[cell]),
+            (self.cell_index[corridor.end], corridor.length - offset, self.forward_moves[cell]),
+        ]
+
+    def heuristic(self, node: int, target: Tuple[int, int], portal_shortcut: int, target_distances: List[int]) -> int:
+        """
+        Lower bound of the moves from a node to the target: the Manhattan distance, lowered to account for the portals
+        like in HeapAStar, or the bound given by the landmarks if it is higher.
+        """
+        position = self.cells[node]
+        estimate = manhattan_distance(position, target)
+        if self.portal_ends:
+            estimate = min(estimate, portal_shortcut + min(manhattan_distance(position, end) for end in self.portal_ends))
+        for distances, target_distance in zip(self.landmark_distances, target_distances):
+            distance = distances[node]
+            if distance != UNREACHABLE and target_distance != UNREACHABLE and abs(distance - target_distance) > estimate:
+                estimate = abs(distance - target_distance)
+        return estimate
+
+    def get_target_distances(self, target_cell: int) -> List[int]:
+        """
+        Moves from each landmark to the target cell, through the nearest end of its corridor.
+        """
+        if self.is_node[target_cell]:
+            return [distances[target_cell] for distances in self.landmark_distances]
+        corridor, offset = self.corridors[self.corridor_of[target_cell]], self.offset_of[target_cell]
+        start, end = self.cell_index[corridor.start], self.cell_index[corridor.end]
+        result = []
+        for distances in self.landmark_distances:
+            through_ends = [distances[node] + moves for node, moves in ((start, offset), (end, corridor.length - offset))
+                            if distances[node] != UNREACHABLE]
+            result.append(min(through_ends, default=UNREACHABLE))
+        return result
+
+    def search(self, position: Tuple[int, int], target: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """
+        A* from node to node: (number of moves, index in DIRECTIONS of the first move) of a shortest path from position
+        to target, (0, NO_MOVE) if already there, None if there is no path or if a position is not an open cell.
+
+        The estimates are bounded by the landmarks, and the dead regions that hold neither the position nor the target
+        are never entered.
+        """
+        self.expanded = 0
+        cell, target_cell = self.cell_index.get(position), self.cell_index.get(target)
+        if cell is None or target_cell is None:
+            return None
+        if cell == target_cell:
+            return 0, NO_MOVE
+        portal_shortcut = 1 + min((manhattan_distance(end, target) for end in self.portal_ends), default=0)
+        target_distances = self.get_target_distances(target_cell)
+        anchors = self.anchors
+        allowed = {NO_ANCHOR} | {anchors[node] for node in self.get_end_nodes(cell) + self.get_end_nodes(target_cell)}
+        # Ways into the target from the nodes around it: (moves, first move from the node)
+        if self.is_node[target_cell]:
+            arrivals = {target_cell: (0, NO_MOVE)}
+        else:
+            corridor, offset = self.corridors[self.corridor_of[target_cell]], self.offset_of[target_cell]
+            arrivals = {}
+            for node, moves, move in ((corridor.start, offset, corridor.start_move),
+                                      (corridor.end, corridor.length - offset, corridor.end_move)):
+                node = self.cell_index[node]
+                if node not in arrivals or moves < arrivals[node][0]:
+                    arrivals[node] = (moves, move)
+
+        # Heap entries: (estimated length, -moves so far, node, first move), the deepest entry first among equals
+        open_nodes = []
+        if self.is_node[cell]:
+            heapq.heappush(open_nodes, (self.heuristic(cell, target, portal_shortcut, target_distances), 0, cell, NO_MOVE))
+        else:
+            if self.corridor_of[cell] == self.corridor_of[target_cell]:
+                # Same corridor: straight along it
+                offset, target_offset = self.offset_of[cell], self.offset_of[target_cell]
+                move = self.forward_moves[cell] if target_offset > offset else self.backward_moves[cell]
+                heapq.heappush(open_nodes, (abs(target_offset - offset), -abs(target_offset - offset), GOAL, move))
+            for node, moves, move in self.get_exits(cell):
+                estimate = self.heuristic(node, target, portal_shortcut, target_distances)
+                heapq.heappush(open_nodes, (moves + estimate, -moves, node, move))
+        closed = set()
+        while open_nodes:
+            _, distance, node, first_move = heapq.heappop(open_nodes)
+            distance = -distance
+            if node == GOAL:
+                self.record_search()
+                return distance, first_move
+            if node in closed:
+                continue
+            closed.add(node)
+            self.expanded += 1
+            if node in arrivals:
+                moves, move = arrivals[node]
+                heapq.heappush(open_nodes, (distance + moves, -distance - moves, GOAL,
+                                            first_move if first_move != NO_MOVE else move))
+            for other, length, _, move in self.edges[node]:
+                if other not in closed and anchors[other] in allowed:
+                    estimate = self.heuristic(other, target, portal_shortcut, target_distances)
+                    heapq.heappush(open_nodes, (distance + length + estimate, -distance - length, other,
+                                                first_move if first_move != NO_MOVE else move))
+        self.record_search()
+        return None
+
+    def get_distance(self, position: Tuple[int, int], target: Tuple[int, int]) -> Optional[int]:
+        """
+        Length of the shortest path between two open cells, or None if there is no such path.
+        """
+        result = self.search(position, target)
+        return None if result is None else result[0]
+
+    def get_next_move(self, position: Tuple[int, int], target: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """
+        First move of a shortest path from position to target, or None if already there or if there is no such path.
+        """
+        result = self.search(position, target)
+        return None if result is None or result[1] == NO_MOVE else DIRECTIONS[result[1]]
+
+    def search_nearest_food(self, position: Tuple[int, int], food: CellSet) -> Optional[Tuple[int, int]]:
+        """
+        Dijkstra from node to node: (number of moves, index in DIRECTIONS of the first move) of a shortest path to the
+        closest food, (0, NO_MOVE) if there is food at the position, None if no food can be reached. Corridors without
+        food are crossed in a single step, the cells of the others are only looked at when reaching the corridor.
+        """
+        self.expanded = 0
+        cell = self.cell_index.get(position)
+        if cell is None:
+            return None
+        if position in food:
+            return 0, NO_MOVE
+        open_nodes = []
+        if self.is_node[cell]:
+            heapq.heappush(open_nodes, (0, cell, NO_MOVE))
+        else:
+            corridor, offset = self.corridors[self.corridor_of[cell]], self.offset_of[cell]
+            if food.bits & corridor.mask:
+                for cells, move in ((corridor.cells[offset:], self.forward_moves[cell]),
+                                    (reversed(corridor.cells[:offset - 1]), self.backward_moves[cell])):
+                    for moves, food_cell in enumerate(cells, 1):
+                        if food_cell in food:
+                            heapq.heappush(open_nodes, (moves, GOAL, move))
+                            break
+            for node, moves, move in self.get_exits(cell):
+                heapq.heappush(open_nodes, (moves, node, move))
+        closed = set()
+        while open_nodes:
+            distance, node, first_move = heapq.heappop(open_nodes)
+            if node == GOAL:
+                self.record_search()
+                return distance, first_move
+            if node in closed:
+                continue
+            closed.add(node)
+            self.expanded += 1
+            if self.cells[node] in food:
+                self.record_search()
+                return distance, first_move
+            for other, length, index, edge_move in self.edges[node]:
+                move = first_move if first_move != NO_MOVE else edge_move
+                corridor = self.corridors[index]
+                if food.bits & corridor.mask:
+                    forward = self.cells[node] == corridor.start and edge_move == corridor.start_move
+                    for moves, food_cell in enumerate(corridor.cells if forward else reversed(corridor.cells), 1):
+                        if food_cell in food:
+                            heapq.heappush(open_nodes, (distance + moves, GOAL, move))
+                            break
+                if other not in closed:
+                    heapq.heappush(open_nodes, (distance + length, other, move))
+        self.record_search()
+        return None
+
+    def record_search(self):
+        """Report the expanded nodes to the turn profiler, if any"""
+        if profiler.current is not None:
+            profiler.current.record_search('junction_graph', self.expanded)
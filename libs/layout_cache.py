@@ -0,0 +1,199 @@
+"""
+Compiled layouts: the parsed grid of a layout and its precomputed tables, saved to a binary file that later games and
+worker processes map in memory instead of parsing the text and computing the shortest paths again.
+
+The files are stored in a cache directory (`.cache/layouts` at the root of the project, or the PACMAN_LAYOUT_CACHE
+environment variable) and named after the hash of the layout text, so a modified `.lay` file is compiled again and the
+old file is never read. File format, little endian:
+    magic b'PACL', version (H), padding (2 bytes), JSON header length (I), the JSON header (the dimensions, the actors,
+    the portals and the offset and length of each section), padded to 8 bytes, then the sections:
+    tiles (B per cell of the grid: bit 0 wall, bit 1 food, bit 2 cherry), neighbours (i, 4 per open cell),
+    pacman action masks (B per open cell), distances (H, open cells squared) and next moves (b, open cells squared).
+The distances and next moves are empty for the layouts too large to be precomputed.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from typing import Dict, Optional
+
+from libs.layouts import Layout, CellSet, NavigationTable, ActionIndex
+
+MAGIC = b'PACL'
+VERSION = 1
+HEADER = struct.Struct('<4sHxxI')
+ALIGNMENT = 8
+WALL, FOOD, CHERRY = 1, 2, 4
+GHOST_NAMES = ('blinky', 'pinky', 'inky', 'clyde')
+CACHE_DIRECTORY = os.environ.get(
+    'PACMAN_LAYOUT_CACHE', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'layouts')
+)
+
+_compiled: Dict[str, Layout] = {}  # Layouts mapped by this process, by path of their compiled file
+
+
+def get_layout_hash(layout_content: str) -> bytes:
+    return hashlib.blake2b(layout_content.encode(), digest_size=16).digest()
+
+
+def get_compiled_path(layout_content: str, directory: str = CACHE_DIRECTORY) -> str:
+    return os.path.join(directory, get_layout_hash(layout_content).hex() + '.layc')
+
+
+def compile_layout(layout: Layout, layout_hash: bytes) -> bytes:
+    """
+    Compiled file of a layout parsed from its text, with all the rows of its navigation table.
+    """
+    width, height = max((len(row) for row in layout.maze), default=0), len(layout.maze)
+    tiles = bytearray(width * height)
+    for x, y in layout.walls:
+        tiles[y * width + x] |= WALL
+    for x, y in layout.food:
+        tiles[y * width + x] |= FOOD
+    for x, y in layout.cherries:
+        tiles[y * width + x] |= CHERRY
+    navigation = layout.navigation
+    precomputed = all(row is not None for row in navigation.distances)
+    sections = {
+        'tiles': bytes(tiles),
+        'neighbours': navigation.neighbours.tobytes(),
+        'actions': bytes(layout.actions.get_masks(layout.cells)),
+        'distances': b''.join(row.tobytes() for row in navigation.distances) if precomputed else b'',
+        'next_moves': b''.join(row.tobytes() for row in navigation.next_moves) if precomputed else b'',
+    }
+    offsets, offset = {}, 0
+    for name, data in sections.items():
+        offsets[name] = [offset, len(data)]
+        offset += -len(data) % ALIGNMENT + len(data)
+    header = json.dumps({
+        'hash': layout_hash.hex(),
+        'width': width,
+        'height': height,
+        'row_lengths': [len(row) for row in layout.maze],
+        'pacman': layout.pacman,
+        'ghosts': {name: getattr(layout, name) for name in GHOST_NAMES},
+        'portals': {str(portal): ends for portal, ends in layout.portals.items()},
+        'cells': len(layout.cells),
+        'sections': offsets,
+    }).encode()
+    header += b' ' * (-(HEADER.size + len(header)) % ALIGNMENT)
+    body = b''.join(data + bytes(-len(data) % ALIGNMENT) for data in sections.values())
+    return HEADER.pack(MAGIC, VERSION, len(header)) + header + body
+
+
+def read_compiled_layout(path: str, layout_hash: Optional[bytes] = None) -> Layout:
+    """
+    Layout whose static data are read-only views of the memory-mapped compiled file. Raises ValueError if the file is
+    not a compiled layout of this version, or not the one of the expected hash.
+    """
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version, header_length = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a compiled layout, or was written by another version')
+        header = json.loads(bytes(data[HEADER.size:HEADER.size + header_length]))
+        if layout_hash is not None and header['hash'] != layout_hash.hex():
+            raise ValueError(f'{path} is the compiled file of another layout')
+        start = HEADER.size + header_length
+        view = memoryview(data)
+        sections = {}
+        for name, (offset, length) in header['sections'].items():
+            if start + offset + length > len(data):
+                raise ValueError(f'{path} is truncated')
+            sections[name] = view[start + offset:start + offset + length]
+    except (struct.error, KeyError, TypeError, json.JSONDecodeError) as error:
+        raise ValueError(f'{path} is not a valid compiled layout: {error}')
+
+    width, height, size = header['width'], header['height'], header['cells']
+    tiles = sections['tiles']
+    layout = Layout.__new__(Layout)
+    layout.maze = [[tile & WALL for tile in tiles[y * width:y * width + length]] for y, length in enumerate(header['row_lengths'])]
+    layout.walls = frozenset((x, y) for y, row in enumerate(layout.maze) for x, tile in enumerate(row) if tile)
+    layout.food = CellSet(width, height)
+    layout.cherries = CellSet(width, height)
+    for y, row in enumerate(layout.maze):
+        for x in range(len(row)):
+            tile = tiles[y * width + x]
+            if tile & FOOD:
+                layout.food.add((x, y))
+            if tile & CHERRY:
+                layout.cherries.add((x, y))
+    layout.initial_food_count = len(layout.food)
+    layout.pacman = tuple(header['pacman'])
+    for name, position in header['ghosts'].items():
+        setattr(layout, name, tuple(position))
+    layout.portals = {
+        int(portal): (tuple(entrance), tuple(exit) if exit is not None else None)
+        for portal, (entrance, exit) in header['portals'].items()
+    }
+    layout.build_portal_index()
+    layout.cells = [(x, y) for y, row in enumerate(layout.maze) for x, tile in enumerate(row) if tile == 0]
+    layout.cell_index = {cell: index for index, cell in enumerate(layout.cells)}
+
+    neighbours = sections['neighbours'].cast('i')
+    if sections['distances']:
+        distances = sections['distances'].cast('H')
+        next_moves = sections['next_moves'].cast('b')
+        distance_rows = [distances[target * size:(target + 1) * size] for target in range(size)]
+        next_move_rows = [next_moves[target * size:(target + 1) * size] for target in range(size)]
+    else:
+        distance_rows, next_move_rows = [None] * size, [None] * size
+    layout.navigation = NavigationTable.from_rows(neighbours, distance_rows, next_move_rows)
+    layout.actions = ActionIndex.from_masks(layout.cells, layout.walls, layout.maze, sections['actions'])
+    layout.compiled_path = path
+    return layout
+
+
+def write_compiled_layout(layout: Layout, layout_hash: bytes, path: str):
+    """
+    Write the compiled file through a temporary file, so other processes never read a partial file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        f.write(compile_layout(layout, layout_hash))
+    os.replace(temporary_path, path)
+
+
+def load_layout(layout_content: str, directory: Optional[str] = CACHE_DIRECTORY) -> Layout:
+    """
+    Layout of this text, mapped from its compiled file, which is written first if there is none yet (or if it is
+    invalid). Each call returns a copy with its own food and cherries, like `Layout(layout_content)` does.
+    Without a directory, or if the cache can't be written, the text is parsed as usual.
+    """
+    if directory is None:
+        return Layout(layout_content)
+    layout_hash = get_layout_hash(layout_content)
+    path = get_compiled_path(layout_content, directory)
+    layout = _compiled.get(path)
+    if layout is None:
+        try:
+            layout = read_compiled_layout(path, layout_hash)
+        except (OSError, ValueError) as error:
+            if not isinstance(error, FileNotFoundError):
+                logging.warning(f'Compiling the layout again: {error}')
+            layout = Layout(layout_content)
+            try:
+                write_compiled_layout(layout, layout_hash, path)
+                layout = read_compiled_layout(path, layout_hash)
+            except OSError as error:
+                logging.warning(f'Could not write the compiled layout to {path}: {error}')
+                return layout
+        _compiled[path] = layout
+    return layout.copy()
+
+
+def restore_layout(path: str, food: int, cherries: int) -> Layout:
+    """
+    Unpickle a layout mapped from a compiled file (see Layout.__reduce_ex__).
+    """
+    layout = _compiled.get(path)
+    if layout is None:
+        layout = _compiled[path] = read_compiled_layout(path)
+    result = layout.copy()
+    result.food.bits = food
+    result.cherries.bits = cherries
+    return result
@@ -1,19 +1,277 @@
-from typing import List, Tuple, Dict, Optional
+import logging
+from array import array
+from collections import deque
+from typing import List, Tuple, Dict, Optional, Iterable, Iterator, FrozenSet
 
-from libs import BaseClass
+from libs import BaseClass, DIRECTIONS, profiler
+
+UNREACHABLE = 0xFFFF  # Distance stored for cells that cannot reach the target
+NO_MOVE = -1  # Next move stored for the target itself and for cells that cannot reach it
+MAX_PRECOMPUTED_CELLS = 4096  # Above this number of open cells, the rows of the navigation table are computed on demand
 
 
 def manhattan_distance(position1: Tuple[int, int], position2: Tuple[int, int]):
     return abs(position1[0] - position2[0]) + abs(position1[1] - position2[1])
 
 
+class CellSet(object):
+    """
+    Mutable set of cells of a layout, stored as a bitset where bit `y * width + x` is set for the cell (x, y).
+
+    Membership and removal are O(1), and iteration goes through the cells in reading order, like the lists the layout
+    used to hold.
+    """
+    bits: int
+    width: int
+    height: int
+
+    def __init__(self, width: int, height: int, cells: Iterable[Tuple[int, int]] = ()):
+        self.width = width
+        self.height = height
+        self.bits = 0
+        for cell in cells:
+            self.add(cell)
+
+    def get_bit(self, cell: Tuple[int, int]) -> int:
+        x, y = cell
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return 1 << (y * self.width + x)
+        return 0
+
+    def add(self, cell: Tuple[int, int]):
+        bit = self.get_bit(cell)
+        if not bit:
+            raise ValueError(f'{cell} is outside of the layout')
+        self.bits |= bit
+
+    def remove(self, cell: Tuple[int, int]):
+        bit = self.get_bit(cell)
+        if not self.bits & bit:
+            raise KeyError(cell)
+        self.bits ^= bit
+
+    def discard(self, cell: Tuple[int, int]):
+        self.bits &= ~self.get_bit(cell)
+
+    def copy(self) -> 'CellSet':
+        result = CellSet.__new__(CellSet)
+        result.width, result.height, result.bits = self.width, self.height, self.bits
+        return result
+
+    def __deepcopy__(self, memodict):
+        return self.copy()
+
+    def __contains__(self, cell) -> bool:
+        return bool(self.bits & self.get_bit(cell))
+
+    def __len__(self) -> int:
+        return self.bits.bit_count()
+
+    def __bool__(self) -> bool:
+        return self.bits != 0
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        bits = self.bits
+        while bits:
+            lowest = bits & -bits
+            index = lowest.bit_length() - 1
+            yield index % self.width, index // self.width
+            bits ^= lowest
+
+    def __getitem__(self, index: int) -> Tuple[int, int]:
+        """
+        Positional access kept for agents written when food and cherries were lists. O(n), prefer iterating.
+        """
+        return list(self)[index]
+
+    def __repr__(self):
+        return f'CellSet({list(self)})'
+
+
+class NavigationTable(object):
+    """
+    Shortest path distances and next moves between every pair of open cells of a layout, portals included.
+
+    Rows are indexed by target cell: `distances[target][cell]` is the number of moves needed to go from `cell` to
+    `target`, and `next_moves[target][cell]` is the index in DIRECTIONS of the first of these moves.
+    The table is static, so it is shared instead of copied when a layout is deep-copied.
+    """
+    neighbours: array  # neighbours[cell * 4 + direction] is the cell reached by moving in that direction, or -1
+    precomputed: bool  # Whether all the rows were computed upfront, or are computed on demand
+    junction_graph = None  # Built on demand by Layout.get_junction_graph
+    distances: List[Optional[array]]
+    next_moves: List[Optional[array]]
+
+    def __init__(self, neighbours: array, precompute: bool = True):
+        self.neighbours = neighbours
+        self.size = len(neighbours) // len(DIRECTIONS)
+        self.build_predecessors()
+        self.distances = [None] * self.size
+        self.next_moves = [None] * self.size
+        self.precomputed = precompute
+        if precompute:
+            for target in range(self.size):
+                self.compute_row(target)
+
+    @classmethod
+    def from_rows(cls, neighbours, distances: List, next_moves: List) -> 'NavigationTable':
+        """
+        Table with rows computed beforehand, like the read-only views of a compiled layout (see libs/layout_cache.py).
+        Rows left to None are computed on demand.
+        """
+        table = cls.__new__(cls)
+        table.neighbours = neighbours
+        table.size = len(neighbours) // len(DIRECTIONS)
+        table.build_predecessors()
+        table.distances = distances
+        table.next_moves = next_moves
+        table.precomputed = all(row is not None for row in distances)
+        return table
+
+    def __deepcopy__(self, memodict):
+        return self
+
+    def build_predecessors(self):
+        self.predecessors: List[List[Tuple[int, int]]] = [[] for _ in range(self.size)]
+        for cell in range(self.size):
+            for direction in range(len(DIRECTIONS)):
+                neighbour = self.neighbours[cell * len(DIRECTIONS) + direction]
+                if neighbour != -1:
+                    self.predecessors[neighbour].append((cell, direction))
+
+    def compute_row(self, target: int):
+        """
+        Breadth first search backwards from the target, filling the distances and the next moves towards it.
+        """
+        distances = array('H', [UNREACHABLE]) * self.size
+        next_moves = array('b', [NO_MOVE]) * self.size
+        distances[target] = 0
+        queue = deque([target])
+        expanded = 0
+        while queue:
+            cell = queue.popleft()
+            expanded += 1
+            distance = distances[cell] + 1
+            for previous, direction in self.predecessors[cell]:
+                if distances[previous] == UNREACHABLE:
+                    distances[previous] = distance
+                    next_moves[previous] = direction
+                    queue.append(previous)
+        self.distances[target] = distances
+        self.next_moves[target] = next_moves
+        if profiler.current is not None:
+            profiler.current.record_search('navigation row', expanded)
+
+    def get_distance(self, cell: int, target: int) -> int:
+        if self.distances[target] is None:
+            self.compute_row(target)
+        return self.distances[target][cell]
+
+    def get_next_move(self, cell: int, target: int, forbidden: int = NO_MOVE) -> int:
+        """
+        Index of the first move of a shortest path from cell to target, or NO_MOVE.
+
+        When a forbidden move is given (ghosts can't reverse), the best of the other moves is returned instead.
+        """
+        if self.distances[target] is None:
+            self.compute_row(target)
+        move = self.next_moves[target][cell]
+        if move == NO_MOVE or move != forbidden:
+            return move
+        distances = self.distances[target]
+        best_move, best_distance = NO_MOVE, UNREACHABLE
+        for direction in range(len(DIRECTIONS)):
+            neighbour = self.neighbours[cell * len(DIRECTIONS) + direction]
+            if direction != forbidden and neighbour != -1 and distances[neighbour] < best_distance:
+                best_move, best_distance = direction, distances[neighbour]
+        return best_move
+
+
+class ActionIndex(object):
+    """
+    Legal moves of every open cell, computed once per layout and shared between copies.
+
+    Pacman can move towards any neighbour that is inside the maze and is not a wall. Ghosts also can't go backwards,
+    unless there is no other way, so their moves are indexed by cell and by current direction.
+    """
+    pacman: Dict[Tuple[int, int], Tuple[Tuple[int, int], ...]]
+    ghosts: Dict[Tuple[Tuple[int, int], Tuple[int, int]], Tuple[Tuple[int, int], ...]]
+
+    def __init__(self, cells: Iterable[Tuple[int, int]], walls: FrozenSet[Tuple[int, int]], maze: List[List[int]]):
+        self.walls = walls
+        self.maze = maze
+        self.pacman = {}
+        self.ghosts = {}
+        for cell in cells:
+            self.pacman[cell] = self.compute_pacman_actions(cell)
+            for direction in DIRECTIONS:
+                self.ghosts[(cell, direction)] = self.compute_ghost_actions(cell, direction)
+
+    @classmethod
+    def from_masks(cls, cells: Iterable[Tuple[int, int]], walls: FrozenSet[Tuple[int, int]], maze: List[List[int]],
+                   masks: Iterable[int]) -> 'ActionIndex':
+        """
+        Index rebuilt from the legal moves of pacman on each cell, as bits of the indices in DIRECTIONS (see get_masks).
+        """
+        index = cls.__new__(cls)
+        index.walls = walls
+        index.maze = maze
+        index.pacman = {}
+        index.ghosts = {}
+        moves = {}  # Pacman actions and ghost actions for each direction, by mask
+        for cell, mask in zip(cells, masks):
+            if mask not in moves:
+                actions = tuple(direction for bit, direction in enumerate(DIRECTIONS) if mask >> bit & 1)
+                ghost_actions = []
+                for direction in DIRECTIONS:
+                    reverse = (direction[0] * -1, direction[1] * -1)
+                    forward = tuple(action for action in actions if action != reverse)
+                    ghost_actions.append((direction, forward if forward else (reverse,)))
+                moves[mask] = actions, ghost_actions
+            actions, ghost_actions = moves[mask]
+            index.pacman[cell] = actions
+            for direction, forward in ghost_actions:
+                index.ghosts[(cell, direction)] = forward
+        return index
+
+    def __deepcopy__(self, memodict):
+        return self
+
+    def get_masks(self, cells: Iterable[Tuple[int, int]]) -> List[int]:
+        return [sum(1 << DIRECTIONS.index(action) for action in self.pacman[cell]) for cell in cells]
+
+    def is_open(self, position: Tuple[int, int]) -> bool:
+        x, y = position
+        return 0 <= y < len(self.maze) and 0 <= x < len(self.maze[y]) and position not in self.walls
+
+    def compute_pacman_actions(self, position: Tuple[int, int]) -> Tuple[Tuple[int, int], ...]:
+        return tuple(
+            direction for direction in DIRECTIONS
+            if self.is_open((position[0] + direction[0], position[1] + direction[1]))
+        )
+
+    def compute_ghost_actions(self, position: Tuple[int, int], direction: Tuple[int, int]) -> Tuple[Tuple[int, int], ...]:
+        reverse = (direction[0] * -1, direction[1] * -1)
+        actions = tuple(action for action in self.compute_pacman_actions(position) if action != reverse)
+        return actions if actions else (reverse,)
+
+    def get_pacman_actions(self, position: Tuple[int, int]) -> Tuple[Tuple[int, int], ...]:
+        actions = self.pacman.get(position)
+        return actions if actions is not None else self.compute_pacman_actions(position)
+
+    def get_ghost_actions(self, position: Tuple[int, int], direction: Tuple[int, int]) -> Tuple[Tuple[int, int], ...]:
+        actions = self.ghosts.get((position, direction))
+        return actions if actions is not None else self.compute_ghost_actions(position, direction)
+
+
 class Layout(BaseClass):
-    maze: List[List[int]] = []
-    walls: List[Tuple[int, int]]
-    portals: Dict[int, Tuple[Tuple[int, int], Optional[Tuple[int, int]]]] = {}
+    maze: List[List[int]]
+    walls: FrozenSet[Tuple[int, int]]
+    portals: Dict[int, Tuple[Tuple[int, int], Optional[Tuple[int, int]]]]
+    portal_partners: Dict[Tuple[int, int], Tuple[int, int]]  # Each end of a paired portal, mapped to the other end
 
-    food: List[Tuple[int, int]]
-    cherries: List[Tuple[int, int]]
+    food: CellSet
+    cherries: CellSet
 
     pacman: Tuple[int, int]
 
@@ -23,11 +281,19 @@ class Layout(BaseClass):
     clyde: Tuple[int, int] = (-1, -1)
 
     initial_food_count: int
+    compiled_path: Optional[str] = None  # Compiled file the static data is mapped from, see libs/layout_cache.py
+
+    cells: List[Tuple[int, int]]  # Open cells, in reading order
+    cell_index: Dict[Tuple[int, int], int]
+    navigation: NavigationTable
+    actions: ActionIndex
 
     def __init__(self, layout_text: str):
-        self.walls = []
-        self.food = []
-        self.cherries = []
+        self.maze = []
+        walls = []
+        self.portals = {}
+        food = []
+        cherries = []
 
         ghosts_table = ['b', 'p', 'i', 'c']
 
@@ -36,15 +302,15 @@ class Layout(BaseClass):
             for x, char in enumerate(line):
                 if char == '%':
                     self.maze[y].append(1)
-                    self.walls.append((x, y))
+                    walls.append((x, y))
                 else:
                     self.maze[y].append(0)
                 if char == ' ':
                     continue
                 elif char == '.':
-                    self.food.append((x, y))
+                    food.append((x, y))
                 elif char == 'o':
-                    self.cherries.append((x, y))
+                    cherries.append((x, y))
                 elif char == 'P':
                     self.pacman = (x, y)
                 elif char == 'G':
@@ -57,14 +323,66 @@ class Layout(BaseClass):
                             self.add_to_portal(int(char), (x, y))
                     except ValueError:
                         continue
+        width, height = max((len(row) for row in self.maze), default=0), len(self.maze)
+        self.walls = frozenset(walls)
+        self.food = CellSet(width, height, food)
+        self.cherries = CellSet(width, height, cherries)
         self.initial_food_count = len(self.food)
+        self.build_portal_index()
+        self.build_navigation_table()
+
+    def copy(self) -> 'Layout':
+        """
+        Copy of the layout sharing its static data (maze, walls, portals and precomputed tables). Only the food and the
+        cherries, that are eaten during the game, belong to the copy.
+        """
+        result = self.shallow_copy()
+        result.food = self.food.copy()
+        result.cherries = self.cherries.copy()
+        return result
+
+    def __deepcopy__(self, memodict):
+        return self.copy()
+
+    def __reduce_ex__(self, protocol):
+        """
+        A layout mapped from a compiled file is pickled as the path of the file (and its food and cherries), so the
+        processes it is sent to map the same file instead of receiving a copy of its tables.
+        """
+        if self.compiled_path is None:
+            return super().__reduce_ex__(protocol)
+        from libs.layout_cache import restore_layout
+        return restore_layout, (self.compiled_path, self.food.bits, self.cherries.bits)
 
     def add_to_portal(self, portal: int, position: Tuple[int, int]):
         if portal in self.portals.keys():
+            if self.portals[portal][1] is not None:
+                raise ValueError(f'Portal {portal} has more than two ends')
             self.portals[portal] = (self.portals[portal][0], position)
         else:
             self.portals[portal] = (position, None)
 
+    def build_portal_index(self):
+        """
+        Map each end of a portal to the other end. A portal with a single end doesn't lead anywhere: its cell is an
+        ordinary open cell.
+        """
+        self.portal_partners = {}
+        for portal, (entrance, exit) in self.portals.items():
+            if exit is None:
+                logging.warning(f'Portal {portal} at {entrance} has no other end, it is ignored')
+                continue
+            self.portal_partners[entrance], self.portal_partners[exit] = exit, entrance
+
+    def is_portal(self, position: Tuple[int, int]) -> bool:
+        return position in self.portal_partners
+
+    def get_portal_partner(self, position: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """
+        Other end of the portal at this position, None if there is no (paired) portal there.
+        """
+        return self.portal_partners.get(position)
+
     def set_ghost_start(self, ghost_vowel: str, position: Tuple[int, int]):
         if ghost_vowel == 'b':
             self.blinky = position
@@ -77,3 +395,100 @@ class Layout(BaseClass):
 
     def get_dimensions(self):
         return max(x for x, y in self.walls) + 1, max(y for x, y in self.walls) + 1
+
+    def build_navigation_table(self):
+        """
+        Index the open cells and precompute the shortest paths between them.
+
+        Moving out of the maze from a portal leads to the other end of the portal.
+        """
+        self.cells = [(x, y) for y, row in enumerate(self.maze) for x, tile in enumerate(row) if tile == 0]
+        self.cell_index = {cell: index for index, cell in enumerate(self.cells)}
+        neighbours = array('i')
+        for cell in self.cells:
+            for direction in DIRECTIONS:
+                neighbour = (cell[0] + direction[0], cell[1] + direction[1])
+                if not (0 <= neighbour[1] < len(self.maze) and 0 <= neighbour[0] < len(self.maze[neighbour[1]])):
+                    neighbour = self.portal_partners.get(cell)
+                neighbours.append(self.cell_index.get(neighbour, -1))
+        self.navigation = NavigationTable(neighbours, precompute=len(self.cells) <= MAX_PRECOMPUTED_CELLS)
+        self.actions = ActionIndex(self.cells, self.walls, self.maze)
+
+    def get_legal_actions(self, position: Tuple[int, int]) -> Tuple[Tuple[int, int], ...]:
+        """
+        Moves that don't lead into a wall or out of the maze, in the order right, left, up, down.
+        """
+        return self.actions.get_pacman_actions(position)
+
+    def get_ghost_legal_actions(self, position: Tuple[int, int], direction: Tuple[int, int]) -> Tuple[Tuple[int, int], ...]:
+        """
+        Same as get_legal_actions, without going backwards unless it is the only way.
+        """
+        return self.actions.get_ghost_actions(position, direction)
+
+    def get_distance(self, position: Tuple[int, int], target: Tuple[int, int]) -> Optional[int]:
+        """
+        Length of the shortest path between two open cells, or None if there is no such path.
+        """
+        if profiler.current is not None:
+            profiler.current.record_search('get_distance')
+        cell, target_cell = self.cell_index.get(position), self.cell_index.get(target)
+        if cell is None or target_cell is None:
+            return None
+        distance = self.navigation.get_distance(cell, target_cell)
+        return None if distance == UNREACHABLE else distance
+
+    def get_next_move(self, position: Tuple[int, int], target: Tuple[int, int],
+                      direction: Optional[Tuple[int, int]] = None) -> Optional[Tuple[int, int]]:
+        """
+        First move of a shortest path from position to target, or None if already there or if there is no such path.
+
+        If the current direction is given, going backwards is not allowed, like for the ghosts.
+        """
+        if profiler.current is not None:
+            profiler.current.record_search('get_next_move')
+        cell, target_cell = self.cell_index.get(position), self.cell_index.get(target)
+        if cell is None or target_cell is None or cell == target_cell:
+            return None
+        reverse = None if direction is None else (-direction[0], -direction[1])
+        forbidden = DIRECTIONS.index(reverse) if reverse in DIRECTIONS else NO_MOVE
+        move = self.navigation.get_next_move(cell, target_cell, forbidden)
+        return None if move == NO_MOVE else DIRECTIONS[move]
+
+    def get_junction_graph(self):
+        """
+        Junctions and corridors of the layout (see libs/junction_graph.py), built on the first call. The graph is kept
+        with the navigation table, so the copies of the layout share it.
+        """
+        if self.navigation.junction_graph is None:
+            from libs.junction_graph import JunctionGraph
+            self.navigation.junction_graph = JunctionGraph(self)
+        return self.navigation.junction_graph
+
+    def predict_pacman(self, position: Tuple[int, int], direction: Tuple[int, int],
+                       steps: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """
+        Fast and unreliable prediction of the cell and direction of pacman after a number of steps, used as the target
+        of the Pinky agent. Walks the neighbours of the navigation table, so a move out of the maze from a portal leads
+        to the other end of the portal.
+
+        Pacman goes straight, and turns to the first open direction (right, left, up, down) when facing a wall. He
+        stays where he is if he can't move at all, or if he is not on an open cell.
+        """
+        cell = self.cell_index.get(position)
+        if cell is None:
+            return position, direction
+        neighbours = self.navigation.neighbours
+        move = DIRECTIONS.index(direction) if direction in DIRECTIONS else NO_MOVE
+        for _ in range(steps):
+            neighbour = neighbours[cell * len(DIRECTIONS) + move] if move != NO_MOVE else -1
+            if neighbour == -1:
+                for turn in range(len(DIRECTIONS)):
+                    neighbour = neighbours[cell * len(DIRECTIONS) + turn]
+                    if neighbour != -1:
+                        move = turn
+                        break
+                else:
+                    break
+            cell = neighbour
+        return self.cells[cell], DIRECTIONS[move] if move != NO_MOVE else direction
@@ -0,0 +1,150 @@
+"""
+Random mazes in the layout format parsed by libs/layouts.py, to test the engine on layouts much larger than the shipped
+ones.
+
+The walls are carved by a depth-first search in a grid of odd dimensions, where the cells with two odd coordinates are
+open, which gives a maze with a single path between any two cells. A share of the remaining inner walls between two
+open cells is then removed to add loops. Portals join the two ends of an odd row or column, on the border of the maze.
+Everything is drawn from `random.Random(seed)`, so the same parameters always give the same layout.
+
+Usage: python -m libs.maze_generator WIDTH HEIGHT [--seed 0] [--loops 0.1] [--portals 1] [--cherries 4] [--ghosts 4]
+    [--ghost-placement center] [--food 1.0] [-o layout.lay]
+"""
+import argparse
+import random
+from typing import List, Tuple
+
+from libs.layouts import manhattan_distance
+
+GHOST_CHARACTERS = ('b', 'p', 'i', 'c')
+GHOST_PLACEMENTS = ('center', 'corners', 'random')
+MIN_SIZE = 7
+MAX_PORTALS = 10  # Portals are numbered with a single digit
+
+
+def carve_maze(width: int, height: int, generator: random.Random) -> List[List[int]]:
+    """
+    Grid of walls (1) and open tiles (0) of a perfect maze, by an iterative depth-first search.
+    """
+    grid = [[1] * width for _ in range(height)]
+    start = (generator.randrange(1, width, 2), generator.randrange(1, height, 2))
+    grid[start[1]][start[0]] = 0
+    stack = [start]
+    while stack:
+        x, y = stack[-1]
+        unvisited = [
+            (x + dx, y + dy) for dx, dy in ((2, 0), (-2, 0), (0, 2), (0, -2))
+            if 0 < x + dx < width - 1 and 0 < y + dy < height - 1 and grid[y + dy][x + dx]
+        ]
+        if not unvisited:
+            stack.pop()
+            continue
+        nx, ny = generator.choice(unvisited)
+        grid[(y + ny) // 2][(x + nx) // 2] = 0
+        grid[ny][nx] = 0
+        stack.append((nx, ny))
+    return grid
+
+
+def add_loops(grid: List[List[int]], loop_density: float, generator: random.Random):
+    """
+    Remove this share of the inner walls standing between two open tiles.
+    """
+    height, width = len(grid), len(grid[0])
+    candidates = [
+        (x, y) for y in range(1, height - 1) for x in range(1, width - 1)
+        if grid[y][x] and (x + y) % 2 == 1
+        and ((grid[y][x - 1] == 0 and grid[y][x + 1] == 0) or (grid[y - 1][x] == 0 and grid[y + 1][x] == 0))
+    ]
+    for x, y in generator.sample(candidates, int(len(candidates) * loop_density)):
+        grid[y][x] = 0
+
+
+def closest_cells(cells: List[Tuple[int, int]], target: Tuple[float, float], count: int) -> List[Tuple[int, int]]:
+    return sorted(cells, key=lambda cell: (abs(cell[0] - target[0]) + abs(cell[1] - target[1]), cell))[:count]
+
+
+def generate_layout(width: int, height: int, seed: int = 0, loop_density: float = 0.1, portals: int = 1,
+                    cherries: int = 4, ghosts: int = 4, ghost_placement: str = 'center', food_density: float = 1.0) -> str:
+    """
+    Text of a random layout. Even dimensions are reduced by one, the maze needs odd ones.
+
+    loop_density is the share of the inner walls between two open tiles that are removed (0 keeps a maze without loops).
+    ghost_placement puts the ghosts on the open cells closest to the center, to the corners, or on random cells away
+    from pacman, who starts in the middle of the lower half. food_density is the share of the other open cells with food.
+    """
+    width, height = width - 1 + width % 2, height - 1 + height % 2
+    if width < MIN_SIZE or height < MIN_SIZE:
+        raise ValueError(f'The maze must be at least {MIN_SIZE}x{MIN_SIZE}')
+    if not 0 <= ghosts <= len(GHOST_CHARACTERS):
+        raise ValueError(f'There can be 0 to {len(GHOST_CHARACTERS)} ghosts')
+    if ghost_placement not in GHOST_PLACEMENTS:
+        raise ValueError(f'Unknown ghost placement {ghost_placement}, use one of {", ".join(GHOST_PLACEMENTS)}')
+    generator = random.Random(seed)
+    grid = carve_maze(width, height, generator)
+    add_loops(grid, loop_density, generator)
+    tiles = [['%' if wall else ' ' for wall in row] for row in grid]
+
+    slots = [((0, y), (width - 1, y)) for y in range(1, height - 1, 2)] + \
+            [((x, 0), (x, height - 1)) for x in range(1, width - 1, 2)]
+    if not 0 <= portals <= min(MAX_PORTALS, len(slots)):
+        raise ValueError(f'There can be 0 to {min(MAX_PORTALS, len(slots))} portals in this maze')
+    for number, ends in enumerate(generator.sample(slots, portals)):
+        for x, y in ends:
+            tiles[y][x] = str(number)
+
+    cells = [(x, y) for y in range(1, height - 1) for x in range(1, width - 1) if grid[y][x] == 0]
+    pacman = closest_cells(cells, (width / 2, height * 3 / 4), 1)[0]
+    tiles[pacman[1]][pacman[0]] = 'P'
+    cells.remove(pacman)
+    if ghost_placement == 'center':
+        ghost_cells = closest_cells(cells, (width / 2, height / 2), ghosts)
+    elif ghost_placement == 'corners':
+        corners = [(0, 0), (width, 0), (0, height), (width, height)]
+        ghost_cells = []
+        for corner in corners[:ghosts]:
+            ghost_cells += closest_cells([cell for cell in cells if cell not in ghost_cells], corner, 1)
+    else:
+        away = [cell for cell in cells if manhattan_distance(cell, pacman) >= (width + height) // 4]
+        ghost_cells = generator.sample(away if len(away) >= ghosts else cells, ghosts)
+    for character, (x, y) in zip(GHOST_CHARACTERS, ghost_cells):
+        tiles[y][x] = character
+        cells.remove((x, y))
+
+    if cherries > len(cells):
+        raise ValueError(f'There is only room for {len(cells)} cherries')
+    for x, y in generator.sample(cells, cherries):
+        tiles[y][x] = 'o'
+    for x, y in cells:
+        if tiles[y][x] == ' ' and generator.random() < food_density:
+            tiles[y][x] = '.'
+    return ''.join(''.join(row) + '\n' for row in tiles)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a random maze in the layout format')
+    parser.add_argument('width', type=int, help='Width of the maze, reduced by one if even')
+    parser.add_argument('height', type=int, help='Height of the maze, reduced by one if even')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+    parser.add_argument('--loops', type=float, default=0.1, help='Share of the inner walls removed to make loops')
+    parser.add_argument('--portals', type=int, default=1, help='Number of portals')
+    parser.add_argument('--cherries', type=int, default=4, help='Number of cherries')
+    parser.add_argument('--ghosts', type=int, default=4, help='Number of ghosts, from 0 to 4')
+    parser.add_argument('--ghost-placement', default='center', choices=GHOST_PLACEMENTS, help='Where the ghosts start')
+    parser.add_argument('--food', type=float, default=1.0, help='Share of the open cells with food')
+    parser.add_argument('-o', '--output', help='File to write the layout to, printed if not given', default=None)
+    args = parser.parse_args()
+    try:
+        content = generate_layout(args.width, args.height, args.seed, args.loops, args.portals, args.cherries,
+                                  args.ghosts, args.ghost_placement, args.food)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(content)
+    else:
+        print(content, end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,15 @@
+import atexit
+import logging
+import math
+import multiprocessing
+import os
 import random
-from copy import copy
+import time
+from typing import Dict, Tuple
 
 from libs import PacmanAgent
 from libs.layouts import manhattan_distance
+from libs.zobrist import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
 
 
 class RightTurnAgent(PacmanAgent):
@@ -22,23 +29,14 @@ class MonCherryAgent(PacmanAgent):
 
     def get_action(self, state):
         actions = self.get_legal_actions(state)
-        cherries_distance = [manhattan_distance(self.position.coordinates, cherry) for cherry in state.layout.cherries]
-        if not cherries_distance:
-            return random.choice(actions)
-        cherry_position = state.layout.cherries[cherries_distance.index(min(cherries_distance))]
-        maze = copy(state.layout.maze)
-        from libs.greedy_shortest_path import AStar
-
-        shortest_path_to_cherry = AStar(maze).search((self.position.coordinates[1], self.position.coordinates[0]), (cherry_position[1], cherry_position[0]))
-        try:
-            next_position = (shortest_path_to_cherry[1][1], shortest_path_to_cherry[1][0])
-        except (TypeError, IndexError):
-            return random.choice(actions)
-        vector = (next_position[0] - self.position.coordinates[0], next_position[1] - self.position.coordinates[1])
+        if not state.layout.cherries:
+            return state.random.choice(actions)
+        cherry_position = min(state.layout.cherries, key=lambda cherry: manhattan_distance(self.position.coordinates, cherry))
+        vector = state.layout.get_next_move(self.position.coordinates, cherry_position)
         if vector in actions:
             return vector
         else:
-            return random.choice(actions)
+            return state.random.choice(actions)
 
 
 class ReflexAgent(PacmanAgent):
@@ -48,4 +46,361 @@ class ReflexAgent(PacmanAgent):
 
     def get_action(self, state):
         actions = self.get_legal_actions(state)
-        return random.choice(actions)
+        return state.random.choice(actions)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class _SearchAgent(PacmanAgent):
+    """
+    Base of the anytime search agents: iterative deepening over SimulationState, one more turn at each iteration, until
+    the time budget of the move is spent. The best move of the last finished iteration is played, and the first move of
+    the game is always ready after the first iteration.
+
+    Pacman maximizes the evaluation, each ghost of `state.ghosts` moves in turn after him. Results are cached in a
+    transposition table shared by the moves of the game, and the best move found for a state is tried first.
+    """
+    time_budget = 0.05  # Seconds per move
+    max_depth = 50  # In turns
+    table_size = 1 << 16
+    check_every = 256  # Nodes between two checks of the clock
+    maze_distance = False  # Evaluate with the maze distance to the closest food, searched on the junction graph
+
+    depth_reached = 0  # Turns fully searched for the last move
+    nodes = 0  # Nodes visited for the last move
+    nodes_per_second = 0.0
+
+    def __init__(self, position: Tuple[int, int]):
+        super().__init__(position)
+        self.table = TranspositionTable(self.table_size)
+
+    def get_action(self, state):
+        from libs.simulation import SimulationState
+
+        self.nodes = 0
+        self.depth_reached = 0
+        actions = self.get_legal_actions(state)
+        if len(actions) == 1:
+            return actions[0]
+        start_time = time.perf_counter()
+        self.deadline = start_time + self.time_budget
+        self.table.new_search()
+        simulation = SimulationState(state, pacman_teleported=True)
+        best_action = actions[0]
+        try:
+            for depth in range(1, self.max_depth + 1):
+                best_action = self.search_root(simulation, depth * simulation.actor_count, best_action)
+                self.depth_reached = depth
+        except SearchTimeout:
+            pass
+        elapsed = time.perf_counter() - start_time
+        self.nodes_per_second = self.nodes / elapsed if elapsed > 0 else 0.0
+        logging.debug(f"{self.__class__.__name__}: depth {self.depth_reached}, {self.nodes} nodes, "
+                      f"{self.nodes_per_second:.0f} nodes/s")
+        return best_action
+
+    def search_root(self, simulation, plies: int, first_action: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Best pacman action when searching the given number of plies (one ply per actor), trying first_action first.
+        """
+        actions = self.order_actions(simulation.get_legal_actions(), first_action)
+        best_action, best_value = actions[0], -math.inf
+        for action in actions:
+            record = simulation.apply(action)
+            value = self.search(simulation, plies - 1, best_value, math.inf)
+            simulation.undo(record)
+            if value > best_value:
+                best_action, best_value = action, value
+        return best_action
+
+    def visit(self):
+        self.nodes += 1
+        if self.nodes % self.check_every == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+    @staticmethod
+    def order_actions(actions, first_action) -> list:
+        if first_action in actions:
+            return [first_action] + [action for action in actions if action != first_action]
+        return list(actions)
+
+    def evaluate(self, simulation) -> float:
+        """
+        Score of the state, minus the distance to the closest food, with a penalty for being next to a ghost that can kill
+        pacman. The distance is the Manhattan distance, or the length of the path with `maze_distance`.
+        """
+        value = simulation.score
+        if simulation.game_over:
+            return value
+        x, y = simulation.pacman
+        if self.maze_distance:
+            nearest = simulation.layout.get_junction_graph().search_nearest_food(simulation.pacman, simulation.food)
+            value -= nearest[0] if nearest is not None else 0
+        else:
+            value -= min((abs(x - food[0]) + abs(y - food[1]) for food in simulation.food), default=0)
+        for index, ghost in enumerate(simulation.ghosts):
+            if not simulation.scared[index] and abs(x - ghost[0]) + abs(y - ghost[1]) <= 1:
+                value -= 100
+        return value
+
+
+class AlphaBetaAgent(_SearchAgent):
+    """
+    Minimax with alpha-beta pruning: the ghosts are assumed to play the moves that are the worst for pacman.
+    """
+
+    def search(self, simulation, plies: int, alpha: float, beta: float) -> float:
+        self.visit()
+        if plies == 0 or simulation.game_over:
+            return self.evaluate(simulation)
+        key = simulation.hash
+        entry = self.table.lookup(key)
+        first_action = None
+        if entry is not None:
+            first_action = entry.move
+            if entry.depth >= plies:
+                value = entry.value + simulation.score
+                if entry.bound == EXACT or (entry.bound == LOWER_BOUND and value >= beta) or \
+                        (entry.bound == UPPER_BOUND and value <= alpha):
+                    return value
+
+        maximizing = simulation.to_move == 0
+        original_alpha, original_beta = alpha, beta
+        best_action, best_value = None, -math.inf if maximizing else math.inf
+        for action in self.order_actions(simulation.get_legal_actions(), first_action):
+            record = simulation.apply(action)
+            value = self.search(simulation, plies - 1, alpha, beta)
+            simulation.undo(record)
+            if maximizing and value > best_value:
+                best_action, best_value = action, value
+                alpha = max(alpha, value)
+            elif not maximizing and value < best_value:
+                best_action, best_value = action, value
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            bound = UPPER_BOUND
+        elif best_value >= original_beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        # Values are stored relative to the score of the state, which depends on the path that led to it
+        self.table.store(key, plies, best_value - simulation.score, bound, best_action)
+        return best_value
+
+
+class ExpectimaxAgent(_SearchAgent):
+    """
+    Expectimax: each ghost is assumed to choose one of its legal actions uniformly at random.
+    """
+
+    def search(self, simulation, plies: int, alpha: float, beta: float) -> float:
+        self.visit()
+        if plies == 0 or simulation.game_over:
+            return self.evaluate(simulation)
+        key = simulation.hash
+        entry = self.table.lookup(key)
+        first_action = None
+        if entry is not None:
+            if entry.depth >= plies:
+                return entry.value + simulation.score
+            first_action = entry.move
+
+        actions = simulation.get_legal_actions()
+        best_action = None
+        if simulation.to_move == 0:
+            value = -math.inf
+            for action in self.order_actions(actions, first_action):
+                record = simulation.apply(action)
+                child_value = self.search(simulation, plies - 1, alpha, beta)
+                simulation.undo(record)
+                if child_value > value:
+                    best_action, value = action, child_value
+        else:
+            value = 0.0
+            for action in actions:
+                record = simulation.apply(action)
+                value += self.search(simulation, plies - 1, alpha, beta)
+                simulation.undo(record)
+            value /= len(actions)
+        self.table.store(key, plies, value - simulation.score, EXACT, best_action)
+        return value
+
+
+REWARD_SCALE = 500  # Score difference mapped to a reward of 1 in the tree, the size of a death or of a victory
+_mcts_pools = {}  # Number of workers -> (layout, pool), kept warm between the moves and games on the same layout
+_mcts_layout = None  # Layout of the worker processes
+
+
+def get_pacman_cell(state) -> Tuple[int, int]:
+    """
+    Cell pacman moves from when the turn is played: the other end of the portal he stands on, if any.
+    """
+    coordinates = state.pacman.position.coordinates
+    return state.layout.portal_partners.get(coordinates, coordinates)
+
+
+class MCTSNode(object):
+    __slots__ = ('children', 'visits', 'total')
+
+    def __init__(self):
+        self.children = {}
+        self.visits = 0
+        self.total = 0.0
+
+
+def play_turn(state, action: Tuple[int, int]):
+    state.pacman.position.direction = action
+    state.update(keyboard_input=True)
+
+
+def get_playout_action(state, policy: str) -> Tuple[int, int]:
+    """
+    Action of pacman during a rollout: 'random' picks a legal action, preferring not to go backwards, 'greedy' heads to
+    the closest food (as the crow flies).
+    """
+    cell = get_pacman_cell(state)
+    actions = state.layout.get_legal_actions(cell)
+    if policy == 'greedy' and state.layout.food:
+        food = min(state.layout.food, key=lambda position: manhattan_distance(cell, position))
+        action = state.layout.get_next_move(cell, food)
+        if action in actions:
+            return action
+    direction = state.pacman.position.direction
+    forward = [action for action in actions if action != (-direction[0], -direction[1])]
+    return state.random.choice(forward or actions)
+
+
+def run_mcts(state, seed: int, time_budget: float, rollout_depth: int, policy: str, exploration: float,
+             max_rollouts: int = 0) -> Tuple[Dict[Tuple[int, int], Tuple[int, float]], int]:
+    """
+    Open-loop UCT search from the state, the ghosts being played by their agents: the tree holds pacman's actions, and
+    each rollout replays them on a new snapshot of the state. Returns the visits and total reward of each root action,
+    and the number of rollouts.
+
+    The rollouts draw from their own random generator, seeded with seed, so the game's generator is left untouched.
+    """
+    state = state.snapshot()
+    state.random = random.Random(seed)
+    root = MCTSNode()
+    score = state.score
+    deadline = time.perf_counter() + time_budget
+    rollouts = 0
+    while time.perf_counter() < deadline and (max_rollouts <= 0 or rollouts < max_rollouts):
+        simulation = state.snapshot()
+        node, path = root, [root]
+        while not simulation.game_over:
+            actions = simulation.layout.get_legal_actions(get_pacman_cell(simulation))
+            untried = [action for action in actions if action not in node.children]
+            if untried:
+                action = simulation.random.choice(untried)
+                node.children[action] = MCTSNode()
+            else:
+                log_visits = math.log(node.visits)
+                action = max(actions, key=lambda candidate: (
+                    node.children[candidate].total / node.children[candidate].visits +
+                    exploration * math.sqrt(log_visits / node.children[candidate].visits)
+                ))
+            node = node.children[action]
+            path.append(node)
+            play_turn(simulation, action)
+            if untried:
+                break
+        for _ in range(rollout_depth):
+            if simulation.game_over:
+                break
+            play_turn(simulation, get_playout_action(simulation, policy))
+        reward = (simulation.score - score) / REWARD_SCALE
+        for visited in path:
+            visited.visits += 1
+            visited.total += reward
+        rollouts += 1
+    return {action: (child.visits, child.total) for action, child in root.children.items()}, rollouts
+
+
+def _init_mcts_worker(layout, log_level: int):
+    global _mcts_layout
+    _mcts_layout = layout
+    logging.getLogger().setLevel(max(log_level, logging.WARNING))
+
+
+def _run_mcts_worker(packed: Tuple, seed: int, settings: Tuple):
+    from libs.pacman_controller import PacmanState
+
+    return run_mcts(PacmanState.unpack(_mcts_layout, packed), seed, *settings)
+
+
+def close_mcts_pools():
+    for _, pool in _mcts_pools.values():
+        pool.terminate()
+    _mcts_pools.clear()
+
+
+atexit.register(close_mcts_pools)
+
+
+class MCTSAgent(PacmanAgent):
+    """
+    Monte Carlo Tree Search, with root parallelisation: each worker process grows its own tree from the current state
+    for the time budget, and the action visited the most over all the trees is played.
+
+    The ghosts are played by their own agents during the rollouts. Workers receive the state packed as a small tuple
+    (see PacmanState.pack) and keep the layout from the creation of their pool, which is reused for the next moves and
+    games on the same layout and terminated when another layout is played. With `workers = 0`, or inside a worker
+    process, the search runs in the current process.
+    """
+    time_budget = 0.1  # Seconds per move
+    rollout_depth = 20  # Turns played after leaving the tree
+    playout_policy = 'random'  # 'random' or 'greedy', see get_playout_action
+    exploration = 1.4
+    workers = os.cpu_count() or 1
+
+    rollouts = 0  # Rollouts of the last move, all workers included
+    rollouts_per_second = 0.0
+
+    def get_action(self, state):
+        actions = self.get_legal_actions(state)
+        if len(actions) == 1:
+            return actions[0]
+        start_time = time.perf_counter()
+        # One seed per tree, drawn from the game's generator so that the game is played again identically with its seed
+        seeds = [state.random.getrandbits(32) for _ in range(max(self.workers, 1))]
+        # Pacman already went through the portal he stood on, the tree replays whole turns from the beginning
+        state = state.snapshot()
+        state.pacman.position.coordinates = get_pacman_cell(state)
+        settings = (self.time_budget, self.rollout_depth, self.playout_policy, self.exploration)
+        if self.workers > 0 and not multiprocessing.current_process().daemon:
+            pool = self.get_pool(state.layout)
+            packed = state.pack()
+            results = [pool.apply_async(_run_mcts_worker, (packed, seed, settings)) for seed in seeds]
+            results = [result.get() for result in results]
+        else:
+            results = [run_mcts(state, seeds[0], *settings)]
+
+        visits = {action: 0 for action in actions}
+        for children, _ in results:
+            for action, (count, _) in children.items():
+                if action in visits:
+                    visits[action] += count
+        self.rollouts = sum(rollouts for _, rollouts in results)
+        elapsed = time.perf_counter() - start_time
+        self.rollouts_per_second = self.rollouts / elapsed if elapsed > 0 else 0.0
+        logging.debug(f"MCTSAgent: {self.rollouts} rollouts, {self.rollouts_per_second:.0f} rollouts/s")
+        return max(actions, key=lambda action: visits[action])
+
+    def get_pool(self, layout):
+        """
+        Pool of processes for this number of workers, started again with the layout when it changed.
+        """
+        current = _mcts_pools.get(self.workers)
+        if current is None or current[0].navigation is not layout.navigation:
+            if current is not None:
+                current[1].terminate()
+            pool = multiprocessing.Pool(self.workers, initializer=_init_mcts_worker,
+                                        initargs=(layout, logging.getLogger().level))
+            _mcts_pools[self.workers] = (layout, pool)
+        return _mcts_pools[self.workers][1]
@@ -1,16 +1,20 @@
 import logging
+import random
 import string
 
-from copy import deepcopy
-from typing import Tuple, Dict
+from typing import Tuple, Dict, Optional, List, Iterable
 
 from libs import add_tuples, sub_tuples, BaseClass
-from libs.ghost_agents import GhostAgent, BlinkyAgent, PinkyAgent, InkyAgent, ClydeAgent
+from libs.ghost_agents import GhostAgent
 from libs.layouts import Layout
 from libs.pacman_agents import PacmanAgent
+from libs.profiler import TurnProfiler
+from libs.remote_agents import RemotePacmanAgent, RemoteGhostAgent, DEFAULT_MOVE_DEADLINE
+from libs import zobrist
 
 LETTERS = string.ascii_uppercase
 TIME_PENALTY = 1  # Number of points lost each round
+ORIGINAL_GHOSTS = {'blinky': 'BlinkyAgent', 'pinky': 'PinkyAgent', 'inky': 'InkyAgent', 'clyde': 'ClydeAgent'}
 
 
 def import_class_by_name(module_name, class_name):
@@ -19,12 +23,33 @@ def import_class_by_name(module_name, class_name):
     """
     module = __import__(module_name, globals(), locals(), [class_name])
     try:
+        if class_name.startswith('_'):
+            raise AttributeError(f'{class_name} is a private base class, not an agent')
         return getattr(module, class_name)
     except AttributeError as e:
         logging.error(f'Class "{class_name}" not found in module "{module_name}"')
         raise e
 
 
+def get_agent_class(agent) -> str:
+    """
+    Name of the class of an agent, the class played by the worker for the agents played in another process.
+    """
+    return getattr(agent, 'agent_class', agent.__class__.__name__)
+
+
+def get_agent(agents: Optional[Dict], name: str, module_name: str, class_name: str, position: Tuple[int, int]):
+    """
+    Agent of this class for the actor, taken from agents if it holds one, else created (and added to agents).
+    """
+    agent = agents.get(name) if agents is not None else None
+    if agent is None or agent.__class__.__name__ != class_name:
+        agent = import_class_by_name(module_name, class_name)(position)
+        if agents is not None:
+            agents[name] = agent
+    return agent
+
+
 class PacmanState(BaseClass):
     turn: int = 0
     layout: Layout
@@ -35,43 +60,136 @@ class PacmanState(BaseClass):
 
     score: int = 0
     game_over: bool = False
+    killed_by: Optional[str] = None  # Name of the ghost that killed pacman
     clipping_bug: bool
+    seed: Optional[int]  # Seed of the random generator of the game, None for unpacked states
+    random: random.Random  # Random generator of the game, shared with the snapshots: agents must draw from it
+    profiler: Optional[TurnProfiler] = None  # Times each phase of update when set, see enable_profiling
+    zobrist_hash: Optional[int] = None  # Maintained once get_hash has been called, see libs/zobrist.py
+    hashed_features: Optional[List] = None  # Actor features the hash was last computed from, never mutated
 
-    def copy(self):
+    def snapshot(self):
         """
+        Copy of the state sharing everything that can't change during a game with this one: the static data of the
+        layout, the agents' configuration. Only the mutable parts are copied: positions, food and cherries, ghosts flags,
+        score and turn.
+
         If the ghosts are not copied, all the states will have the same ghosts, messing up the position when calculating
-         the successors states.
+        the successors states.
         """
-        result = deepcopy(self)
-        result.ghosts = deepcopy(self.ghosts)
+        result = self.shallow_copy()
+        result.layout = self.layout.copy()
+        result.pacman = self.pacman.copy()
+        result.ghosts = {name: ghost.copy() for name, ghost in self.ghosts.items()}
+        result.profiler = None
         return result
 
-    def __init__(self, layout, pacman_agent: str, clipping_bug: bool = False, ghost_agent=None):
+    def copy(self):
+        return self.snapshot()
+
+    def __init__(self, layout, pacman_agent: str, clipping_bug: bool = False, ghost_agent=None, seed: Optional[int] = None,
+                 remote: Iterable[str] = (), move_deadline: float = DEFAULT_MOVE_DEADLINE):
+        """
+        Without a seed, one is drawn from the global random generator, so that seeding it still makes games reproducible.
+
+        remote lists the actors whose agents are played in worker processes, 'pacman' and/or 'ghosts', with a deadline
+        of move_deadline seconds per move (see libs/remote_agents.py).
+        """
         self.clipping_bug = clipping_bug
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.random = random.Random(self.seed)
         self.layout = layout
-        ghost_agent_class = import_class_by_name('libs.ghost_agents', ghost_agent)
-        if self.layout.blinky != (-1, -1):
-            if ghost_agent:
-                self.ghosts['blinky'] = deepcopy(ghost_agent_class(self.layout.blinky))
-            else:
-                self.ghosts['blinky'] = deepcopy(BlinkyAgent(self.layout.blinky))
-        if self.layout.pinky != (-1, -1):
-            if ghost_agent:
-                self.ghosts['pinky'] = deepcopy(ghost_agent_class(self.layout.pinky))
+        self.ghosts = {}
+        for name, default_agent in ORIGINAL_GHOSTS.items():
+            position = getattr(self.layout, name)
+            if position == (-1, -1):
+                continue
+            if 'ghosts' in remote:
+                self.ghosts[name] = RemoteGhostAgent(name, position, ghost_agent or default_agent, move_deadline)
             else:
-                self.ghosts['pinky'] = deepcopy(PinkyAgent(self.layout.pinky))
-        if self.layout.inky != (-1, -1):
-            if ghost_agent:
-                self.ghosts['inky'] = deepcopy(ghost_agent_class(self.layout.inky))
-            else:
-                self.ghosts['inky'] = deepcopy(InkyAgent(self.layout.inky))
-        if self.layout.clyde != (-1, -1):
-            if ghost_agent:
-                self.ghosts['clyde'] = deepcopy(ghost_agent_class(self.layout.clyde))
-            else:
-                self.ghosts['clyde'] = deepcopy(ClydeAgent(self.layout.clyde))
+                self.ghosts[name] = import_class_by_name('libs.ghost_agents', ghost_agent or default_agent)(position)
+
+        if 'pacman' in remote:
+            self.pacman = RemotePacmanAgent(self.layout.pacman, pacman_agent, move_deadline)
+        else:
+            self.pacman = import_class_by_name('libs.pacman_agents', pacman_agent)(self.layout.pacman)
 
-        self.pacman = import_class_by_name('libs.pacman_agents', pacman_agent)(self.layout.pacman)
+    def pack(self) -> Tuple:
+        """
+        Compact picklable description of the state, made of ints, strings and tuples only, to send to other processes.
+        The layout is not included: the receiver must already have it. See unpack.
+        """
+        ghosts = tuple(
+            (name, get_agent_class(ghost), ghost.initial_position.coordinates, ghost.position.coordinates,
+             ghost.position.direction, ghost.scared, ghost.dead, ghost.disable_clip, ghost.fleeing_since,
+             ghost.previous_action)
+            for name, ghost in self.ghosts.items()
+        )
+        return (get_agent_class(self.pacman), self.pacman.position.coordinates, self.pacman.position.direction,
+                ghosts, self.layout.food.bits, self.layout.cherries.bits, self.score, self.turn, self.game_over,
+                self.killed_by, self.clipping_bug)
+
+    @classmethod
+    def unpack(cls, layout: Layout, packed: Tuple, agents: Optional[Dict] = None) -> 'PacmanState':
+        """
+        State described by pack, on a copy of the given layout.
+
+        The agents are created from the names of their classes, unless `agents` holds one of the same class for the
+        actor ('pacman' or the name of the ghost): the worker processes keep their agents from one move to the next
+        this way. The agents created are added to it.
+        """
+        (pacman_agent, pacman_coordinates, pacman_direction, ghosts, food, cherries, score, turn, game_over, killed_by,
+         clipping_bug) = packed
+        state = cls.__new__(cls)
+        state.layout = layout.copy()
+        state.layout.food.bits = food
+        state.layout.cherries.bits = cherries
+        state.pacman = get_agent(agents, 'pacman', 'libs.pacman_agents', pacman_agent, pacman_coordinates)
+        state.pacman.position.coordinates = pacman_coordinates
+        state.pacman.position.direction = pacman_direction
+        state.ghosts = {}
+        for (name, ghost_agent, initial_coordinates, coordinates, direction, scared, dead, disable_clip, fleeing_since,
+             previous_action) in ghosts:
+            ghost = get_agent(agents, name, 'libs.ghost_agents', ghost_agent, initial_coordinates)
+            ghost.initial_position.coordinates = initial_coordinates
+            ghost.position.coordinates = coordinates
+            ghost.position.direction = direction
+            ghost.scared = scared
+            ghost.dead = dead
+            ghost.disable_clip = disable_clip
+            ghost.fleeing_since = fleeing_since
+            ghost.previous_action = previous_action
+            state.ghosts[name] = ghost
+        state.score = score
+        state.turn = turn
+        state.game_over = game_over
+        state.killed_by = killed_by
+        state.clipping_bug = clipping_bug
+        state.seed = None
+        state.random = random.Random()
+        return state
+
+    def enable_profiling(self) -> TurnProfiler:
+        """
+        Time each phase of the next updates, and count the path searches they run.
+        """
+        self.profiler = TurnProfiler()
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+
+    def get_hash(self) -> int:
+        """
+        Zobrist hash of the positions and directions of the actors, the remaining food and cherries, and the ghosts
+        flags. Computed in full on the first call, then updated: the eaten food and cherries are XOR-ed out as they are
+        eaten, and only the actors that changed since the last call are rehashed.
+        """
+        if self.zobrist_hash is None:
+            self.zobrist_hash, self.hashed_features = zobrist.compute_hash(self)
+        else:
+            self.zobrist_hash, self.hashed_features = zobrist.update_hash(self.zobrist_hash, self.hashed_features, self)
+        return self.zobrist_hash
 
     def set_ghost_position(self, ghost_name: str, position: Tuple[int, int]):
         self.ghosts[ghost_name].position.coordinates = position
@@ -83,81 +201,104 @@ class PacmanState(BaseClass):
         """
         Compute the new position of pacman, taking into account the portals and the keyboard input.
         """
-        for portal in self.layout.portals:
-            if self.pacman.position.coordinates == self.layout.portals[portal][0]:
-                self.pacman.position.coordinates = self.layout.portals[portal][1]
-
-            elif self.pacman.position.coordinates == self.layout.portals[portal][1]:
-                self.pacman.position.coordinates = self.layout.portals[portal][0]
-
+        profiler = self.profiler
+        self.teleport_pacman()
+        if profiler is not None:
+            profiler.lap('pacman portals')
         if not keyboard_input:
             self.pacman.position.direction = self.pacman.get_action(self)
+            if profiler is not None:
+                profiler.lap('pacman agent')
+        self.move_pacman()
+        if profiler is not None:
+            profiler.lap('pacman move')
+
+    def teleport_pacman(self):
+        """
+        Pacman standing on a portal starts his turn at the other end of it.
+        """
+        partner = self.layout.portal_partners.get(self.pacman.position.coordinates)
+        if partner is not None:
+            self.pacman.position.coordinates = partner
+
+    def move_pacman(self):
         if self.pacman.position.direction not in self.pacman.get_legal_actions(self):
             logging.error(f'Pacman tried to move in an illegal direction: {self.pacman.position.direction}')
             raise ValueError
         self.pacman.position.coordinates = add_tuples(self.pacman.position.coordinates, self.pacman.position.direction)
 
-    def update(self, with_pacman: bool = True, keyboard_input=False):
+    def move_ghost(self, name: str):
+        self.ghosts[name].position.coordinates = add_tuples(self.ghosts[name].position.coordinates, self.ghosts[name].position.direction)
+
+    def teleport_ghost(self, name: str):
+        """
+        A ghost entering a portal is moved right before the other end of it, and goes through it during the next turn.
+        The ghost coming out of the portal on that turn lands on the other end, which doesn't send it back.
+        """
+        ghost = self.ghosts[name]
+        if ghost.disable_clip:
+            ghost.disable_clip = False
+            return
+        partner = self.layout.portal_partners.get(ghost.position.coordinates)
+        if partner is not None:
+            self.set_ghost_position(name, sub_tuples(partner, ghost.position.direction))
+            ghost.disable_clip = True
+
+    def update(self, with_pacman: bool = True, keyboard_input=False,
+               ghost_actions: Optional[Dict[str, Tuple[int, int]]] = None):
         """
         Update the state of the game, moving the ghosts and pacman.
+
+        When ghost_actions is given, the ghosts play these actions instead of calling their agents, to replay a game.
+
+        When profiling, the profiler is told the end of each phase of the turn (see TurnProfiler).
         """
-        if with_pacman:
-            self.compute_pacman_position(keyboard_input=keyboard_input)
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start_turn()
+        try:
+            if with_pacman:
+                self.compute_pacman_position(keyboard_input=keyboard_input)
 
-        for index, name in enumerate(self.ghosts):
-            if not self.ghosts[name].disable_clip:
-                self.ghosts[name].position.direction = self.ghosts[name].get_action(self)
-            self.ghosts[name].position.coordinates = add_tuples(self.ghosts[name].position.coordinates, self.ghosts[name].position.direction)
-            for portal in self.layout.portals:
-                if self.ghosts[name].disable_clip:
-                    self.ghosts[name].disable_clip = False
-                    continue
-                if self.ghosts[name].position.coordinates == self.layout.portals[portal][0]:
-                    before_portal = sub_tuples(self.layout.portals[portal][1], self.ghosts[name].position.direction)
-                    self.set_ghost_position(name, before_portal)
-                    self.ghosts[name].disable_clip = True
-                elif self.ghosts[name].position.coordinates == self.layout.portals[portal][1]:
-                    before_portal = sub_tuples(self.layout.portals[portal][0], self.ghosts[name].position.direction)
-                    self.set_ghost_position(name, before_portal)
-                    self.ghosts[name].disable_clip = True
-            if self.ghosts[name].dead or self.ghosts[name].scared:
-                self.ghosts[name].respawn_tick()
-        self.turn += 1
-        return self.compute_score()
+            for index, name in enumerate(self.ghosts):
+                if not self.ghosts[name].disable_clip:
+                    if ghost_actions is not None:
+                        self.ghosts[name].position.direction = ghost_actions[name]
+                    else:
+                        self.ghosts[name].position.direction = self.ghosts[name].get_action(self)
+                    if profiler is not None:
+                        profiler.lap(f'ghost {name} agent')
+                self.move_ghost(name)
+                if profiler is not None:
+                    profiler.lap(f'ghost {name} move')
+                self.teleport_ghost(name)
+                if profiler is not None:
+                    profiler.lap(f'ghost {name} portals')
+                if self.ghosts[name].dead or self.ghosts[name].scared:
+                    self.ghosts[name].respawn_tick()
+                    if profiler is not None:
+                        profiler.lap(f'ghost {name} respawn')
+            self.turn += 1
+            over = self.compute_score()
+            if profiler is not None:
+                profiler.lap('score')
+            return over
+        finally:
+            if profiler is not None:
+                profiler.end_turn()
 
     def generate_successor(self, pacman_action: Tuple[int, int]):
-        next_state = self.copy()
+        next_state = self.snapshot()
         next_state.pacman.position.coordinates = add_tuples(next_state.pacman.position.coordinates, pacman_action)
         next_state.update(with_pacman=False)
         return next_state
 
-    def predict_pacman_position(self, steps: int):
-        """
-        Fast and unreliable way to predict the position of pacman after a certain number of steps. Used to calculate the
-        target position for the Pinky agent.
-        """
-        next_state = self.copy()
-        if steps != 0:
-            current_position = next_state.pacman.position.coordinates
-            next_state.pacman.position.coordinates = add_tuples(next_state.pacman.position.coordinates, self.pacman.position.direction)
-            if next_state.pacman.position.coordinates in next_state.layout.walls:
-                if add_tuples(current_position, (1, 0)) not in next_state.layout.walls:
-                    next_state.pacman.position.direction = (1, 0)
-                    next_state.pacman.position.coordinates = add_tuples(current_position, (1, 0))
-                    return next_state.predict_pacman_position(steps=steps-1)
-                elif add_tuples(current_position, (-1, 0)) not in next_state.layout.walls:
-                    next_state.pacman.position.direction = (-1, 0)
-                    next_state.pacman.position.coordinates = add_tuples(current_position, (-1, 0))
-                    return next_state.predict_pacman_position(steps=steps-1)
-                elif add_tuples(current_position, (0, 1)) not in next_state.layout.walls:
-                    next_state.pacman.position.direction = (0, 1)
-                    next_state.pacman.position.coordinates = add_tuples(current_position, (0, 1))
-                    return next_state.predict_pacman_position(steps=steps-1)
-                elif add_tuples(current_position, (0, -1)) not in next_state.layout.walls:
-                    next_state.pacman.position.direction = (0, -1)
-                    next_state.pacman.position.coordinates = add_tuples(current_position, (0, -1))
-                    return next_state.predict_pacman_position(steps=steps-1)
-        return next_state
+    def predict_pacman_position(self, steps: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """
+        Predicted coordinates and direction of pacman after a certain number of steps, see Layout.predict_pacman.
+        """
+        position = self.pacman.position
+        return self.layout.predict_pacman(position.coordinates, position.direction, steps)
 
     def get_ghosts_bounty(self):
         """
@@ -190,11 +331,15 @@ class PacmanState(BaseClass):
         if self.pacman.position.coordinates in self.layout.food:
             self.score += 10
             self.layout.food.remove(self.pacman.position.coordinates)
+            if self.zobrist_hash is not None:
+                self.zobrist_hash ^= zobrist.KEYS.get(('food',) + self.pacman.position.coordinates)
         if self.pacman.position.coordinates in self.layout.cherries:
             self.score += 50
             for index, name in enumerate(self.ghosts):
                 self.ghosts[name].scared = True
             self.layout.cherries.remove(self.pacman.position.coordinates)
+            if self.zobrist_hash is not None:
+                self.zobrist_hash ^= zobrist.KEYS.get(('cherry',) + self.pacman.position.coordinates)
         for index, name in enumerate(self.ghosts):
             if self.ghosts[name].position.coordinates == self.pacman.position.coordinates or \
                     self.pacman_just_crossed_ghost(self.ghosts[name]):
@@ -206,6 +351,7 @@ class PacmanState(BaseClass):
                     self.score -= 500
                     logging.info(f"Pacman died! Final score: {self.score}")
                     self.game_over = True
+                    self.killed_by = name
         if len(self.layout.food) == 0:
             self.score += 500
             logging.info(f"Pacman won! Final score: {self.score}")
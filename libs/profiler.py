@@ -0,0 +1,91 @@
+"""
+Per-phase timing of PacmanState.update, to find which part of a turn is slow.
+"""
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+current: Optional['TurnProfiler'] = None  # Profiler of the update being run, for the path searches to report to
+
+
+class TurnProfiler(object):
+    """
+    Accumulates the time spent in each phase of a turn (pacman portals, pacman agent, pacman move, the agent, the move,
+    the portals and the respawn countdown of each ghost, and the score), and the number of path searches with the nodes
+    they expanded.
+
+    Attach it to a state with `PacmanState.enable_profiling()`: the state then calls `start_turn`, `lap` at the end of
+    each phase and `end_turn` during its updates.
+    """
+
+    previous: Optional['TurnProfiler'] = None  # Profiler of the enclosing update, restored by end_turn
+    lap_start = 0.0
+
+    def __init__(self):
+        self.durations: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.searches: Dict[str, int] = defaultdict(int)
+        self.expanded: Dict[str, int] = defaultdict(int)
+        self.turns = 0
+
+    def add(self, phase: str, duration: float):
+        self.durations[phase] += duration
+        self.calls[phase] += 1
+
+    def record_search(self, kind: str, expanded: int = 0):
+        self.searches[kind] += 1
+        self.expanded[kind] += expanded
+
+    def start_turn(self):
+        """
+        Called by PacmanState.update at the start of a turn: the path searches of the turn are now reported here.
+        """
+        global current
+        self.previous, current = current, self
+        self.lap_start = time.perf_counter()
+
+    def lap(self, phase: str):
+        """
+        Called by PacmanState.update at the end of each phase, which took the time since the previous one.
+        """
+        now = time.perf_counter()
+        self.add(phase, now - self.lap_start)
+        self.lap_start = now
+
+    def end_turn(self):
+        global current
+        current = self.previous
+        self.turns += 1
+
+    def report(self) -> Dict:
+        """
+        Totals as a JSON serializable dict.
+        """
+        total = sum(self.durations.values())
+        return {
+            'turns': self.turns,
+            'total_seconds': total,
+            'phases': {
+                phase: {
+                    'seconds': duration,
+                    'calls': self.calls[phase],
+                    'mean_us': duration / self.calls[phase] * 1e6,
+                    'share': duration / total if total else 0.0,
+                }
+                for phase, duration in sorted(self.durations.items(), key=lambda item: -item[1])
+            },
+            'searches': {
+                kind: {'calls': count, 'expanded': self.expanded[kind]} for kind, count in sorted(self.searches.items())
+            },
+        }
+
+    def format_table(self) -> str:
+        report = self.report()
+        lines = [f"{'phase':<24}{'total ms':>10}{'calls':>9}{'mean us':>10}{'share':>8}"]
+        for phase, values in report['phases'].items():
+            lines.append(f"{phase:<24}{values['seconds'] * 1e3:>10.2f}{values['calls']:>9}{values['mean_us']:>10.1f}"
+                         f"{values['share']:>8.1%}")
+        lines.append(f"{report['turns']} turns, {report['total_seconds'] * 1e3:.2f} ms")
+        for kind, values in report['searches'].items():
+            lines.append(f"{kind}: {values['calls']} searches, {values['expanded']} nodes expanded")
+        return '\n'.join(lines)
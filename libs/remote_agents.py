@@ -0,0 +1,210 @@
+"""
+Agents played in a worker process instead of the game process, so that a slow agent, or one holding a large model,
+neither blocks the game loop nor competes with it for the GIL.
+
+The game talks to the worker over a pipe. For each move, it sends the state packed by PacmanState.pack (a small tuple of
+ints and strings), the name of the actor to play and the state of the game's random generator, then waits for the
+action until the deadline of the move. A move that misses its deadline, or that fails in the worker, is replaced by a
+fallback action: going on in the current direction if it is legal, the first legal action otherwise. Its late answer is
+dropped when it arrives, and a worker that fell behind skips the moves the game already sent a newer one after.
+The worker plays the move with a copy of the game's generator and sends its state back with the action, and the game
+takes it over: as long as no move misses its deadline, the generator goes through the same draws as if the agent had
+played in the game process, so the game is the same one as in-process with the same seed. A missed move leaves the
+generator untouched.
+
+A worker plays the agents of one class and is kept for the next games. The agents are created in the worker on their
+first move, then reused for the next moves and games with the state of each move copied to them (see
+PacmanState.unpack), so a model loaded by an agent is only loaded once per worker. The agent class is imported as soon
+as the worker starts, and the first move of a new worker waits up to START_TIMEOUT seconds. The layout is sent when it
+changes; a compiled layout is sent as the path of its file (see libs/layout_cache.py).
+
+Messages, as tuples:
+    game -> worker: ('layout', layout), ('move', move id, actor name, packed state, random state), ('close',)
+    worker -> game: ('action', move id, action, ghost flags or None, random state), ('error', move id, traceback)
+"""
+import atexit
+import logging
+import multiprocessing
+import time
+import traceback
+from typing import Dict, Optional, Tuple
+
+from libs import PacmanAgent
+from libs.ghost_agents import GhostAgent
+
+DEFAULT_MOVE_DEADLINE = 0.1  # Seconds
+START_TIMEOUT = 30.0  # Seconds given to the first move of a new worker, which starts a process and imports the agent
+GHOST_FLAGS = ('scared', 'dead', 'disable_clip', 'fleeing_since', 'previous_action')  # Sent back after a ghost's move
+
+_workers: Dict[Tuple[str, str], 'AgentWorker'] = {}  # By module and class of the agent, kept warm between games
+
+
+def _serve(connection, module_name: str, class_name: str, log_level: int):
+    """
+    Main loop of a worker process.
+    """
+    from libs.pacman_controller import PacmanState, import_class_by_name
+
+    logging.getLogger().setLevel(log_level)
+    import_class_by_name(module_name, class_name)
+    layout, agents = None, {}
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message[0] == 'layout':
+            layout = message[1]
+        elif message[0] == 'move':
+            if connection.poll():
+                continue  # The game sent another move since, this one already missed its deadline
+            _, move_id, name, packed, random_state = message
+            try:
+                state = PacmanState.unpack(layout, packed, agents)
+                state.random.setstate(random_state)
+                agent = state.pacman if name == 'pacman' else state.ghosts[name]
+                action = agent.get_action(state)
+                flags = None if name == 'pacman' else tuple(getattr(agent, flag) for flag in GHOST_FLAGS)
+                connection.send(('action', move_id, action, flags, state.random.getstate()))
+            except Exception:
+                connection.send(('error', move_id, traceback.format_exc()))
+        else:
+            break
+    connection.close()
+
+
+class AgentWorker(object):
+    """
+    Worker process playing the agents of one class, see the module docstring.
+    """
+    started: bool = False  # Whether the worker answered a move yet
+    layout = None  # Last layout sent to the worker
+
+    def __init__(self, module_name: str, class_name: str):
+        self.module_name = module_name
+        self.class_name = class_name
+        self.move_id = 0
+        self.start()
+
+    def start(self):
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(worker_connection, self.module_name, self.class_name, logging.getLogger().level),
+            name=f'{self.class_name} worker', daemon=True
+        )
+        self.process.start()
+        worker_connection.close()
+        self.started = False
+        self.layout = None
+
+    def close(self):
+        try:
+            self.connection.send(('close',))
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+    def request_action(self, state, name: str, deadline: float) -> Optional[Tuple]:
+        """
+        (action, ghost flags, random state) of the worker's move for this actor, None if the deadline passed or if the
+        move failed.
+        """
+        if not self.process.is_alive():
+            logging.warning(f'The {self.class_name} worker stopped, starting a new one')
+            self.start()
+        try:
+            if self.layout is None or self.layout.navigation is not state.layout.navigation:
+                self.connection.send(('layout', state.layout))
+                self.layout = state.layout
+            self.move_id += 1
+            self.connection.send(('move', self.move_id, name, state.pack(), state.random.getstate()))
+            end = time.perf_counter() + (deadline if self.started else max(deadline, START_TIMEOUT))
+            while True:
+                remaining = end - time.perf_counter()
+                if remaining <= 0 or not self.connection.poll(remaining):
+                    return None
+                message = self.connection.recv()
+                if message[1] != self.move_id:
+                    continue  # Answer to a move that missed its deadline
+                self.started = True
+                if message[0] == 'error':
+                    logging.error(f'{self.class_name} failed to play {name}:\n{message[2]}')
+                    return None
+                return message[2:]
+        except (EOFError, OSError) as error:
+            logging.error(f'Lost the {self.class_name} worker: {error}')
+            return None
+
+
+def get_worker(module_name: str, class_name: str) -> AgentWorker:
+    key = (module_name, class_name)
+    if key not in _workers:
+        _workers[key] = AgentWorker(module_name, class_name)
+    return _workers[key]
+
+
+def close_workers():
+    for worker in _workers.values():
+        worker.close()
+    _workers.clear()
+
+
+atexit.register(close_workers)
+
+
+class RemoteAgent(object):
+    """
+    Agent of the game process forwarding its moves to the worker of its agent class.
+    """
+    module_name: str
+    agent_class: str  # Class of the agent played by the worker, used by PacmanState.pack
+    move_deadline: float
+    missed_moves: int = 0  # Moves replaced by the fallback action
+
+    def get_remote_action(self, state, name: str):
+        worker = get_worker(self.module_name, self.agent_class)
+        result = worker.request_action(state, name, self.move_deadline)
+        if result is None:
+            self.missed_moves += 1
+            action = self.get_fallback_action(state)
+            logging.warning(f'{self.agent_class} missed the deadline of {name} on turn {state.turn}, playing {action}')
+            return action
+        action, flags, random_state = result
+        state.random.setstate(random_state)
+        if flags is not None:
+            for flag, value in zip(GHOST_FLAGS, flags):
+                setattr(self, flag, value)
+        return action
+
+    def get_fallback_action(self, state):
+        actions = self.get_legal_actions(state)
+        return self.position.direction if self.position.direction in actions else actions[0]
+
+
+class RemotePacmanAgent(RemoteAgent, PacmanAgent):
+    module_name = 'libs.pacman_agents'
+
+    def __init__(self, position: Tuple[int, int], agent_class: str, move_deadline: float = DEFAULT_MOVE_DEADLINE):
+        super().__init__(position)
+        self.agent_class = agent_class
+        self.move_deadline = move_deadline
+
+    def get_action(self, state):
+        return self.get_remote_action(state, 'pacman')
+
+
+class RemoteGhostAgent(RemoteAgent, GhostAgent):
+    module_name = 'libs.ghost_agents'
+
+    def __init__(self, name: str, position: Tuple[int, int], agent_class: str,
+                 move_deadline: float = DEFAULT_MOVE_DEADLINE):
+        super().__init__(position)
+        self.name = name
+        self.agent_class = agent_class
+        self.move_deadline = move_deadline
+
+    def get_action(self, state):
+        return self.get_remote_action(state, self.name)
@@ -0,0 +1,134 @@
+"""
+Compact binary record of a game, to play it again exactly without calling any agent.
+
+File format, little endian:
+    magic b'PACR', version (B), flags (B, bit 0 is the clipping bug), number of actors (B), padding (B),
+    seed (Q), layout hash (16 bytes), number of turns (I), final score (i),
+    pacman agent and ghost agent names (H length then UTF-8, an empty ghost agent for the original ghosts),
+    then one byte per actor per turn: the index in DIRECTIONS of the move of pacman, then of each ghost.
+"""
+import struct
+from typing import Iterator, List, Optional
+
+from libs import BaseClass, DIRECTIONS
+from libs.layout_cache import get_layout_hash, load_layout
+from libs.pacman_controller import PacmanState, get_agent_class
+
+MAGIC = b'PACR'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBxQ16sIi')
+NAME_LENGTH = struct.Struct('<H')
+CLIPPING_BUG = 1
+# Inert agents of the replayed actors: the recorded moves are played instead, so the recorded agents are not created
+PLACEHOLDER_PACMAN = 'PacmanAgent'
+PLACEHOLDER_GHOST = 'GhostAgent'
+
+
+class Replay(BaseClass):
+    """
+    Moves of every actor of a game, and what is needed to start the same game again.
+    """
+    seed: int
+    layout_hash: bytes
+    clipping_bug: bool
+    pacman_agent: str
+    ghost_agent: Optional[str]
+    actors: int
+    moves: bytearray  # moves[turn * actors + actor], pacman being actor 0
+    score: int  # Final score, to check the replay
+
+    def __init__(self, seed: int, layout_hash: bytes, clipping_bug: bool, pacman_agent: str, ghost_agent: Optional[str],
+                 actors: int, moves: Optional[bytearray] = None, score: int = 0):
+        self.seed = seed
+        self.layout_hash = layout_hash
+        self.clipping_bug = clipping_bug
+        self.pacman_agent = pacman_agent
+        self.ghost_agent = ghost_agent
+        self.actors = actors
+        self.moves = moves if moves is not None else bytearray()
+        self.score = score
+
+    @property
+    def turns(self) -> int:
+        return len(self.moves) // self.actors
+
+    def to_bytes(self) -> bytes:
+        header = HEADER.pack(MAGIC, VERSION, CLIPPING_BUG if self.clipping_bug else 0, self.actors, self.seed,
+                             self.layout_hash, self.turns, self.score)
+        names = b''
+        for name in (self.pacman_agent, self.ghost_agent or ''):
+            encoded = name.encode()
+            names += NAME_LENGTH.pack(len(encoded)) + encoded
+        return header + names + bytes(self.moves)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Replay':
+        magic, version, flags, actors, seed, layout_hash, turns, score = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a replay file, or written by another version')
+        offset = HEADER.size
+        names = []
+        for _ in range(2):
+            length, = NAME_LENGTH.unpack_from(data, offset)
+            offset += NAME_LENGTH.size
+            names.append(data[offset:offset + length].decode())
+            offset += length
+        moves = bytearray(data[offset:offset + turns * actors])
+        if len(moves) != turns * actors:
+            raise ValueError(f'Truncated replay: {len(moves) // actors} turns out of {turns}')
+        return cls(seed, layout_hash, bool(flags & CLIPPING_BUG), names[0], names[1] or None, actors, moves, score)
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    def create_state(self, layout_content: str) -> PacmanState:
+        """
+        State at the beginning of the game, on the given layout, which must be the recorded one. The actors are played by
+        placeholder agents, the recorded agents are not created.
+        """
+        if get_layout_hash(layout_content) != self.layout_hash:
+            raise ValueError('The replay was recorded on another layout')
+        return PacmanState(load_layout(layout_content), pacman_agent=PLACEHOLDER_PACMAN, clipping_bug=self.clipping_bug,
+                           ghost_agent=PLACEHOLDER_GHOST, seed=self.seed)
+
+    def play_turn(self, state: PacmanState, turn: int) -> bool:
+        """
+        Play the recorded moves of a turn on the state, without calling the agents. Returns whether the game is over.
+        """
+        moves = self.moves[turn * self.actors:(turn + 1) * self.actors]
+        state.pacman.position.direction = DIRECTIONS[moves[0]]
+        ghost_actions = {name: DIRECTIONS[move] for name, move in zip(state.ghosts, moves[1:])}
+        return state.update(keyboard_input=True, ghost_actions=ghost_actions)
+
+    def play(self, layout_content: str) -> Iterator[PacmanState]:
+        """
+        Play the whole game again, yielding the state after each turn.
+        """
+        state = self.create_state(layout_content)
+        for turn in range(self.turns):
+            self.play_turn(state, turn)
+            yield state
+
+
+def load_replay(path: str) -> Replay:
+    with open(path, 'rb') as f:
+        return Replay.from_bytes(f.read())
+
+
+class ReplayRecorder(object):
+    """
+    Records the moves of a game, turn after turn: call `record(state)` after each update.
+    """
+
+    def __init__(self, state: PacmanState, layout_content: str, ghost_agent: Optional[str] = None):
+        self.replay = Replay(state.seed, get_layout_hash(layout_content), state.clipping_bug,
+                             get_agent_class(state.pacman), ghost_agent, len(state.ghosts) + 1)
+
+    def record(self, state: PacmanState):
+        directions: List = [state.pacman.position.direction] + [ghost.position.direction for ghost in state.ghosts.values()]
+        self.replay.moves.extend(DIRECTIONS.index(direction) for direction in directions)
+        self.replay.score = state.score
+
+    def save(self, path: str):
+        self.replay.save(path)
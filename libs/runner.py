@@ -0,0 +1,147 @@
+import logging
+import multiprocessing
+import random
+import time
+from typing import List, Optional, Iterator
+
+import numpy as np
+
+from libs import BaseClass
+from libs.environment import PacmanEnvironment
+from libs.layout_cache import load_layout
+from libs.trajectories import TrajectoryWriter, DEFAULT_SHARD_SIZE
+from libs.pacman_controller import PacmanState
+
+
+class GameResult(BaseClass):
+    """
+    Outcome of a headless game, sent back by the worker processes.
+    """
+    index: int
+    seed: int
+    score: int
+    turns: int
+    won: bool
+    cause: str  # 'won', the name of the ghost that killed pacman, 'illegal move' or 'turn limit'
+    duration: float
+
+    def __init__(self, index: int, seed: int, score: int, turns: int, won: bool, cause: str, duration: float):
+        self.index = index
+        self.seed = seed
+        self.score = score
+        self.turns = turns
+        self.won = won
+        self.cause = cause
+        self.duration = duration
+
+
+def play_headless_game(layout_content: str, pacman_agent: str, ghost_agent: Optional[str], clipping_bug: bool,
+                       seed: int, index: int = 0, max_turns: int = 0) -> GameResult:
+    """
+    Play a whole game without rendering. max_turns stops games that would never end, 0 means no limit.
+    """
+    start_time = time.perf_counter()
+    state = PacmanState(load_layout(layout_content), pacman_agent=pacman_agent, clipping_bug=clipping_bug, ghost_agent=ghost_agent,
+                        seed=seed)
+    cause = 'turn limit'
+    try:
+        while not state.game_over and (max_turns <= 0 or state.turn < max_turns):
+            state.update()
+    except ValueError:
+        cause = 'illegal move'
+    won = state.game_over and len(state.layout.food) == 0 and state.killed_by is None
+    if state.game_over:
+        cause = 'won' if won else state.killed_by
+    return GameResult(index, seed, state.score, state.turn, won, cause, time.perf_counter() - start_time)
+
+
+def collect_trajectories(layout_content: str, pacman_agent: str, ghost_agent: Optional[str], clipping_bug: bool,
+                         number_of_games: int, directory: str, seed: Optional[int] = None, max_turns: int = 0,
+                         shard_size: int = DEFAULT_SHARD_SIZE) -> int:
+    """
+    Play headless games with the agents, streaming the observation, action, reward and done of every turn to a
+    dataset directory (see libs/trajectories.py). Game i is played with the seed `seed + i`. Returns the number of
+    records written.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    environment = PacmanEnvironment(load_layout(layout_content), ghost_agent=ghost_agent, clipping_bug=clipping_bug,
+                                    max_turns=max_turns, dtype=np.uint8, pacman_agent=pacman_agent)
+    with TrajectoryWriter(directory, environment.observation.shape, shard_size=shard_size) as writer:
+        environment.attach_writer(writer)
+        for index in range(number_of_games):
+            environment.reset(seed + index)
+            records = len(writer)
+            done = False
+            while not done:
+                try:
+                    _, _, done, _ = environment.step()
+                except ValueError:
+                    # The step that raised is not written, end the game on its previous step
+                    logging.warning(f'Game {index} (seed {seed + index}) stopped on an illegal move at turn '
+                                    f'{environment.state.turn}')
+                    if len(writer) > records:
+                        writer.mark_done()
+                    break
+        return len(writer)
+
+
+def _play_game(arguments) -> GameResult:
+    return play_headless_game(*arguments)
+
+
+def _init_worker(log_level: int):
+    """
+    The end of each game is already logged by the parent process.
+    """
+    logging.getLogger().setLevel(max(log_level, logging.WARNING))
+
+
+def run_games(layout_content: str, pacman_agent: str, ghost_agent: Optional[str], clipping_bug: bool,
+              number_of_games: int, workers: int, seed: Optional[int] = None, max_turns: int = 0) -> Iterator[GameResult]:
+    """
+    Spread headless games over a pool of processes, and yield their results as soon as they are finished.
+
+    Game i is played with the seed `seed + i`. Without a seed, a random one is drawn and reported in the results so the
+    game can be played again.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    tasks = [
+        (layout_content, pacman_agent, ghost_agent, clipping_bug, seed + index, index, max_turns)
+        for index in range(number_of_games)
+    ]
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(logging.getLogger().level,)) as pool:
+        for result in pool.imap_unordered(_play_game, tasks):
+            yield result
+
+
+def percentile(values: List[float], rank: float) -> float:
+    """
+    Linear interpolation between the closest ranks, values must be sorted.
+    """
+    if len(values) == 1:
+        return values[0]
+    position = (len(values) - 1) * rank / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(results: List[GameResult], elapsed: float) -> str:
+    """
+    Aggregated statistics of a set of games, as a printable report.
+    """
+    scores = sorted(result.score for result in results)
+    causes = {}
+    for result in results:
+        causes[result.cause] = causes.get(result.cause, 0) + 1
+    lines = [
+        f"Games: {len(results)} in {elapsed:.2f}s ({len(results) / elapsed:.1f} games/s)",
+        f"Win rate: {sum(result.won for result in results) / len(results):.1%}",
+        f"Score: mean {sum(scores) / len(scores):.1f}, min {scores[0]}, max {scores[-1]}",
+        "Score percentiles: " + ", ".join(f"p{rank} {percentile(scores, rank):.0f}" for rank in (5, 25, 50, 75, 95)),
+        f"Turns: mean {sum(result.turns for result in results) / len(results):.1f}",
+        "Outcomes: " + ", ".join(f"{cause} {count}" for cause, count in sorted(causes.items(), key=lambda item: -item[1])),
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,283 @@
+"""
+Lean copy of the game rules for tree search: a state that is modified in place by `apply` and restored by `undo`.
+"""
+from typing import Dict, Tuple
+
+from libs import zobrist
+from libs.layouts import CellSet, Layout
+from libs.pacman_controller import PacmanState, TIME_PENALTY
+
+FOOD_REWARD = 10
+CHERRY_REWARD = 50
+DEATH_PENALTY = 500
+VICTORY_REWARD = 500
+GHOST_BOUNTY = 200
+
+
+def get_turn_key(to_move: int) -> int:
+    """
+    Zobrist key of the actor to move. Pacman's is 0, so that the hash between two turns is the one of PacmanState.
+    """
+    return zobrist.KEYS.get(('to_move', to_move)) if to_move else 0
+
+
+class SimulationState(object):
+    """
+    Game state for minimax-style searches, made of plain ints, tuples and lists.
+
+    A turn is split in one move per actor: pacman first (`to_move == 0`), then each ghost in the order of
+    `PacmanState.ghosts`. The move of the last ghost ends the turn and computes the score. `apply(action)` plays the move
+    of the actor to move and returns an undo record, and `undo(record)` puts the state back as it was, so a search can
+    walk the whole tree on a single instance.
+
+    The rules are the ones of `PacmanState.update` and `PacmanState.compute_score`, quirks included: ghosts entering a
+    portal wait one cell outside the maze and go through it on their next move without choosing, pacman teleports at the
+    beginning of his move, and a dead ghost that is still scared can be eaten again. Only the choices of the ghost agents
+    are left out: the ghosts play the actions given to `apply`, which are not checked, as in `update`. Unpaired portals
+    don't teleport anyone.
+
+    `hash` is the Zobrist hash of the state (see libs/zobrist.py), equal to `PacmanState.get_hash()` between turns.
+    """
+    __slots__ = (
+        'layout', 'ghost_names', 'ghost_starts', 'partners', 'clipping_bug', 'initial_food_count',
+        'pacman', 'pacman_direction', 'ghosts', 'ghost_directions', 'disable_clip', 'scared', 'dead', 'fleeing_since',
+        'food', 'cherries', 'score', 'turn', 'game_over', 'killed_by', 'to_move', 'hash',
+    )
+
+    layout: Layout  # Static data only, the food and cherries are in this state
+    ghost_names: Tuple[str, ...]
+    ghost_starts: Tuple[Tuple[int, int], ...]
+    partners: Dict[Tuple[int, int], Tuple[int, int]]  # Layout.portal_partners
+    food: CellSet
+    cherries: CellSet
+
+    def __init__(self, state: PacmanState, pacman_teleported: bool = False):
+        """
+        Pass pacman_teleported from a pacman agent's get_action: at that point of the turn pacman already went through the
+        portal he stood on, and must not go through it again when his move is applied.
+        """
+        self.layout = state.layout
+        self.ghost_names = tuple(state.ghosts)
+        self.ghost_starts = tuple(ghost.initial_position.coordinates for ghost in state.ghosts.values())
+        self.partners = state.layout.portal_partners
+        self.clipping_bug = state.clipping_bug
+        self.initial_food_count = state.layout.initial_food_count
+
+        self.pacman = state.pacman.position.coordinates
+        self.pacman_direction = state.pacman.position.direction
+        ghosts = list(state.ghosts.values())
+        self.ghosts = [ghost.position.coordinates for ghost in ghosts]
+        self.ghost_directions = [ghost.position.direction for ghost in ghosts]
+        self.disable_clip = [ghost.disable_clip for ghost in ghosts]
+        self.scared = [ghost.scared for ghost in ghosts]
+        self.dead = [ghost.dead for ghost in ghosts]
+        self.fleeing_since = [ghost.fleeing_since for ghost in ghosts]
+        self.food = state.layout.food.copy()
+        self.cherries = state.layout.cherries.copy()
+        self.score = state.score
+        self.turn = state.turn
+        self.game_over = state.game_over
+        self.killed_by = state.killed_by
+        self.to_move = 0
+        snapshot = state.snapshot()
+        if pacman_teleported:
+            self.pacman = snapshot.pacman.position.coordinates = self.partners.get(self.pacman, self.pacman)
+        self.hash = snapshot.get_hash()
+
+    @classmethod
+    def from_state(cls, state: PacmanState, pacman_teleported: bool = False) -> 'SimulationState':
+        return cls(state, pacman_teleported)
+
+    def to_state(self, template: PacmanState) -> PacmanState:
+        """
+        PacmanState with the positions, flags, food, score and turn of this state, and the agents of the template. Only
+        meaningful between two turns, when pacman is to move.
+        """
+        state = template.snapshot()
+        state.layout.food = self.food.copy()
+        state.layout.cherries = self.cherries.copy()
+        state.pacman.position.coordinates = self.pacman
+        state.pacman.position.direction = self.pacman_direction
+        for index, name in enumerate(self.ghost_names):
+            ghost = state.ghosts[name]
+            ghost.position.coordinates = self.ghosts[index]
+            ghost.position.direction = self.ghost_directions[index]
+            ghost.disable_clip = self.disable_clip[index]
+            ghost.scared = self.scared[index]
+            ghost.dead = self.dead[index]
+            ghost.fleeing_since = self.fleeing_since[index]
+        state.score = self.score
+        state.turn = self.turn
+        state.game_over = self.game_over
+        state.killed_by = self.killed_by
+        state.zobrist_hash = None
+        state.hashed_features = None
+        return state
+
+    @property
+    def actor_count(self) -> int:
+        return len(self.ghost_names) + 1
+
+    def get_pacman_cell(self) -> Tuple[int, int]:
+        """
+        Cell pacman starts his next move from, after going through a portal.
+        """
+        return self.partners.get(self.pacman, self.pacman)
+
+    def get_legal_actions(self) -> Tuple[Tuple[int, int], ...]:
+        """
+        Actions of the actor to move. A ghost going through a portal has a single action, its current direction.
+        """
+        if self.to_move == 0:
+            return self.layout.get_legal_actions(self.get_pacman_cell())
+        index = self.to_move - 1
+        if self.disable_clip[index]:
+            return self.ghost_directions[index],
+        return self.layout.get_ghost_legal_actions(self.ghosts[index], self.ghost_directions[index])
+
+    def apply(self, action: Tuple[int, int]) -> Tuple:
+        """
+        Play the action of the actor to move, and return the record to give to `undo`.
+        """
+        to_move = self.to_move
+        if to_move == 0:
+            record = (0, self.hash, self.pacman, self.pacman_direction)
+            self.move_pacman(action)
+            self.to_move = 1 if self.ghost_names else 0
+            if not self.ghost_names:
+                record += self.end_turn()
+            return record
+
+        index = to_move - 1
+        record = (to_move, self.hash, self.ghosts[index], self.ghost_directions[index], self.disable_clip[index],
+                  self.scared[index], self.dead[index], self.fleeing_since[index])
+        self.move_ghost(index, action)
+        if to_move == len(self.ghost_names):
+            self.to_move = 0
+            record += self.end_turn()
+        else:
+            self.to_move = to_move + 1
+        return record
+
+    def undo(self, record: Tuple):
+        to_move = record[0]
+        turn_record = record[4:] if to_move == 0 else record[8:]
+        if turn_record:
+            self.score, self.turn, self.game_over, self.killed_by, food, cherry, scared, dead = turn_record
+            if food is not None:
+                self.food.add(food)
+            if cherry is not None:
+                self.cherries.add(cherry)
+            self.scared[:] = scared
+            self.dead[:] = dead
+        if to_move == 0:
+            _, self.hash, self.pacman, self.pacman_direction = record[:4]
+        else:
+            index = to_move - 1
+            (_, self.hash, self.ghosts[index], self.ghost_directions[index], self.disable_clip[index],
+             self.scared[index], self.dead[index], self.fleeing_since[index]) = record[:8]
+        self.to_move = to_move
+
+    def move_pacman(self, action: Tuple[int, int]):
+        cell = self.get_pacman_cell()
+        if action not in self.layout.get_legal_actions(cell):
+            raise ValueError(f'Pacman tried to move in an illegal direction: {action}')
+        keys = zobrist.KEYS
+        self.hash ^= keys.get(('pacman',) + self.pacman + self.pacman_direction)
+        self.pacman = (cell[0] + action[0], cell[1] + action[1])
+        self.pacman_direction = action
+        self.hash ^= keys.get(('pacman',) + self.pacman + action) ^ get_turn_key(1 if self.ghost_names else 0)
+
+    def move_ghost(self, index: int, action: Tuple[int, int]):
+        """
+        Same as the ghost loop of PacmanState.update, with the action of the ghost given.
+        """
+        name = self.ghost_names[index]
+        keys = zobrist.KEYS
+        value = self.hash ^ keys.get(('ghost', name) + self.ghosts[index] + self.ghost_directions[index])
+        if self.scared[index]:
+            value ^= keys.get(('scared', name))
+        if self.dead[index]:
+            value ^= keys.get(('dead', name))
+
+        disable_clip = self.disable_clip[index]
+        direction = self.ghost_directions[index] if disable_clip else action
+        x, y = self.ghosts[index]
+        position = (x + direction[0], y + direction[1])
+        if disable_clip:
+            disable_clip = False
+        else:
+            partner = self.partners.get(position)
+            if partner is not None:
+                position = (partner[0] - direction[0], partner[1] - direction[1])
+                disable_clip = True
+        self.ghosts[index] = position
+        self.ghost_directions[index] = direction
+        self.disable_clip[index] = disable_clip
+        if (self.dead[index] or self.scared[index]) and position == self.ghost_starts[index]:
+            self.dead[index] = False
+            self.scared[index] = False
+            self.fleeing_since[index] = 0
+
+        value ^= keys.get(('ghost', name) + position + direction)
+        if self.scared[index]:
+            value ^= keys.get(('scared', name))
+        if self.dead[index]:
+            value ^= keys.get(('dead', name))
+        next_to_move = 0 if index + 1 == len(self.ghost_names) else index + 2
+        self.hash = value ^ get_turn_key(index + 1) ^ get_turn_key(next_to_move)
+
+    def end_turn(self) -> Tuple:
+        """
+        Same as PacmanState.compute_score. Returns what undo needs to restore.
+        """
+        record = (self.score, self.turn, self.game_over, self.killed_by)
+        keys = zobrist.KEYS
+        scared, dead = tuple(self.scared), tuple(self.dead)
+        self.turn += 1
+        bounty = (sum(1 for flag in self.dead if flag) + 1) * GHOST_BOUNTY
+        self.score -= TIME_PENALTY
+        pacman = self.pacman
+        food = cherry = None
+        if pacman in self.food:
+            self.score += FOOD_REWARD
+            self.food.remove(pacman)
+            self.hash ^= keys.get(('food',) + pacman)
+            food = pacman
+        if pacman in self.cherries:
+            self.score += CHERRY_REWARD
+            for index, name in enumerate(self.ghost_names):
+                if not self.scared[index]:
+                    self.scared[index] = True
+                    self.hash ^= keys.get(('scared', name))
+            self.cherries.remove(pacman)
+            self.hash ^= keys.get(('cherry',) + pacman)
+            cherry = pacman
+        pacman_direction = self.pacman_direction
+        pacman_previous = (pacman[0] - pacman_direction[0], pacman[1] - pacman_direction[1])
+        for index, name in enumerate(self.ghost_names):
+            ghost = self.ghosts[index]
+            if ghost != pacman:
+                if self.clipping_bug or ghost != pacman_previous:
+                    continue
+                direction = self.ghost_directions[index]
+                if (ghost[0] - direction[0], ghost[1] - direction[1]) != pacman:
+                    continue
+            if self.scared[index]:
+                self.score += bounty
+                if not self.dead[index]:
+                    self.dead[index] = True
+                    self.hash ^= keys.get(('dead', name))
+                bounty = (sum(1 for flag in self.dead if flag) + 1) * GHOST_BOUNTY
+            else:
+                self.score -= DEATH_PENALTY
+                self.game_over = True
+                self.killed_by = name
+        if not self.food:
+            self.score += VICTORY_REWARD
+            self.game_over = True
+        return record + (food, cherry, scared, dead)
+
+    def __repr__(self):
+        return (f'SimulationState(turn={self.turn}, to_move={self.to_move}, score={self.score}, pacman={self.pacman}, '
+                f'ghosts={self.ghosts}, food={len(self.food)})')
@@ -0,0 +1,176 @@
+"""
+Trajectories of many games, (observation, action, reward, done) for each turn, streamed to disk for offline learning.
+
+A dataset is a directory of `.npy` shards holding fixed-size records, and an `index.json` file listing the shards and
+how many records each one holds. Shards are memory-mapped both when writing and when reading, so neither side keeps the
+trajectories in memory.
+"""
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+INDEX_FILE = 'index.json'
+DEFAULT_SHARD_SIZE = 64 * 2 ** 20  # Bytes
+
+
+def get_record_dtype(observation_shape: Sequence[int], observation_dtype=np.uint8) -> np.dtype:
+    return np.dtype([
+        ('observation', observation_dtype, tuple(observation_shape)),
+        ('action', np.int8),
+        ('reward', np.float32),
+        ('done', np.bool_),
+    ])
+
+
+class TrajectoryWriter(object):
+    """
+    Appends records to preallocated memory-mapped shards, starting a new shard when the current one is full, and keeps
+    the index file up to date at each new shard and when closed. The last shard is cut down to its records when closed.
+
+    Observations are stored as uint8 by default, which is lossless for the 0/1 planes of PacmanEnvironment.
+    """
+
+    def __init__(self, directory: str, observation_shape: Sequence[int], shard_size: int = DEFAULT_SHARD_SIZE,
+                 observation_dtype=np.uint8):
+        self.directory = directory
+        self.dtype = get_record_dtype(observation_shape, observation_dtype)
+        self.observation_shape = tuple(observation_shape)
+        self.capacity = max(1, shard_size // self.dtype.itemsize)  # Records per shard
+        self.shards: List[Dict] = []  # {'file', 'count'} of each shard, the last one being written
+        self.shard: Optional[np.memmap] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(shard['count'] for shard in self.shards)
+
+    def open_shard(self):
+        self.close_shard()
+        name = f'shard-{len(self.shards):05d}.npy'
+        self.shard = np.lib.format.open_memmap(os.path.join(self.directory, name), mode='w+', dtype=self.dtype,
+                                               shape=(self.capacity,))
+        self.shards.append({'file': name, 'count': 0})
+        self.write_index()
+
+    def close_shard(self):
+        if self.shard is not None:
+            self.shard.flush()
+            self.shard = None
+
+    def append(self, observation: np.ndarray, action: int, reward: float, done: bool):
+        if self.shard is None or self.shards[-1]['count'] == self.capacity:
+            self.open_shard()
+        position = self.shards[-1]['count']
+        record = self.shard[position]
+        record['observation'] = observation
+        record['action'] = action
+        record['reward'] = reward
+        record['done'] = done
+        self.shards[-1]['count'] = position + 1
+
+    def mark_done(self):
+        """
+        Mark the last record as the end of its game, for a game stopped after its last step was written.
+        """
+        if self.shard is not None and self.shards[-1]['count']:
+            self.shard[self.shards[-1]['count'] - 1]['done'] = True
+
+    def write_index(self):
+        index = {
+            'dtype': self.dtype.descr,
+            'observation_shape': list(self.observation_shape),
+            'capacity': self.capacity,
+            'records': len(self),
+            'shards': self.shards,
+        }
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def truncate_shard(self):
+        """
+        Rewrite the shard being written with only its records, instead of its full preallocated capacity.
+        """
+        path = os.path.join(self.directory, self.shards[-1]['file'])
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, self.shard[:self.shards[-1]['count']])
+        self.shard = None
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        if self.shard is not None and self.shards[-1]['count'] < self.capacity:
+            self.truncate_shard()
+        self.close_shard()
+        self.write_index()
+
+
+class TrajectoryReader(object):
+    """
+    Read-only view over the shards of a dataset. `reader[i]` and slices within a shard are views of the memory-mapped
+    files, nothing is copied until the values are used.
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, INDEX_FILE), 'r') as f:
+            self.index = json.load(f)
+        self.shards = [
+            np.load(os.path.join(directory, shard['file']), mmap_mode='r')[:shard['count']]
+            for shard in self.index['shards'] if shard['count']
+        ]
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.shards])
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """
+        Shard and position in the shard of a record.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        shard = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        return shard, index - int(self.offsets[shard])
+
+    def __getitem__(self, index: int):
+        shard, position = self.locate(index)
+        return self.shards[shard][position]
+
+    def get_batch(self, indices: Sequence[int]) -> np.ndarray:
+        """
+        Records at the given indices, copied into one array.
+        """
+        indices = np.asarray(indices)
+        batch = np.empty(len(indices), dtype=self.shards[0].dtype if self.shards else None)
+        shards = np.searchsorted(self.offsets, indices, side='right') - 1
+        for shard in np.unique(shards):
+            selected = shards == shard
+            batch[selected] = self.shards[shard][indices[selected] - self.offsets[shard]]
+        return batch
+
+    def iter_batches(self, batch_size: int, shuffle: bool = False, seed: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        Batches of records covering the dataset once. In order, batches that don't cross a shard boundary are views of
+        the shard; shuffled, they are gathered with get_batch.
+        """
+        if shuffle:
+            order = np.random.default_rng(seed).permutation(len(self))
+            for start in range(0, len(self), batch_size):
+                yield self.get_batch(order[start:start + batch_size])
+            return
+        for start in range(0, len(self), batch_size):
+            end = min(start + batch_size, len(self))
+            shard, position = self.locate(start)
+            if position + end - start <= len(self.shards[shard]):
+                yield self.shards[shard][position:position + end - start]
+            else:
+                yield self.get_batch(np.arange(start, end))
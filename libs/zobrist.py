@@ -0,0 +1,151 @@
+"""
+Zobrist hashing of the game states, and a transposition table for the search agents.
+
+The hash of a state is the XOR of one random 64 bits key per feature of the state: each remaining food and cherry,
+pacman's cell and direction, each ghost's cell and direction and its scared and dead flags. Applying a move only changes
+a few features, so the hash is updated by XOR-ing out the old keys and XOR-ing in the new ones.
+"""
+import hashlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+HASH_BITS = 64
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2  # Kind of value stored in the transposition table
+DEFAULT_TABLE_SIZE = 1 << 16
+
+Feature = Tuple  # ('food', x, y), ('pacman', x, y, dx, dy), ('ghost', name, x, y, dx, dy), ('scared', name)...
+
+
+class ZobristKeys(object):
+    """
+    Random keys of the features, derived from the feature itself and a seed rather than drawn from an RNG, so they are
+    the same in every process and for every copy of a layout, and only the keys actually used are ever computed.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self.keys: Dict[Feature, int] = {}
+
+    def get(self, feature: Feature) -> int:
+        key = self.keys.get(feature)
+        if key is None:
+            digest = hashlib.blake2b(repr((self.seed,) + feature).encode(), digest_size=HASH_BITS // 8).digest()
+            key = self.keys[feature] = int.from_bytes(digest, 'little')
+        return key
+
+
+KEYS = ZobristKeys()
+
+
+def get_actor_features(state) -> List[Optional[Feature]]:
+    """
+    Features of pacman and the ghosts, in a fixed order. Flags that are not set are None.
+    """
+    position = state.pacman.position
+    features = [('pacman',) + position.coordinates + position.direction]
+    for name, ghost in state.ghosts.items():
+        features.append(('ghost', name) + ghost.position.coordinates + ghost.position.direction)
+        features.append(('scared', name) if ghost.scared else None)
+        features.append(('dead', name) if ghost.dead else None)
+    return features
+
+
+def compute_hash(state) -> Tuple[int, List[Optional[Feature]]]:
+    """
+    Full hash of a state, and the actor features it was computed from.
+    """
+    value = 0
+    for cell in state.layout.food:
+        value ^= KEYS.get(('food',) + cell)
+    for cell in state.layout.cherries:
+        value ^= KEYS.get(('cherry',) + cell)
+    features = get_actor_features(state)
+    for feature in features:
+        if feature is not None:
+            value ^= KEYS.get(feature)
+    return value, features
+
+
+def update_hash(value: int, previous: List[Optional[Feature]], state) -> Tuple[int, List[Optional[Feature]]]:
+    """
+    Hash of the state given the hash of its previous actor features: only the actors that changed are rehashed.
+    """
+    features = get_actor_features(state)
+    for old, new in zip(previous, features):
+        if old != new:
+            if old is not None:
+                value ^= KEYS.get(old)
+            if new is not None:
+                value ^= KEYS.get(new)
+    return value, features
+
+
+class TableEntry(NamedTuple):
+    key: int
+    depth: int
+    value: float
+    bound: int  # EXACT, LOWER_BOUND or UPPER_BOUND
+    move: Optional[Tuple[int, int]]
+    generation: int
+
+
+class TranspositionTable(object):
+    """
+    Fixed-size cache of search results indexed by state hash, for the search agents.
+
+    Each hash has a single slot (hash modulo size). A slot is overwritten by a result of the same state, by a result of a
+    search at least as deep, or when its entry comes from an older search (see `new_search`), so the table never grows
+    and keeps the most useful entries of the current move.
+    """
+
+    def __init__(self, size: int = DEFAULT_TABLE_SIZE):
+        self.size = size
+        self.slots: List[Optional[TableEntry]] = [None] * size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.filled = 0
+
+    def __len__(self):
+        return self.filled
+
+    def new_search(self):
+        """
+        Mark the current entries as old, so they are the first to be replaced by the next search.
+        """
+        self.generation += 1
+
+    def clear(self):
+        self.slots = [None] * self.size
+        self.filled = 0
+
+    def lookup(self, key: int) -> Optional[TableEntry]:
+        entry = self.slots[key % self.size]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key: int, depth: int, value: float, bound: int = EXACT, move: Optional[Tuple[int, int]] = None):
+        index = key % self.size
+        entry = self.slots[index]
+        if entry is None:
+            self.filled += 1
+        elif entry.key != key and entry.generation == self.generation and entry.depth > depth:
+            return
+        self.slots[index] = TableEntry(key, depth, value, bound, move, self.generation)
+
+    def probe(self, key: int, depth: int, alpha: float, beta: float) -> Optional[float]:
+        """
+        Stored value of the state if it was searched at least as deep and is usable within the (alpha, beta) window.
+        """
+        entry = self.lookup(key)
+        if entry is None or entry.depth < depth:
+            return None
+        if entry.bound == EXACT:
+            return entry.value
+        if entry.bound == LOWER_BOUND and entry.value >= beta:
+            return entry.value
+        if entry.bound == UPPER_BOUND and entry.value <= alpha:
+            return entry.value
+        return None
@@ -1,13 +1,21 @@
 import argparse
+import cProfile
+import json
 import logging
+import os
+import pstats
+import sys
 from copy import copy
 import time
 from typing import Dict, Tuple
 
 from libs import add_tuples, sub_tuples, reverse_tuple, BaseClass
 from libs.animations import ANIMATIONS
-from libs.layouts import Layout, manhattan_distance
+from libs.layout_cache import load_layout
+from libs.layouts import CellSet, manhattan_distance
 from libs.pacman_controller import PacmanState
+from libs.replay import ReplayRecorder, load_replay
+from libs.runner import run_games, summarize, collect_trajectories
 from random import choice
 
 logger = logging.getLogger('root')
@@ -15,7 +23,9 @@ handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter('Pacman - %(levelname)s - %(message)s'))
 logger.addHandler(handler)
 
-DELAY_BETWEEN_FRAMES = 0.015  # In seconds. Used to slow down the game for better visualization.
+DELAY_BETWEEN_FRAMES = 0.015  # In seconds. Simulated duration of a frame at speed 1, used to slow down the game for better visualization.
+FRAME_RATE = 60  # Maximum number of rendered frames per second
+MAX_FRAME_TIME = 0.25  # In seconds. Longer frames (a slow agent, the window being moved) are not caught up beyond this
 FRAME_PER_EPOCH = 16  # Number of frames between each game state update. Every 16 frames, agens take a new action, must be identical to the tile size.
 SPRITE_OFFSET = (2, 0)
 SPRITE_SIZE = (16, 16)
@@ -38,10 +48,39 @@ parser.add_argument('-l', '--layout', help='The layout to use', default='layouts
 parser.add_argument('-a', '--agent', help='The agent to use, must be a class in pacman_agents.py', default='RightTurnAgent')
 parser.add_argument('-g', '--ghost-agent', help='If set, uses this agent for all ghosts', default=None)
 parser.add_argument('-C', '--clipping-bug', action='store_true', help='Enable the clipping bug', default=False)
-
+parser.add_argument('-w', '--workers', type=int, help='Play the games in parallel on this number of processes, requires --no-graphics', default=0)
+parser.add_argument('--seed', type=int, help='Seed of the first game, game i uses seed + i', default=None)
+parser.add_argument('--speed', type=float, help='Speed of the game in the window, 1 is 4 turns per second', default=1.0)
+parser.add_argument('--turns-per-frame', type=int, help='Play this number of turns between two rendered frames, as fast as possible, instead of following --speed', default=0)
+parser.add_argument('--max-turns', type=int, help='Stop the games played by the workers after this number of turns, 0 for no limit', default=0)
+parser.add_argument('--remote-pacman', action='store_true', help='Play the pacman agent in a worker process', default=False)
+parser.add_argument('--remote-ghosts', action='store_true', help='Play the ghosts agents in worker processes', default=False)
+parser.add_argument('--move-deadline', type=float, help='Seconds given to the agents played in worker processes for each move, after which a fallback action is played', default=0.1)
+
+parser.add_argument('--profile', action='store_true', help='Print the time spent in each phase of the turns at the end of each game', default=False)
+parser.add_argument('--profile-output', help='Write the time spent in each phase of the turns of each game to this JSON file', default=None)
+parser.add_argument('--cprofile', action='store_true', help='Run the games under cProfile and print the slowest functions', default=False)
+parser.add_argument('--record', help='Record the games to this replay file, numbered when there are several games', default=None)
+parser.add_argument('--replay', help='Play again the game recorded in this replay file, on the layout given by --layout', default=None)
+parser.add_argument('--trajectories', help='Save the observation, action, reward and done of every turn to this dataset directory, requires --no-graphics', default=None)
 parser.add_argument('--log-level', help='The log level to use: DEBUG, INFO, WARNING, ERROR, CRITICAL', default='INFO')
 # parser.add_argument('-K', '--keyboard', action='store_true', help='Use the keyboard to control Pacman', default=False)
 args = parser.parse_args()
+if args.workers and not args.no_graphics:
+    parser.error('--workers requires --no-graphics')
+if args.workers and (args.record or args.replay):
+    parser.error('--record and --replay can\'t be used with --workers')
+if args.trajectories and (not args.no_graphics or args.workers or args.replay):
+    parser.error('--trajectories requires --no-graphics, without --workers nor --replay')
+if args.record and args.replay:
+    parser.error('--record and --replay can\'t be used together')
+if args.speed <= 0 or args.turns_per_frame < 0:
+    parser.error('--speed must be positive and --turns-per-frame can\'t be negative')
+if (args.remote_pacman or args.remote_ghosts) and (args.workers or args.trajectories):
+    parser.error('--remote-pacman and --remote-ghosts can\'t be used with --workers nor --trajectories')
+if args.move_deadline <= 0:
+    parser.error('--move-deadline must be positive')
+remote_actors = [actor for actor, remote in (('pacman', args.remote_pacman), ('ghosts', args.remote_ghosts)) if remote]
 
 logger.setLevel(args.log_level)
 
@@ -80,21 +119,34 @@ class App(BaseClass):
     ghost_positions: Dict[str, Tuple[int, int]] = {}
     game_state: PacmanState
     frame = 0
+    finished = False  # Set when the game is over, no more frames are simulated
     last_pacman_direction = None
 
-    def __init__(self):
+    def __init__(self, index: int = 0):
         logging.info(f"Starting a new game")
         logging.info(f"Using layout {args.layout}")
         with open(args.layout, 'r') as f:
             layout_content = f.read()
 
-        logging.info(f"Using agent {args.agent}")
-        self.game_state = PacmanState(
-            Layout(layout_content),
-            pacman_agent=args.agent,
-            clipping_bug=args.clipping_bug,
-            ghost_agent=args.ghost_agent
-        )
+        self.replay = load_replay(args.replay) if args.replay else None
+        if self.replay is not None:
+            logging.info(f"Replaying {self.replay.turns} turns of {self.replay.pacman_agent} from {args.replay}")
+            self.game_state = self.replay.create_state(layout_content)
+        else:
+            logging.info(f"Using agent {args.agent}")
+            self.game_state = PacmanState(
+                load_layout(layout_content),
+                pacman_agent=args.agent,
+                clipping_bug=args.clipping_bug,
+                ghost_agent=args.ghost_agent,
+                seed=args.seed + index if args.seed is not None else None,
+                remote=remote_actors,
+                move_deadline=args.move_deadline
+            )
+            logging.info(f"Using seed {self.game_state.seed}")
+        self.recorder = ReplayRecorder(self.game_state, layout_content, args.ghost_agent) if args.record else None
+        if args.profile or args.profile_output:
+            self.game_state.enable_profiling()
 
         if run_pygame:
             pygame.init()
@@ -105,6 +157,13 @@ class App(BaseClass):
             self._pacman_sprites = pygame.image.load('sprites/pacman.png')
             self._font = pygame.font.SysFont('arial', 16)
             self._pacman_sprites.set_colorkey((0, 0, 0))
+            self._static_layer = self.render_static_layer()
+            self._board = self._static_layer.copy()  # Static layer with the remaining food and cherries
+            self._drawn_food = self._drawn_cherries = 0  # Bits of the CellSets drawn on the board
+            self._actor_rects = []  # Rectangles of the display where the actors were drawn during the last frame
+            self._hud_rect = pygame.Rect(0, self.layout_size[1] * SPRITE_SIZE[1], self.size[0], self.size[1] - self.layout_size[1] * SPRITE_SIZE[1])
+            self._hud_text = None
+            self._first_frame = True
 
         self._running = True
         self.pacman_position = self.game_state.pacman.position.coordinates[0] * SPRITE_SIZE[0], self.game_state.pacman.position.coordinates[1] * SPRITE_SIZE[1]
@@ -141,6 +200,7 @@ class App(BaseClass):
         """
             Called when the game is over
         """
+        self.finished = True
         if run_pygame:
             pygame.event.post(pygame.event.Event(pygame.locals.QUIT))
         else:
@@ -159,7 +219,13 @@ class App(BaseClass):
             self.pacman_position = self.game_state.pacman.position.coordinates[0] * SPRITE_SIZE[0], self.game_state.pacman.position.coordinates[1] * SPRITE_SIZE[1]
             for index, name in enumerate(self.game_state.ghosts):
                 self.ghost_positions[name] = self.game_state.ghosts[name].position.coordinates[0] * SPRITE_SIZE[0], self.game_state.ghosts[name].position.coordinates[1] * SPRITE_SIZE[1]
-            over = self.game_state.update(with_pacman=True, keyboard_input=keyboard_input)
+            if self.replay is not None:
+                turn = self.game_state.turn
+                over = self.replay.play_turn(self.game_state, turn) if turn < self.replay.turns else True
+            else:
+                over = self.game_state.update(with_pacman=True, keyboard_input=keyboard_input)
+                if self.recorder is not None:
+                    self.recorder.record(self.game_state)
             if over:
                 self.game_over()
 
@@ -200,23 +266,59 @@ class App(BaseClass):
 
     def on_render(self):
         """
-        Called every frame when pygame is enabled, to render the game state on the screen
+        Called every frame when pygame is enabled, to render the game state on the screen.
+
+        Only the parts of the window that changed are drawn again: the cells where food was eaten, the actors at their
+        previous and new positions, and the score when it changed.
         """
-        self._display_surf.blit(self._background, (0, 0))
-        self.render_layout()
+        dirty_rects = self.render_layout()
+        for rect in self._actor_rects:
+            self._display_surf.blit(self._board, rect, rect)
+        dirty_rects += self._actor_rects
+        self._actor_rects = []
+        if self._first_frame:
+            self._display_surf.blit(self._board, (0, 0))
+        dirty_rects += self.render_score_and_distances()
+        self.render_pacman()
         self.render_ghosts()
-        self.render_score_and_distances()
-        pygame.display.flip()
+        dirty_rects += self._actor_rects
+        if self._first_frame:
+            pygame.display.flip()
+            self._first_frame = False
+        else:
+            pygame.display.update(dirty_rects)
 
-    def render_layout(self):
+    def render_static_layer(self):
+        """
+        Background and walls, drawn once per game.
+        """
+        surface = pygame.Surface(self.size).convert()
+        surface.blit(self._background, (0, 0))
         for wall in self.game_state.layout.walls:
-            self._display_surf.blit(self._pacman_sprites, (wall[0] * SPRITE_SIZE[0], wall[1] * SPRITE_SIZE[1]), self.get_sprite_coordinates((12, 2)))
-        for food in self.game_state.layout.food:
-            self._display_surf.blit(self._pacman_sprites, (food[0] * SPRITE_SIZE[0], food[1] * SPRITE_SIZE[1]), self.get_sprite_coordinates((12, 3)))
-        for cherry in self.game_state.layout.cherries:
-            self._display_surf.blit(self._pacman_sprites, (cherry[0] * SPRITE_SIZE[0], cherry[1] * SPRITE_SIZE[1]), self.get_sprite_coordinates((2, 3)))
+            surface.blit(self._pacman_sprites, (wall[0] * SPRITE_SIZE[0], wall[1] * SPRITE_SIZE[1]), self.get_sprite_coordinates((12, 2)))
+        return surface
 
-        self._display_surf.blit(self._pacman_sprites, self.pacman_position, self.get_pacman_sprite())
+    def render_layout(self):
+        """
+        Erase the food and cherries eaten since the last frame from the board (and draw new ones, on the first frame).
+        Returns the rectangles of the display that changed.
+        """
+        layout = self.game_state.layout
+        if layout.food.bits == self._drawn_food and layout.cherries.bits == self._drawn_cherries:
+            return []
+        rects = []
+        for cells, drawn, sprite in ((layout.food, self._drawn_food, (12, 3)), (layout.cherries, self._drawn_cherries, (2, 3))):
+            changed = CellSet(cells.width, cells.height)
+            changed.bits = cells.bits ^ drawn
+            for cell in changed:
+                rect = pygame.Rect(cell[0] * SPRITE_SIZE[0], cell[1] * SPRITE_SIZE[1], SPRITE_SIZE[0], SPRITE_SIZE[1])
+                self._board.blit(self._static_layer, rect, rect)
+                if cell in cells:
+                    self._board.blit(self._pacman_sprites, rect, self.get_sprite_coordinates(sprite))
+                self._display_surf.blit(self._board, rect, rect)
+                rects.append(rect)
+        self._drawn_food, self._drawn_cherries = layout.food.bits, layout.cherries.bits
+        return rects
 
     def render_ghosts(self):
         for index, name in enumerate(self.ghost_positions):
@@ -227,12 +329,21 @@ class App(BaseClass):
             if self.game_state.ghosts[name].dead:
                 status = f"ghost_dead_{direction}"
             self.check_ghost_in_portal(name, status)
-            self._display_surf.blit(self._pacman_sprites, self.ghost_positions[name], self.get_ghost_sprite(name, status))
+            self._actor_rects.append(self._display_surf.blit(self._pacman_sprites, self.ghost_positions[name], self.get_ghost_sprite(name, status)))
 
     def render_pacman(self):
-        self._display_surf.blit(self._pacman_sprites, self.pacman_position, self.get_pacman_sprite())
+        self._actor_rects.append(self._display_surf.blit(self._pacman_sprites, self.pacman_position, self.get_pacman_sprite()))
 
     def render_score_and_distances(self):
+        """
+        Draw the score and the distances below the maze when they changed. Returns the rectangles of the display that
+        changed.
+        """
+        distances = tuple(manhattan_distance(ghost.position.coordinates, self.game_state.pacman.position.coordinates) for ghost in self.game_state.ghosts.values())
+        if (self.game_state.score, distances) == self._hud_text:
+            return []
+        self._hud_text = self.game_state.score, distances
+        self._display_surf.blit(self._board, self._hud_rect, self._hud_rect)
         score = self._font.render(f"Score: {self.game_state.score}", True, (255, 255, 255))
         self._display_surf.blit(score, (SPRITE_SIZE[0], self.layout_size[1] * SPRITE_SIZE[1]))
         distances = self._font.render(f"Distances:", True, (255, 255, 255))
@@ -243,57 +354,171 @@ class App(BaseClass):
                 True, DISPLAY_COLORS[ghost])
             self._display_surf.blit(d_ghost,
                                     (SPRITE_SIZE[0], self.layout_size[1] * SPRITE_SIZE[1] + SPRITE_SIZE[1] * (index + 2)))
+        return [self._hud_rect]
 
     def check_ghost_in_portal(self, ghost_name, status):
         """
         Check if a ghost is in a portal, and if so, starts to draw it at the other side of the portal
         """
-        for portal in self.game_state.layout.portals:
-            if self.game_state.ghosts[ghost_name].position.coordinates in self.game_state.layout.portals[portal]:
-                source_portal = self.game_state.layout.portals[portal][0] if self.game_state.ghosts[ghost_name].position.coordinates == self.game_state.layout.portals[portal][1] else self.game_state.layout.portals[portal][1]
-                source_portal = (source_portal[0] * SPRITE_SIZE[0], source_portal[1] * SPRITE_SIZE[1])
-                source_portal = add_tuples(source_portal, (self.game_state.ghosts[ghost_name].position.direction[0] * SPRITE_SIZE[0], self.game_state.ghosts[ghost_name].position.direction[1] * SPRITE_SIZE[1]))
-                ghost_position = self.game_state.ghosts[ghost_name].position.coordinates[0] * SPRITE_SIZE[0], self.game_state.ghosts[ghost_name].position.coordinates[1] * SPRITE_SIZE[1]
-                ghost_offset = reverse_tuple(sub_tuples(self.ghost_positions[ghost_name], ghost_position))
+        ghost = self.game_state.ghosts[ghost_name]
+        partner = self.game_state.layout.get_portal_partner(ghost.position.coordinates)
+        if partner is not None:
+            source_portal = (partner[0] * SPRITE_SIZE[0], partner[1] * SPRITE_SIZE[1])
+            source_portal = add_tuples(source_portal, (ghost.position.direction[0] * SPRITE_SIZE[0], ghost.position.direction[1] * SPRITE_SIZE[1]))
+            ghost_position = ghost.position.coordinates[0] * SPRITE_SIZE[0], ghost.position.coordinates[1] * SPRITE_SIZE[1]
+            ghost_offset = reverse_tuple(sub_tuples(self.ghost_positions[ghost_name], ghost_position))
 
-                self._display_surf.blit(self._pacman_sprites, sub_tuples(source_portal, ghost_offset), self.get_ghost_sprite(ghost_name, status))
+            self._actor_rects.append(self._display_surf.blit(self._pacman_sprites, sub_tuples(source_portal, ghost_offset), self.get_ghost_sprite(ghost_name, status)))
 
     def check_pacman_in_portal(self):
         """
         Check if pacman is in a portal, and if so, starts to draw it at the other side of the portal
         """
-        for portal in self.game_state.layout.portals:
-            if self.game_state.pacman.position.coordinates in self.game_state.layout.portals[portal]:
-                source_portal = self.game_state.layout.portals[portal][0] if self.game_state.pacman.position.coordinates == self.game_state.layout.portals[portal][1] else self.game_state.layout.portals[portal][1]
-                source_portal = (source_portal[0] * SPRITE_SIZE[0], source_portal[1] * SPRITE_SIZE[1])
-                source_portal = add_tuples(source_portal, (self.game_state.pacman.position.direction[0] * SPRITE_SIZE[0], self.game_state.pacman.position.direction[1] * SPRITE_SIZE[1]))
-                pacman_position = self.game_state.pacman.position.coordinates[0] * SPRITE_SIZE[0], self.game_state.pacman.position.coordinates[1] * SPRITE_SIZE[1]
-                pacman_offset = reverse_tuple(sub_tuples(self.pacman_position, pacman_position))
-                self._display_surf.blit(self._pacman_sprites, sub_tuples(source_portal, pacman_offset), self.get_pacman_sprite())
+        pacman = self.game_state.pacman
+        partner = self.game_state.layout.get_portal_partner(pacman.position.coordinates)
+        if partner is not None:
+            source_portal = (partner[0] * SPRITE_SIZE[0], partner[1] * SPRITE_SIZE[1])
+            source_portal = add_tuples(source_portal, (pacman.position.direction[0] * SPRITE_SIZE[0], pacman.position.direction[1] * SPRITE_SIZE[1]))
+            pacman_position = pacman.position.coordinates[0] * SPRITE_SIZE[0], pacman.position.coordinates[1] * SPRITE_SIZE[1]
+            pacman_offset = reverse_tuple(sub_tuples(self.pacman_position, pacman_position))
+            self._actor_rects.append(self._display_surf.blit(self._pacman_sprites, sub_tuples(source_portal, pacman_offset), self.get_pacman_sprite()))
 
     def on_cleanup(self):
         pygame.quit()
 
+    def get_frames_to_play(self, elapsed: float) -> int:
+        """
+        Number of frames to simulate before rendering the next one, `elapsed` seconds after the previous one.
+
+        The simulation runs at a fixed timestep of DELAY_BETWEEN_FRAMES / speed: the real time is accumulated and
+        consumed one simulated frame at a time, so the speed of the game doesn't depend on how long rendering or the
+        agents take. With --turns-per-frame, whole turns are played between two rendered frames instead.
+        """
+        if args.turns_per_frame:
+            return args.turns_per_frame * FRAME_PER_EPOCH
+        self._time_lag += min(elapsed, MAX_FRAME_TIME) * args.speed
+        frames = int(self._time_lag / DELAY_BETWEEN_FRAMES)
+        self._time_lag -= frames * DELAY_BETWEEN_FRAMES
+        return frames
+
     def start(self):
         """
         Main loop of the game
         """
-        while self._running:
-            if run_pygame:
-                for event in pygame.event.get():
-                    self.on_event(event)
-            self.on_loop()
-            if run_pygame:
-                time.sleep(DELAY_BETWEEN_FRAMES)
-                self.on_render()
-            else:
+        if not run_pygame:
+            while self._running:
+                self.on_loop()
                 self.frame += FRAME_PER_EPOCH
+            return
+
+        clock = pygame.time.Clock()
+        self._time_lag = DELAY_BETWEEN_FRAMES  # The first frame is played at once
+        last_time = time.perf_counter()
+        while self._running:
+            for event in pygame.event.get():
+                self.on_event(event)
+            now = time.perf_counter()
+            for _ in range(self.get_frames_to_play(now - last_time)):
+                if self.finished:
+                    break
+                self.on_loop()
+            last_time = now
+            self.on_render()
+            clock.tick(FRAME_RATE)
 
         if run_pygame:
             self.on_cleanup()
 
 
-if __name__ == "__main__":
+def run_workers():
+    """
+    Play the games on a pool of processes, logging each result as soon as it comes back and the statistics at the end.
+    """
+    with open(args.layout, 'r') as f:
+        layout_content = f.read()
+    logging.info(f"Playing {args.number_of_games} games of {args.agent} on {args.layout} with {args.workers} workers")
+    start_time = time.perf_counter()
+    results = []
+    for result in run_games(layout_content, args.agent, args.ghost_agent, args.clipping_bug, args.number_of_games,
+                            args.workers, seed=args.seed, max_turns=args.max_turns):
+        results.append(result)
+        logging.info(f"Game {result.index} (seed {result.seed}): score {result.score}, {result.turns} turns, "
+                     f"{'win' if result.won else 'loss'} ({result.cause})")
+    print(summarize(results, time.perf_counter() - start_time))
+
+
+def run_trajectories():
+    with open(args.layout, 'r') as f:
+        layout_content = f.read()
+    start_time = time.perf_counter()
+    records = collect_trajectories(layout_content, args.agent, args.ghost_agent, args.clipping_bug, args.number_of_games,
+                                   args.trajectories, seed=args.seed, max_turns=args.max_turns)
+    duration = time.perf_counter() - start_time
+    print(f"{records} turns of {args.number_of_games} games saved to {args.trajectories} "
+          f"in {duration:.1f}s ({records / duration:.0f} turns/s)")
+
+
+def get_record_path(index: int) -> str:
+    if args.number_of_games == 1:
+        return args.record
+    root, extension = os.path.splitext(args.record)
+    return f"{root}-{index}{extension}"
+
+
+def run_replay():
+    """
+    Play the recorded game again without rendering, and check that it ends with the recorded score.
+    """
+    with open(args.layout, 'r') as f:
+        layout_content = f.read()
+    replay = load_replay(args.replay)
+    start_time = time.perf_counter()
+    state = None
+    for state in replay.play(layout_content):
+        pass
+    duration = time.perf_counter() - start_time
+    score = state.score if state is not None else 0
+    print(f"Replayed {replay.turns} turns of {replay.pacman_agent} in {duration * 1000:.1f} ms: score {score}")
+    if score != replay.score:
+        logging.error(f"The replay ended with score {score} instead of the recorded {replay.score}")
+        sys.exit(1)
+
+
+def run_games_in_app():
+    """
+    Play the games one after the other, printing and saving the turn profiles if asked to.
+    """
+    reports = []
     for i in range(args.number_of_games):
-        theApp = App()
+        theApp = App(i)
         theApp.start()
+        if theApp.recorder is not None:
+            theApp.recorder.save(get_record_path(i))
+            logging.info(f"Game recorded to {get_record_path(i)}")
+        profiler = theApp.game_state.profiler
+        if profiler is not None:
+            if args.profile:
+                print(f"Game {i}: {theApp.game_state.turn} turns, score {theApp.game_state.score}")
+                print(profiler.format_table())
+            reports.append(profiler.report())
+    if args.profile_output:
+        with open(args.profile_output, 'w') as f:
+            json.dump({'layout': args.layout, 'agent': args.agent, 'ghost_agent': args.ghost_agent, 'games': reports},
+                      f, indent=2)
+
+
+if __name__ == "__main__":
+    if args.cprofile:
+        profile = cProfile.Profile()
+        profile.enable()
+    if args.workers:
+        run_workers()
+    elif args.replay and args.no_graphics:
+        run_replay()
+    elif args.trajectories:
+        run_trajectories()
+    else:
+        run_games_in_app()
+    if args.cprofile:
+        profile.disable()
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(25)